@@ -0,0 +1,208 @@
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from beancount.core.data import Transaction
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_TAG_BITS = 64
+
+
+class Columns(object):
+    """Columns holds the postings of a ledger's transactions as columnar NumPy arrays,
+    one row per posting, so that reports are computed with vectorized filters and
+    group-bys instead of iterating the entries.
+
+    Columns are never changed in place, :meth:`extend` returns new columns. That way
+    a report can keep using the columns while transactions are appended.
+
+    Attributes:
+        dates (:obj: numpy.ndarray): The transaction's date as ``datetime64[D]``.
+        accounts (:obj: numpy.ndarray): The account's id, see :attr:`account_names`.
+        amounts (:obj: numpy.ndarray): The amount in cents.
+        currencies (:obj: numpy.ndarray): The currency's id, see :attr:`currency_names`.
+        tags (:obj: numpy.ndarray): The transaction's tags as bitset, a row of 64 bit
+            words per posting. Bit ``i % 64`` of word ``i // 64`` is tag id ``i``, see
+            :attr:`tag_names`.
+        txns (:obj: numpy.ndarray): The index of the transaction of the posting.
+        account_names (:obj: List[str]): The account of each id.
+        currency_names (:obj: List[str]): The currency of each id.
+        tag_names (:obj: List[str]): The tag of each id.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("Reports require numpy (pip install numpy)")
+        self.dates = np.empty(0, dtype="datetime64[D]")
+        self.accounts = np.empty(0, dtype=np.int32)
+        self.amounts = np.empty(0, dtype=np.int64)
+        self.currencies = np.empty(0, dtype=np.int16)
+        self.tags = np.zeros((0, 1), dtype=np.uint64)
+        self.txns = np.empty(0, dtype=np.int64)
+        self.account_names: List[str] = []
+        self.currency_names: List[str] = []
+        self.tag_names: List[str] = []
+        self._ids: Dict[str, Dict[str, int]] = {"account": {}, "currency": {}, "tag": {}}
+        self._count = 0
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def extend(self, entries: Iterable) -> "Columns":
+        """Get new columns with the postings of the transactions among entries added.
+        Postings without units are skipped, beancount fills them in while loading."""
+        c = Columns.__new__(Columns)
+        c.account_names = list(self.account_names)
+        c.currency_names = list(self.currency_names)
+        c.tag_names = list(self.tag_names)
+        c._ids = {k: dict(v) for k, v in self._ids.items()}
+        c._count = self._count
+
+        dates: List[int] = []
+        accounts: List[int] = []
+        amounts: List[int] = []
+        currencies: List[int] = []
+        tags: List[int] = []
+        txns: List[int] = []
+        for e in entries:
+            if type(e) is not Transaction:
+                continue
+            bits = 0
+            for t in e.tags or ():
+                bits |= 1 << c._id("tag", t, c.tag_names)
+            day = e.date.toordinal()
+            for p in e.postings:
+                if p.units is None or not isinstance(p.units.number, Decimal):
+                    continue
+                dates.append(day)
+                accounts.append(c._id("account", p.account, c.account_names))
+                amounts.append(int(round(p.units.number * 100)))
+                currencies.append(c._id("currency", p.units.currency, c.currency_names))
+                tags.append(bits)
+                txns.append(c._count)
+            c._count += 1
+
+        words = max(1, -(-len(c.tag_names) // _TAG_BITS))
+        new_tags = np.zeros((len(tags), words), dtype=np.uint64)
+        mask = (1 << _TAG_BITS) - 1
+        for w in range(words):
+            new_tags[:, w] = [(b >> (w * _TAG_BITS)) & mask for b in tags]
+        old_tags = self.tags
+        if old_tags.shape[1] < words:
+            old_tags = np.pad(old_tags, ((0, 0), (0, words - old_tags.shape[1])))
+
+        # Dates are converted from ordinals, day 1 is 0001-01-01
+        epoch = date(1970, 1, 1).toordinal()
+        new_dates = (np.array(dates, dtype=np.int64) - epoch).astype("datetime64[D]")
+        c.dates = np.concatenate([self.dates, new_dates])
+        c.accounts = np.concatenate([self.accounts, np.array(accounts, dtype=np.int32)])
+        c.amounts = np.concatenate([self.amounts, np.array(amounts, dtype=np.int64)])
+        c.currencies = np.concatenate(
+            [self.currencies, np.array(currencies, dtype=np.int16)]
+        )
+        c.tags = np.concatenate([old_tags, new_tags])
+        c.txns = np.concatenate([self.txns, np.array(txns, dtype=np.int64)])
+        return c
+
+    def select(
+        self,
+        account: Optional[str] = None,
+        prefix: Optional[str] = None,
+        currency: Optional[str] = None,
+        tag: Optional[str] = None,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+    ):
+        """Get a boolean mask of the postings matching all given conditions.
+
+        Args:
+            account (:obj: str [optional]): Only postings of transactions with a posting on this account.
+            prefix (:obj: str [optional]): Only postings on accounts starting with the prefix.
+            currency (:obj: str [optional]): Only postings in this currency.
+            tag (:obj: str [optional]): Only postings of transactions with this tag, without ``#``.
+            start (:obj: datetime.date [optional]): Only postings on or after this date.
+            end (:obj: datetime.date [optional]): Only postings before this date.
+
+        Returns:
+            numpy.ndarray: The mask, True for each matching posting.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if prefix is not None:
+            matching = np.array(
+                [a.startswith(prefix) for a in self.account_names], dtype=bool
+            )
+            mask &= matching[self.accounts]
+        if currency is not None:
+            mask &= self.currencies == self._ids["currency"].get(currency, -1)
+        if account is not None:
+            id = self._ids["account"].get(account, -1)
+            has = np.zeros(self._count, dtype=bool)
+            has[self.txns[self.accounts == id]] = True
+            mask &= has[self.txns]
+        if tag is not None:
+            id = self._ids["tag"].get(tag)
+            if id is None:
+                return np.zeros(len(self), dtype=bool)
+            bit = np.uint64(1 << (id % _TAG_BITS))
+            mask &= (self.tags[:, id // _TAG_BITS] & bit) != 0
+        if start is not None:
+            mask &= self.dates >= np.datetime64(start, "D")
+        if end is not None:
+            mask &= self.dates < np.datetime64(end, "D")
+        return mask
+
+    def total(self, mask) -> int:
+        """Get the sum of the selected postings' amounts in cents."""
+        return int(self.amounts[mask].sum())
+
+    def by_month(self, mask) -> List[Tuple[date, int]]:
+        """Sum the selected postings' amounts per month.
+
+        Returns:
+            The first day of each month with postings and the month's sum in cents, by date.
+        """
+        months = self.dates[mask].astype("datetime64[M]")
+        keys, inverse = np.unique(months, return_inverse=True)
+        sums = _sum_by(inverse, self.amounts[mask], len(keys))
+        return list(zip(keys.astype("datetime64[D]").tolist(), sums))
+
+    def by_account(self, mask, prefix: str = "", depth: int = 0) -> List[Tuple[str, int]]:
+        """Sum the selected postings' amounts per account.
+
+        Args:
+            mask (:obj: numpy.ndarray): The postings to sum, see :meth:`select`.
+            prefix (:obj: str [optional]): The prefix stripped from the accounts.
+            depth (:obj: int [optional]): Sum accounts by their first ``depth`` components
+                after the prefix, 0 doesn't group accounts.
+
+        Returns:
+            The accounts and their sum in cents, the largest first.
+        """
+        names = [a[len(prefix) :] if a.startswith(prefix) else a for a in self.account_names]
+        if depth > 0:
+            names = [":".join(n.split(":")[:depth]) for n in names]
+        groups = sorted(set(names))
+        index = {g: i for i, g in enumerate(groups)}
+        group_of = np.array([index[n] for n in names], dtype=np.int64)
+        sums = _sum_by(group_of[self.accounts[mask]], self.amounts[mask], len(groups))
+        result = [(g, s) for g, s in zip(groups, sums) if s]
+        return sorted(result, key=lambda r: -r[1])
+
+    def _id(self, kind: str, name: str, names: List[str]) -> int:
+        ids = self._ids[kind]
+        id = ids.get(name)
+        if id is None:
+            id = ids[name] = len(names)
+            names.append(name)
+        return id
+
+
+def _sum_by(keys, amounts, n: int) -> List[int]:
+    """Sum amounts per key, keys are integers from 0 to n - 1. Sums are exact as long
+    as they stay below 2**53 cents."""
+    sums = np.bincount(keys, weights=amounts, minlength=n)
+    return [int(s) for s in np.rint(sums)]
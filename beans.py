@@ -1,19 +1,30 @@
+import os
 import re
+import threading
+from collections import Counter
 from dataclasses import dataclass, field
 from datetime import date
 from logging import getLogger
 from os import makedirs
-from os.path import dirname, exists, join
-from typing import Dict, List
+from os.path import abspath, dirname, exists, join
+from typing import Dict, List, Optional, Tuple
 
 from beancount import loader
+from beancount.core.account import ACCOUNT_RE
+from beancount.core.amount import CURRENCY_RE
+from beancount.core.data import Balance, Close
 from beancount.core.data import Open as Account
+from beancount.core.data import Transaction as Entry
 from beancount.core.inventory import Inventory
 from beancount.ops import validation
-from beancount.query.query import run_query
+from beancount.parser import booking, parser
 from beancount.scripts.format import align_beancount
 
+import analytics
 import config
+import ledger
+import metrics
+import suggest
 
 
 class Error(Exception):
@@ -73,8 +84,7 @@ class Transaction:
         if self.amount < 0:
             raise ValueError("Amount cannot be negative")
 
-        self.tags.append("#bot")
-        tagstr = " ".join(self.tags)
+        tagstr = " ".join(self.tags + ["#bot"])
 
         # Our debit account is often an Expense account w/o prefix
         accts = get_accounts()
@@ -93,42 +103,211 @@ class Transaction:
         return tx
 
 
-def get_expense_accounts() -> List[str]:
-    """Get all expense accounts. The accounts are sorted and will be stripped of the expense prefix.
+@dataclass
+class AccountNode:
+    """A node in the tree of accounts. Each node represents one component of an
+    account name, e.g. ``Expenses:Food:Coffee`` is represented by the nodes ``Food``
+    and ``Coffee`` below the ``Expenses`` node.
+
+    Attributes:
+        account (:obj: str): The full account name of the node.
+        children (:obj: Dict[str, AccountNode]): The child nodes, keyed by their name component.
+        options (:obj: List[str]): The sorted names of the children.
+        leaf (:obj: bool): The node is an opened account, i.e. an account selection may end here.
+        open_date (:obj: date): The date on which the account was opened.
+        close_date (:obj: date): The date on which the account was closed, if it was.
+        currencies (:obj: List[str]): The currencies the account is constrained to, if any.
+    """
+
+    account: str = ""
+    children: Dict[str, "AccountNode"] = field(default_factory=lambda: {})
+    options: List[str] = field(default_factory=lambda: [])
+    leaf: bool = False
+    open_date: Optional[date] = None
+    close_date: Optional[date] = None
+    currencies: List[str] = field(default_factory=lambda: [])
+
+    def find(self, path: str) -> Optional["AccountNode"]:
+        """Find the node for a path relative to this node. The empty path returns the node itself.
+
+        Args:
+            path (:obj: str): The account path relative to this node, e.g. ``Food:Coffee``.
+
+        Returns:
+            The node if it exists, otherwise None.
+        """
+        node: Optional[AccountNode] = self
+        for name in path.split(":") if path else []:
+            node = node.children.get(name)  # type: ignore
+            if not node:
+                return None
+        return node
+
+
+def get_account_tree(check: bool = True) -> AccountNode:
+    """Get the tree of all accounts. The tree is only built once per ledger version.
+
+    Args:
+        check (:obj: bool): Check the ledger files for changes first. If False, the tree of the
+            last loaded ledger is used without touching the files.
 
     Returns:
-        List[str]: List of expense accounts, stripped of expense prefix.
+        AccountNode: The root node, its children are the top level accounts, e.g. ``Assets``.
 
     Raises:
         LoadError: Error occurred while loading beancount files.
         Error: Some other error while loading the accounting data.
     """
+    if check or not cache.loaded:
+        _load_checked()
+    return cache.derived("account_tree", _build_account_tree, _keep_for_transactions)
 
-    entries, errors, options_map = load()
-    if errors:
-        getLogger("beans").exception(
-            f"Can't parse beancount data: errors present: {errors}"
-        )
-        ts = [type(e) for e in errors]
-        if loader.LoadError in ts:
-            es = [e.message for e in errors if e is loader.LoadError]
-            raise LoadError("Error while opening beancount file: " + ": ".join(es))
+
+def get_expense_tree(check: bool = True) -> AccountNode:
+    """Get the tree of expense accounts. See :func:`get_account_tree`.
+
+    Returns:
+        AccountNode: The expense node, its children are the expense accounts without prefix.
+    """
+    if check or not cache.loaded:
+        _load_checked()
+    return cache.derived("expense_tree", _build_expense_tree, _keep_for_transactions)
+
+
+def _build_expense_tree(result) -> AccountNode:
+    _, _, options_map = result
+    tree = cache.derived("account_tree", _build_account_tree, _keep_for_transactions)
+    return tree.find(options_map["name_expenses"]) or AccountNode()
+
+
+def _build_account_tree(result) -> AccountNode:
+    entries, _, _ = result
+    root = AccountNode()
+    for e in entries:
+        if type(e) is not Account and type(e) is not Close:
+            continue
+        node = root
+        for name in e.account.split(":"):
+            if name not in node.children:
+                node.children[name] = AccountNode(
+                    account=f"{node.account}:{name}" if node.account else name
+                )
+            node = node.children[name]
+        if type(e) is Account:
+            node.leaf = True
+            node.open_date = e.date
+            node.currencies = e.currencies or []
         else:
-            raise Error("Error while opening beancount file.")
+            node.close_date = e.date
 
-    # Expense prefix is usually Expenses:, but might be something else throught the options
-    prefix = options_map["name_expenses"] + ":"
-    # Filter for expense accounts and strip the prefix
-    accounts = [
-        e.account.split(prefix)[1]
-        for e in entries
-        if type(e) is Account and e.account.startswith(prefix)
-    ]
-    return sorted(accounts)
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        node.options = sorted(node.children)
+        nodes.extend(node.children.values())
+    return root
+
+
+def suggest_accounts(narration: str, account: str, k: int = 3) -> List[str]:
+    """Suggest expense accounts for a narration, based on the ledger's transactions
+    that used the same account with a similar narration. The index is built once per
+    ledger and updated with appended transactions.
+
+    Args:
+        narration (:obj: str): The narration of the new transaction.
+        account (:obj: str): The account the transactions must have a posting on, usually the user's account.
+        k (:obj: int): The maximum number of suggestions.
+
+    Returns:
+        List[str]: The suggested expense accounts, stripped of the expense prefix.
+
+    Raises:
+        LoadError: Error occurred while loading beancount files.
+        Error: Some other error while loading the accounting data.
+    """
+    if not cache.loaded:
+        _load_checked()
+    index = cache.derived(
+        f"suggestions:{account}",
+        lambda result: _update_suggestions(
+            _Suggestions(account, result[2]["name_expenses"] + ":"), result[0]
+        ),
+        _update_suggestions,
+    )
+    return index.suggest(narration, k)
+
+
+class _Suggestions(suggest.SuggestionIndex):
+    """A suggestion index for the transactions on one account."""
+
+    def __init__(self, account: str, prefix: str):
+        super().__init__()
+        self.account = account
+        self.prefix = prefix
+
+
+def _update_suggestions(index: _Suggestions, new: List) -> _Suggestions:
+    """Add the expense postings of new transactions on the index's account."""
+    for e in new:
+        if type(e) is not Entry or not e.narration:
+            continue
+        accounts = [p.account for p in e.postings]
+        if index.account not in accounts:
+            continue
+        for a in accounts:
+            if a.startswith(index.prefix):
+                index.add(e.narration, a[len(index.prefix) :], e.date)
+    return index
+
+
+def get_columns() -> analytics.Columns:
+    """Get the postings of the ledger's transactions as columns for reports. The
+    columns are built once per ledger and extended with appended transactions.
+
+    Raises:
+        LoadError: Error occurred while loading beancount files.
+        Error: Some other error while loading the accounting data.
+        ImportError: numpy is not installed.
+    """
+    _load_checked()
+    return cache.derived(
+        "columns",
+        lambda result: analytics.Columns().extend(result[0]),
+        lambda columns, new: columns.extend(new),
+    )
+
+
+def get_expense_prefix() -> str:
+    """Get the prefix of expense accounts, usually ``Expenses:``.
+
+    Raises:
+        LoadError: Error occurred while loading beancount files.
+        Error: Some other error while loading the accounting data.
+    """
+    _, _, options_map = _load_checked()
+    return options_map["name_expenses"] + ":"
+
+
+def get_expense_accounts() -> List[str]:
+    """Get all expense accounts. The accounts are sorted and will be stripped of the expense prefix.
+    The list is built once per ledger version from the account tree and must not be modified.
+
+    Returns:
+        List[str]: List of expense accounts, stripped of expense prefix.
+
+    Raises:
+        LoadError: Error occurred while loading beancount files.
+        Error: Some other error while loading the accounting data.
+    """
+    _load_checked()
+    return cache.derived(
+        "expense_accounts", _build_expense_accounts, _keep_for_transactions
+    )
 
 
 def get_accounts() -> List[str]:
-    """Get all accounts that exist. The accounts are sorted.
+    """Get all accounts that exist. The accounts are sorted. The list is built once per
+    ledger version from the account tree and must not be modified.
 
     Returns:
         List[str]: List of accounts.
@@ -137,20 +316,31 @@ def get_accounts() -> List[str]:
         LoadError: Error occurred while loading beancount files.
         Error: Some other error while loading the accounting data.
     """
-    entries, errors, _ = load()
-    if errors:
-        getLogger("beans").exception(
-            f"Can't parse beancount data: errors present: {errors}"
-        )
-        ts = [type(e) for e in errors]
-        if loader.LoadError in ts:
-            es = [e.message for e in errors if e is loader.LoadError]
-            raise LoadError("Error while opening beancount file: " + ": ".join(es))
-        else:
-            raise Error("Error while opening beancount file.")
+    _load_checked()
+    return cache.derived("accounts", _build_accounts, _keep_for_transactions)
+
+
+def _build_expense_accounts(result) -> List[str]:
+    tree = cache.derived("expense_tree", _build_expense_tree, _keep_for_transactions)
+    # Expense prefix is usually Expenses:, but might be something else throught the options
+    prefix = len(tree.account) + 1
+    return [a[prefix:] for a in _leaves(tree)]
+
 
-    # Filter for Accounts
-    accounts = [e.account for e in entries if type(e) is Account]
+def _build_accounts(result) -> List[str]:
+    tree = cache.derived("account_tree", _build_account_tree, _keep_for_transactions)
+    return _leaves(tree)
+
+
+def _leaves(tree: AccountNode) -> List[str]:
+    """Get the sorted accounts below the root of a tree that have been opened."""
+    accounts = []
+    nodes = list(tree.children.values())
+    while nodes:
+        node = nodes.pop()
+        if node.leaf:
+            accounts.append(node.account)
+        nodes.extend(node.children.values())
     return sorted(accounts)
 
 
@@ -172,23 +362,211 @@ def append_tx(tx: Transaction, fname: str) -> Dict:
     """
     if not tx:
         raise ValueError("Transaction cannot be empty")
+    return append_txs([tx], fname)[0]
+
+
+@metrics.registry.timed("beans.append")
+def append_txs(txs: List[Transaction], fname: str) -> List[Dict]:
+    """Append several transactions to a beancount file at once. The transactions are
+    validated together and written with a single write, if one of them is invalid,
+    none of them is appended.
+
+    Args:
+        txs (:obj: List[Transaction]): The transactions to append.
+        fname (:obj: str): The relative path (from your beancount folder) to the file used.
+
+    Returns:
+        The balances of both accounts of each transaction after all transactions are
+        completed, see :func:`append_tx`.
+
+    Raises:
+        ValueError: A function parameter is not valid.
+    """
+    if not txs:
+        raise ValueError("Transactions cannot be empty")
     if not fname:
         raise ValueError("File must be specified")
 
-    data = ""
-    old = ""
     fname = join(config.bean_path, fname)
     if not exists(dirname(fname)):
-        makedirs(dirname(fname), 0o755)
+        makedirs(dirname(fname), 0o755, exist_ok=True)
+
+    text = "".join(tx.print() + "\n" for tx in txs)
+    with _file_lock(fname):
+        result = None
+        if not config.bean_align_file:
+            result = _append_incremental(text, fname)
+        if result is None:
+            getLogger("beans").debug(f"Incremental check undecided, reloading {fname}")
+            with cache.writing():
+                _append_full(text, fname)
+
+    # Get balances
+    balances = cache.derived("balances", _build_balances, _update_balances)
+    ds = []
+    for tx in txs:
+        d = {}
+        try:
+            d["credit"] = _format_balance(balances[tx.credit_account])
+            d["debit"] = _format_balance(balances[tx.debit_account])
+        except Exception:
+            d["credit"] = "Could not determine amount"
+            d["debit"] = "Could not determine amount"
+        ds.append(d)
+    return ds
+
+
+_file_locks: Dict[str, threading.Lock] = {}
+_file_locks_lock = threading.Lock()
+
+
+def _file_lock(fname: str) -> threading.Lock:
+    """Get the lock held while appending to a file. Appends to different files may
+    run in parallel, appends to the same file run one after another. Parallel appends
+    only share the cache's write lock while the data is written and added to the
+    cache; appends that reload the ledger hold it throughout."""
+    with _file_locks_lock:
+        return _file_locks.setdefault(abspath(fname), threading.Lock())
+
+
+def _append_incremental(text: str, fname: str):
+    """Validate a transaction against the cached ledger and append it to the file
+    without loading the ledger again.
 
+    Args:
+        text (:obj: str): The printed transaction.
+        fname (:obj: str): The absolute path of the file to append to.
+
+    Returns:
+        The updated ``(entries, options_map)``, or None if the transaction can't be
+        validated incrementally and the ledger has to be reloaded.
+
+    Raises:
+        ValueError: The transaction is invalid.
+    """
+    entries, errors, options_map = load()
+    # Plugins may transform the entries in ways we can't predict
+    if errors or options_map["plugin"]:
+        return None
+    # New files and files not included by the ledger have to be loaded
+    fname = abspath(fname)
+    lines = cache.lines(fname)
+    if lines is None:
+        return None
+
+    text = _align(text, fname)
+    new, errs, _ = parser.parse_string(
+        text, report_filename=fname, report_firstline=lines + 1
+    )
+    if errs:
+        raise ValueError("Data invalid: " + str(errs))
+    new, errs = booking.book(new, options_map)
+    if errs:
+        raise ValueError("Data invalid: " + str(errs))
+    errs = _validate_incremental(new, options_map)
+    if errs is None:
+        return None
+    if errs:
+        raise ValueError("Data invalid: " + str(errs))
+
+    data = text.encode()
+    with cache.writing():
+        # The ledger might have been reloaded since the transaction was parsed
+        if cache.lines(fname) != lines:
+            return None
+        offset = _write_append(fname, data, sync=False)
+        try:
+            cache.append(fname, data, new)
+        except Exception:
+            _truncate(fname, offset)
+            raise
+    # Syncing only needs the file's lock, appends to other files go on meanwhile
+    _sync(fname)
+    return entries, options_map
+
+
+def _validate_incremental(new: List, options_map: Dict) -> Optional[List]:
+    """Validate new entries against the cached ledger. This checks the accounts of
+    all postings, their currency constraints and the balance of the transactions.
+    The hardcore validations only run if configured, otherwise they are left to
+    :func:`validate_deep`.
+
+    Returns:
+        A list of validation errors, or None if a balance assertion after the entries
+        involves one of their accounts and the entries can't be validated without
+        reloading the ledger.
+    """
+    tree = get_account_tree(check=False)
+    balances = cache.derived("balance_dates", _build_balance_dates, _keep_for_transactions)
+    errs: List = []
+    for entry in new:
+        for posting in getattr(entry, "postings", []):
+            node = tree.find(posting.account)
+            if not node or not node.leaf:
+                errs.append(f"Invalid reference to unknown account '{posting.account}'")
+            elif entry.date < node.open_date or (
+                node.close_date and entry.date > node.close_date
+            ):
+                errs.append(f"Invalid reference to inactive account '{posting.account}'")
+            elif node.currencies and posting.units.currency not in node.currencies:
+                errs.append(
+                    f"Invalid currency {posting.units.currency} for account '{posting.account}'"
+                )
+            # Balance assertions on parent accounts include the postings as well
+            parts = posting.account.split(":")
+            for i in range(len(parts)):
+                last = balances.get(":".join(parts[: i + 1]))
+                if last and last > entry.date:
+                    return None
+    errs.extend(validation.validate_check_transaction_balances(new, options_map))
+    if config.bean_validation == "hardcore":
+        errs.extend(_validate_extra(new, options_map))
+    return errs
+
+
+def _append_full(text: str, fname: str):
+    """Append a transaction to the file and reload the ledger to validate it. The
+    file is truncated to its previous size if the ledger is invalid. If
+    ``config.bean_align_file`` is set, the whole file is aligned and rewritten instead.
+
+    Returns:
+        The updated ``(entries, options_map)``.
+
+    Raises:
+        ValueError: The transaction is invalid.
+    """
+    if config.bean_align_file:
+        return _rewrite_full(text, fname)
+
+    offset = _write_append(fname, _align(text, fname).encode())
+    entries, errs, options_map = load()
+
+    # on error cut off the new data
+    if errs:
+        _truncate(fname, offset)
+        raise ValueError("Data invalid: " + str(errs))
+    return entries, options_map
+
+
+def _rewrite_full(text: str, fname: str):
+    """Append a transaction to the file, align the whole file and reload the ledger
+    to validate it. The file is restored if the ledger is invalid.
+
+    Returns:
+        The updated ``(entries, options_map)``.
+
+    Raises:
+        ValueError: The transaction is invalid.
+    """
+    old = ""
     try:
         with open(fname, "r") as file:
             old = file.read()
     except FileNotFoundError:
         pass
 
-    data = old + tx.print()
-    data = align_beancount(data)
+    with metrics.registry.timer("beans.align"):
+        data = align_beancount(old + text)
     with open(fname, "w") as file:
         file.write(data)
     entries, errs, options_map = load()
@@ -198,31 +576,142 @@ def append_tx(tx: Transaction, fname: str) -> Dict:
         with open(fname, "w") as file:
             file.write(old)
         raise ValueError("Data invalid: " + str(errs))
+    return entries, options_map
 
-    # Get balances
-    d = {}
+
+_AMOUNT_RE = re.compile(
+    r'(^\d[^";]*?|\s+{})\s+([-+]?\s*[\d,]+(?:\.\d*)?)\s+({}\b.*)'.format(
+        ACCOUNT_RE, CURRENCY_RE
+    )
+)
+"""Matches lines with an amount, the same way ``align_beancount`` does."""
+
+_COLUMN_SCAN_BYTES = 1 << 16
+"""Number of bytes at the end of a file scanned for the currency column."""
+
+_columns: Dict[str, Tuple[Optional[int], int]] = {}
+"""The currency column of each file, mapped with the file size it was detected at."""
+
+
+def _align(text: str, fname: str) -> str:
+    """Align the amounts of a transaction to the currency column used in the file.
+    If the file has no amounts yet, the transaction is aligned on its own."""
+    column = _currency_column(fname)
+    with metrics.registry.timer("beans.align"):
+        if column:
+            return align_beancount(text, currency_column=column)
+        return align_beancount(text)
+
+
+def _currency_column(fname: str) -> Optional[int]:
+    """Get the currency column used in a file. The column is detected from the end of
+    the file and cached until the file's size changes by something else than
+    :func:`_write_append`.
+
+    Returns:
+        The most frequent column (starting at 1) of currencies, None if there are no amounts.
+    """
     try:
-        _, rows = run_query(
-            entries,
-            options_map,
-            f"BALANCES WHERE account = '{tx.credit_account}'",
-        )
-        i: Inventory = rows[0][1]
-        _, amount = i.popitem()
-        d["credit"] = str(amount)
-
-        _, rows = run_query(
-            entries,
-            options_map,
-            f"BALANCES WHERE account = '{tx.debit_account}'",
-        )
-        i = rows[0][1]
-        _, amount = i.popitem()
-        d["debit"] = str(amount)
-    except Exception:
-        d["credit"] = "Could not determine amount"
-        d["debit"] = "Could not determine amount"
-    return d
+        size = os.stat(fname).st_size
+    except OSError:
+        return None
+    column, at = _columns.get(fname, (None, -1))
+    if at == size:
+        return column
+
+    with open(fname, "rb") as file:
+        file.seek(max(0, size - _COLUMN_SCAN_BYTES))
+        tail = file.read().decode("utf8", errors="ignore")
+    columns = [m.start(3) + 1 for m in map(_AMOUNT_RE.match, tail.splitlines()) if m]
+    column = Counter(columns).most_common(1)[0][0] if columns else None
+    _columns[fname] = (column, size)
+    return column
+
+
+def _write_append(fname: str, data: bytes, sync: bool = True) -> int:
+    """Append data to a file with ``O_APPEND`` and, unless sync is False, sync it to
+    disk. Otherwise :func:`_sync` has to be called afterwards.
+
+    Returns:
+        The size of the file before writing, which can be used to roll back with :func:`_truncate`.
+    """
+    fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        offset = os.fstat(fd).st_size
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    if fname in _columns:
+        _columns[fname] = (_columns[fname][0], offset + len(data))
+    return offset
+
+
+def _sync(fname: str):
+    """Sync a file written by :func:`_write_append` to disk."""
+    fd = os.open(fname, os.O_WRONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _truncate(fname: str, offset: int):
+    """Roll back an append by truncating the file to its previous size."""
+    os.truncate(fname, offset)
+    _columns.pop(fname, None)
+
+
+def _build_balances(result) -> Dict[str, Inventory]:
+    """Map each account to the inventory of its postings, not including its children.
+    This is the same as the ``BALANCES`` BQL query."""
+    entries, _, _ = result
+    return _update_balances({}, entries)
+
+
+def _update_balances(balances: Dict[str, Inventory], new: List) -> Dict[str, Inventory]:
+    """Add the postings of new entries to the running balances."""
+    for e in new:
+        for posting in getattr(e, "postings", []):
+            if posting.account not in balances:
+                balances[posting.account] = Inventory()
+            balances[posting.account].add_position(posting)
+    return balances
+
+
+def _format_balance(inventory: Inventory) -> str:
+    """Format an account's balance, preferring the position in ``config.bean_currency``.
+
+    Raises:
+        KeyError: The inventory is empty.
+    """
+    positions = inventory.get_positions()
+    if not positions:
+        raise KeyError("Inventory is empty")
+    for position in positions:
+        if position.units.currency == config.bean_currency:
+            return str(position)
+    return str(positions[0])
+
+
+def _build_balance_dates(result) -> Dict[str, date]:
+    """Map each account to the date of its last balance assertion."""
+    entries, _, _ = result
+    dates: Dict[str, date] = {}
+    for e in entries:
+        if type(e) is Balance and e.date > dates.get(e.account, e.date.min):
+            dates[e.account] = e.date
+    return dates
+
+
+def _keep_for_transactions(value, new: List):
+    """Keep a derived value when new entries are appended, unless they open or close accounts."""
+    if any(type(e) in (Account, Close, Balance) for e in new):
+        return None
+    return value
 
 
 def format_amount(input: int) -> str:
@@ -231,25 +720,107 @@ def format_amount(input: int) -> str:
 
     Example: ``1195`` is formatted into ``11.95 EUR`` (if your currency string is ``EUR``)
     """
-    s = f"{int(input / 100)}.{input % 100:02} {config.bean_currency}"
+    sign = "-" if input < 0 else ""
+    s = f"{sign}{abs(input) // 100}.{abs(input) % 100:02} {config.bean_currency}"
     return s
 
 
-def load():
-    """Load the beancount file and return its entries, errors and options."""
-    l = getLogger("beancount")
+@metrics.registry.timed("beans.load")
+def _load_file(filename: str):
+    log = getLogger("beancount")
     entries, errors, options_map = loader.load_file(
-        join(config.bean_path, config.bean_main_file),
-        log_timings=l.debug,
-        log_errors=l.error,
-        extra_validations=validation.HARDCORE_VALIDATIONS,
+        filename, log_timings=_log_timings, log_errors=log.error
     )
+    if config.bean_validation == "hardcore":
+        errors.extend(_validate_extra(entries, options_map))
+    return entries, errors, options_map
+
+
+def _log_timings(message: str):
+    """Log the loader's timings and record them as metrics."""
+    getLogger("beancount").debug(message)
+    metrics.registry.log_timings(message)
+
+
+def _validate_extra(entries: List, options_map: Dict) -> List:
+    """Run the hardcore validations. They are not passed to the loader as
+    ``extra_validations``, since beancount adds those to its global list of
+    validations, running them once more with every load."""
+    errors: List = []
+    for fn in validation.HARDCORE_VALIDATIONS:
+        errors.extend(fn(entries, options_map))
+    return errors
+
+
+def validate_deep() -> List:
+    """Load the ledger from its files, bypassing the ledger cache and snapshot, and run
+    all validations including the hardcore ones. This is slow and meant to run in the background.
+
+    Returns:
+        The errors found, an empty list if the ledger is valid.
+    """
+    log = getLogger("beancount")
+    # The loader's timings aren't recorded, they'd mix with those of the bot's loads
+    with metrics.registry.timer("beans.validate_deep"):
+        entries, errors, options_map = loader.load_file(
+            join(config.bean_path, config.bean_main_file), log_timings=log.debug
+        )
+        return errors + _validate_extra(entries, options_map)
+
+
+cache = ledger.LedgerCache(
+    _load_file,
+    ledger.Snapshot(join(config.db_dir, "ledger.snapshot"))
+    if config.bean_snapshot
+    else None,
+)
+"""Process-wide cache of the loaded beancount ledger."""
+
+
+def save_snapshot():
+    """Store the loaded ledger on disk, so that the next start doesn't have to parse it."""
+    cache.save_snapshot()
+
+
+def _load_checked():
+    """Load the beancount file like :func:`load`, but raise if errors occurred.
+
+    Raises:
+        LoadError: Error occurred while loading beancount files.
+        Error: Some other error while loading the accounting data.
+    """
+    entries, errors, options_map = load()
     if errors:
-        l.error(f"Check failed: {errors}")
+        getLogger("beans").exception(
+            f"Can't parse beancount data: errors present: {errors}"
+        )
+        ts = [type(e) for e in errors]
+        if loader.LoadError in ts:
+            es = [e.message for e in errors if e is loader.LoadError]
+            raise LoadError("Error while opening beancount file: " + ": ".join(es))
+        else:
+            raise Error("Error while opening beancount file.")
+    return entries, errors, options_map
+
+
+def load():
+    """Load the beancount file and return its entries, errors and options.
+    The ledger is only parsed again if one of its files changed, the entries
+    returned are shared and must not be modified."""
+    entries, errors, options_map = cache.get(
+        join(config.bean_path, config.bean_main_file)
+    )
+    if errors:
+        getLogger("beancount").error(f"Check failed: {errors}")
         return None, errors, None
     return entries, errors, options_map
 
 
+def cache_info() -> ledger.CacheInfo:
+    """Get the hit and miss counters of the ledger cache."""
+    return cache.info()
+
+
 def parse_tx(val: str) -> Transaction:
     """Parse a string into a transaction. The string format to parse looks something like this:
 
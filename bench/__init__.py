@@ -0,0 +1,2 @@
+"""This package benchmarks the bot on synthetic ledgers, driving the real handlers
+with fake updates. Run it with ``python -m bench --help``."""
@@ -0,0 +1,132 @@
+"""Benchmark the bot on a synthetic ledger.
+
+Example::
+
+    python -m bench --years 5 --per-day 10 --sync git --json
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from os.path import join
+
+from .generate import LedgerSpec, generate
+
+_DEFAULTS = LedgerSpec._field_defaults
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m bench", description="Benchmark the bot on a synthetic ledger."
+    )
+    parser.add_argument("--accounts", type=int, default=_DEFAULTS["accounts"])
+    parser.add_argument("--years", type=int, default=_DEFAULTS["years"])
+    parser.add_argument("--per-day", type=int, default=_DEFAULTS["per_day"])
+    parser.add_argument("--files", type=int, default=_DEFAULTS["files"])
+    parser.add_argument("--seed", type=int, default=_DEFAULTS["seed"])
+    parser.add_argument(
+        "--sync",
+        choices=["none", "git", "pygit"],
+        default="none",
+        help="none doesn't sync, git and pygit push to a local bare repository",
+    )
+    parser.add_argument(
+        "--async", dest="sync_async", action="store_true", help="push in the background"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=50, help="operations per scenario"
+    )
+    parser.add_argument("--loads", type=int, default=3, help="number of cold loads")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="concurrent senders of message.xN"
+    )
+    parser.add_argument(
+        "--dir", help="directory for the ledger, a temporary one by default"
+    )
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    spec = LedgerSpec(args.accounts, args.years, args.per_day, args.files, args.seed)
+    root = args.dir or tempfile.mkdtemp(prefix="beanbot-bench-")
+    # The bot and git print to stdout, keep it for the report
+    sys.stdout.flush()
+    stdout = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        results, ledger, settings = _run(root, spec, args)
+    finally:
+        sys.stdout.flush()
+        os.dup2(stdout, 1)
+        os.close(stdout)
+        if not args.dir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    # Imported late, like the scenarios, because they import the bot's configuration
+    from .report import format_json, format_table
+
+    if args.json:
+        print(format_json(spec, ledger, settings, results))
+    else:
+        print(format_table(spec, ledger, settings, results))
+
+
+def _run(root: str, spec: LedgerSpec, args):
+    path = join(root, "ledger")
+    ledger = generate(path, spec)
+    if args.sync != "none":
+        _init_repository(root, path)
+
+    # The bot reads its configuration from the environment when it's imported
+    os.environ.update(
+        {
+            "TELEGRAM_API_TOKEN": "123:bench",
+            "BEAN_PATH": path,
+            "BEAN_MAIN_FILE": ledger.main_file,
+            "BEAN_CURRENCY": "EUR",
+            "BEAN_SNAPSHOT": "0",
+            "DB_DIR": join(root, "db"),
+            "SYNC_METHOD": args.sync,
+            "SYNC_ASYNC": "1" if args.sync_async else "0",
+            "DEEP_VALIDATION": "off",
+        }
+    )
+    os.makedirs(join(root, "db"), exist_ok=True)
+    from .scenarios import Bench, describe, run_all
+
+    bench = Bench(ledger, args.seed)
+    results = run_all(bench, args.iterations, args.loads, args.workers)
+    return results, ledger, describe()
+
+
+def _init_repository(root: str, path: str):
+    """Turn the ledger into a clone of a new bare repository."""
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="bench",
+        GIT_AUTHOR_EMAIL="bench@localhost",
+        GIT_COMMITTER_NAME="bench",
+        GIT_COMMITTER_EMAIL="bench@localhost",
+    )
+    os.environ.update(env)
+    remote = join(root, "remote.git")
+
+    def git(*args: str, cwd: str = path):
+        subprocess.run(
+            ["git", *args], cwd=cwd, env=env, check=True, capture_output=True
+        )
+
+    git("init", "--bare", "-b", "main", remote, cwd=root)
+    git("init", "-b", "main")
+    git("add", "-A")
+    git("commit", "-m", "Synthetic ledger")
+    git("remote", "add", "origin", remote)
+    git("push", "-u", "origin", "main")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
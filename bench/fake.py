@@ -0,0 +1,111 @@
+import threading
+from typing import Any, Dict, List, Optional
+
+from telegram import InlineKeyboardMarkup
+
+
+class FakeMessage(object):
+    """FakeMessage stands in for a ``telegram.Message``. Replies are new fake messages,
+    edits change the message, nothing is sent.
+
+    Attributes:
+        text (:obj: str): The message's text.
+        message_id (:obj: int): The message's id.
+        reply_to_message (:class: FakeMessage): The message this one replies to.
+        reply_markup (:class: telegram.InlineKeyboardMarkup): The message's buttons.
+        replies (:obj: List[FakeMessage]): The replies sent to the message.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        message_id: int,
+        reply_to_message: Optional["FakeMessage"] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ):
+        self.text = text
+        self.message_id = message_id
+        self.reply_to_message = reply_to_message
+        self.reply_markup = reply_markup
+        self.replies: List[FakeMessage] = []
+        self._changed = threading.Condition()
+
+    def reply_text(self, text: str = "", reply_markup=None, **kwargs) -> "FakeMessage":
+        msg = FakeMessage(text, self.message_id + 1, self, reply_markup)
+        with self._changed:
+            self.replies.append(msg)
+            self._changed.notify_all()
+        return msg
+
+    reply_markdown = reply_text
+
+    def reply_photo(self, photo: Any = None, **kwargs) -> "FakeMessage":
+        return self.reply_text("")
+
+    def edit_text(self, text: str = "", reply_markup=None, **kwargs) -> "FakeMessage":
+        with self._changed:
+            self.text = text
+            self.reply_markup = reply_markup
+            self._changed.notify_all()
+        # An edited bot message is a result for the message it replied to
+        if self.reply_to_message:
+            self.reply_to_message._notify()
+        return self
+
+    def edit_reply_markup(self, reply_markup=None, **kwargs) -> "FakeMessage":
+        with self._changed:
+            self.reply_markup = reply_markup
+            self._changed.notify_all()
+        return self
+
+    def wait(self, predicate, timeout: float = 60) -> bool:
+        """Wait until the predicate, called with the message, is true."""
+        with self._changed:
+            return self._changed.wait_for(lambda: predicate(self), timeout)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+
+class FakeUser(object):
+    def __init__(self, id: int, first_name: str):
+        self.id = id
+        self.first_name = first_name
+
+    def __getitem__(self, key: str):
+        return getattr(self, key)
+
+
+class FakeCallbackQuery(object):
+    def __init__(self, data: str, message: FakeMessage):
+        self.data = data
+        self.message = message
+
+    def answer(self, text: str = "", **kwargs):
+        pass
+
+
+class FakeUpdate(object):
+    """FakeUpdate stands in for a ``telegram.Update`` with a message or a callback query."""
+
+    def __init__(
+        self,
+        user: FakeUser,
+        message: FakeMessage,
+        callback_query: Optional[FakeCallbackQuery] = None,
+    ):
+        self.effective_user = user
+        self.effective_message = message
+        self.message = None if callback_query else message
+        self.callback_query = callback_query
+
+
+class FakeContext(object):
+    """FakeContext stands in for a ``telegram.ext.CallbackContext``. The user's and
+    chat's data are kept between updates, like the dispatcher does."""
+
+    def __init__(self, opts: Dict[str, Any]):
+        self.user_data: Dict[str, Any] = {"opts": opts}
+        self.chat_data: Dict[str, Any] = {}
+        self.args: List[str] = []
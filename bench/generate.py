@@ -0,0 +1,105 @@
+import random
+from datetime import date, timedelta
+from os import makedirs
+from os.path import join
+from typing import List, NamedTuple
+
+START = date(2015, 1, 1)
+"""The date of the first generated transaction, fixed so that ledgers are reproducible."""
+
+_WORDS = [
+    "Bakery", "Supermarket", "Coffee", "Lunch", "Dinner", "Train", "Bus", "Taxi",
+    "Cinema", "Books", "Pharmacy", "Hardware", "Market", "Kiosk", "Museum", "Pizza",
+    "Fuel", "Parking", "Gift", "Flowers", "Haircut", "Gym", "Concert", "Snacks",
+]  # fmt: skip
+
+
+class LedgerSpec(NamedTuple):
+    """The shape of a synthetic ledger.
+
+    Attributes:
+        accounts (:obj: int): Number of expense accounts, grouped into categories of five.
+        years (:obj: int): Number of years with transactions.
+        per_day (:obj: int): Number of transactions per day.
+        files (:obj: int): Number of included files the transactions are spread over.
+        seed (:obj: int): Seed of the random amounts, narrations and accounts.
+    """
+
+    accounts: int = 30
+    years: int = 3
+    per_day: int = 5
+    files: int = 12
+    seed: int = 0
+
+
+class Ledger(NamedTuple):
+    """A generated ledger.
+
+    Attributes:
+        main_file (:obj: str): The main file, relative to the ledger's directory.
+        user_file (:obj: str): An empty included file, for the bot to append to.
+        expense_accounts (:obj: List[str]): The expense accounts, without prefix.
+        narrations (:obj: List[str]): The narrations used.
+        transactions (:obj: int): The number of transactions generated.
+    """
+
+    main_file: str
+    user_file: str
+    expense_accounts: List[str]
+    narrations: List[str]
+    transactions: int
+
+
+def generate(path: str, spec: LedgerSpec) -> Ledger:
+    """Write a synthetic ledger to a directory. The same spec always results in the
+    same files.
+
+    Args:
+        path (:obj: str): The directory, it's created if it doesn't exist.
+        spec (:class: LedgerSpec): The ledger's shape.
+
+    Returns:
+        Ledger: The generated ledger.
+    """
+    rand = random.Random(spec.seed)
+    accounts = [f"Category{i // 5}:Account{i}" for i in range(spec.accounts)]
+    narrations = [f"{w} {n}" for w in _WORDS for n in range(10)]
+    # Every narration is mostly used with the same account, like real ledgers
+    usual = {n: rand.choice(accounts) for n in narrations}
+
+    makedirs(join(path, "txs"), exist_ok=True)
+    makedirs(join(path, "cash"), exist_ok=True)
+    days = (date(START.year + spec.years, 1, 1) - START).days
+    per_file = -(-days // spec.files)
+    includes = ["accounts.bean", "cash/bench.bean"]
+    count = 0
+    for f in range(spec.files):
+        name = f"txs/{f:03}.bean"
+        includes.append(name)
+        with open(join(path, name), "w") as file:
+            for d in range(f * per_file, min((f + 1) * per_file, days)):
+                day = START + timedelta(days=d)
+                for _ in range(spec.per_day):
+                    narration = rand.choice(narrations)
+                    account = usual[narration]
+                    if rand.random() < 0.1:
+                        account = rand.choice(accounts)
+                    source = "Assets:Cash" if rand.random() < 0.7 else "Assets:Bank"
+                    amount = rand.randint(100, 20000)
+                    file.write(
+                        f'{day} * "{narration}"\n'
+                        f"    {source}  -{amount // 100}.{amount % 100:02} EUR\n"
+                        f"    Expenses:{account}\n\n"
+                    )
+                    count += 1
+
+    with open(join(path, "accounts.bean"), "w") as file:
+        file.write('option "operating_currency" "EUR"\n\n')
+        for a in ["Assets:Cash", "Assets:Bank", "Equity:Opening"]:
+            file.write(f"{START - timedelta(days=1)} open {a}\n")
+        for a in accounts:
+            file.write(f"{START - timedelta(days=1)} open Expenses:{a}\n")
+    open(join(path, "cash/bench.bean"), "w").close()
+    with open(join(path, "main.bean"), "w") as file:
+        file.writelines(f'include "{i}"\n' for i in includes)
+    return Ledger("main.bean", "cash/bench.bean", accounts, narrations, count)
@@ -0,0 +1,90 @@
+import json
+from statistics import mean
+from typing import Dict, List
+
+from .generate import Ledger, LedgerSpec
+from .scenarios import Result
+
+
+def _latency(values: List[float]) -> Dict[str, float]:
+    """Get percentiles and mean of durations in milliseconds."""
+    values = sorted(values)
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+
+    def rank(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+    return {
+        "p50": rank(0.5),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "mean": mean(values) * 1000,
+    }
+
+
+def format_json(
+    spec: LedgerSpec, ledger: Ledger, settings: Dict, results: List[Result]
+) -> str:
+    """Format the results as JSON, durations are in milliseconds."""
+    return json.dumps(
+        {
+            "ledger": dict(spec._asdict(), transactions=ledger.transactions),
+            "settings": settings,
+            "scenarios": [
+                {
+                    "name": r.name,
+                    "count": r.count,
+                    "seconds": r.seconds,
+                    "throughput": r.throughput,
+                    "latency": _latency(r.latencies),
+                    "stages": {
+                        name: {
+                            "count": s.count,
+                            "total": s.sum * 1000,
+                            **{
+                                f"p{int(q * 100)}": v * 1000
+                                for q, v in s.quantiles.items()
+                            },
+                        }
+                        for name, s in r.stages.items()
+                    },
+                }
+                for r in results
+            ],
+        },
+        indent=2,
+    )
+
+
+def format_table(
+    spec: LedgerSpec, ledger: Ledger, settings: Dict, results: List[Result]
+) -> str:
+    """Format the results as table, durations are in milliseconds. Each scenario is
+    followed by the stages recorded while it ran."""
+    rows = [("", "n", "p50", "p95", "p99", "mean", "ops/s")]
+    for r in results:
+        latency = _latency(r.latencies)
+        rows.append(
+            (r.name, str(r.count))
+            + tuple(f"{latency[k]:.1f}" for k in ("p50", "p95", "p99", "mean"))
+            + (f"{r.throughput:.1f}",)
+        )
+        for name, s in r.stages.items():
+            rows.append(
+                (f"  {name}", str(s.count))
+                + tuple(f"{s.quantiles[q] * 1000:.1f}" for q in (0.5, 0.95, 0.99))
+                + (f"{s.sum / s.count * 1000:.1f}" if s.count else "", "")
+            )
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    lines = [
+        f"Ledger: {ledger.transactions} transactions, {spec.accounts} accounts, "
+        f"{spec.years} years, {spec.files} files",
+        "Settings: " + ", ".join(f"{k}={v}" for k, v in settings.items()),
+        "",
+    ]
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [c.rjust(w) for c, w in zip(row[1:], widths[1:])]
+        lines.append("  ".join(cells).rstrip())
+    return "\n".join(lines)
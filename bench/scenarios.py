@@ -0,0 +1,222 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import beans
+import config
+import metrics
+from bot.commits import get_commit_queue
+from bot.handlers import _handle_account_callback, _handle_message, _handle_withdraw
+
+from .fake import FakeCallbackQuery, FakeContext, FakeMessage, FakeUpdate, FakeUser
+from .generate import Ledger
+
+STAGES = ("beans.", "beancount.", "sync.")
+"""Prefixes of the metrics reported as stages of a scenario."""
+
+_ids = count(1)
+
+
+class Result(NamedTuple):
+    """The result of a scenario.
+
+    Attributes:
+        name (:obj: str): The scenario's name.
+        count (:obj: int): Number of operations run.
+        seconds (:obj: float): Wall time of all operations.
+        latencies (:obj: List[float]): Seconds from sending each operation to its result.
+        stages (:obj: Dict[str, metrics.Summary]): Durations recorded by the bot while
+            the scenario ran, see :data:`STAGES`.
+    """
+
+    name: str
+    count: int
+    seconds: float
+    latencies: List[float]
+    stages: Dict[str, metrics.Summary]
+
+    @property
+    def throughput(self) -> float:
+        """Operations per second."""
+        return self.count / self.seconds if self.seconds else 0.0
+
+
+class Bench(object):
+    """Bench runs scenarios against the configured ledger, calling the bot's handlers
+    like the dispatcher does.
+
+    Attributes:
+        ledger (:class: Ledger): The generated ledger.
+        seed (:obj: int): Seed of the random messages sent.
+    """
+
+    def __init__(self, ledger: Ledger, seed: int = 0):
+        self.ledger = ledger
+        self.rand = random.Random(seed)
+        self.opts = {
+            "admin": True,
+            "name": "bench",
+            "file": ledger.user_file,
+            "account": "Assets:Cash",
+            "withdrawal_account": "Assets:Bank",
+        }
+
+    def run(self, name: str, n: int, operation: Callable[[], None], workers: int = 1):
+        """Run an operation n times and record its latencies and the stages' durations.
+
+        Args:
+            name (:obj: str): The scenario's name.
+            n (:obj: int): Number of operations.
+            operation (:obj: Callable): Function running one operation until its result.
+            workers (:obj: int): Number of threads running operations concurrently.
+        """
+        metrics.registry.reset()
+        latencies: List[float] = []
+
+        def timed(_):
+            t = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - t)
+
+        start = time.perf_counter()
+        if workers > 1:
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(timed, range(n)))
+        else:
+            for i in range(n):
+                timed(i)
+        seconds = time.perf_counter() - start
+        stages = {
+            k: s
+            for k, s in metrics.registry.summaries().items()
+            if k.startswith(STAGES)
+        }
+        return Result(name, n, seconds, latencies, stages)
+
+    def load_cold(self):
+        """Parse the whole ledger, as after a change by someone else."""
+        beans.cache.invalidate()
+        beans.load()
+
+    def load_warm(self):
+        """Get the loaded ledger, checking its files for changes."""
+        beans.load()
+
+    def message(self, context: Optional[FakeContext] = None):
+        """Send a transaction with its account."""
+        narration = self.rand.choice(self.ledger.narrations)
+        account = self.rand.choice(self.ledger.expense_accounts)
+        msg = self._send(f"{self._amount()} {narration} [{account}]", context)
+        _wait_result(msg)
+
+    def callback(self):
+        """Send a transaction with a new narration and choose its account button by button."""
+        context = self._context()
+        account = self.rand.choice(self.ledger.expense_accounts)
+        msg = self._send(f"{self._amount()} Unknown {next(_ids)}", context)
+        prompt = msg.replies[0]
+        for part in account.split(":"):
+            data = _button(prompt, part)
+            query = FakeCallbackQuery(data, prompt)
+            _handle_account_callback(FakeUpdate(self.user, prompt, query), context)
+        _wait_result(msg)
+
+    def withdraw(self):
+        """Withdraw money with /withdraw."""
+        context = self._context()
+        context.args = [self._amount()]
+        msg = FakeMessage(f"/withdraw {context.args[0]}", next(_ids))
+        _handle_withdraw(FakeUpdate(self.user, msg), context)
+        _wait_result(msg)
+
+    @property
+    def user(self) -> FakeUser:
+        return FakeUser(1, "bench")
+
+    def _context(self) -> FakeContext:
+        return FakeContext(dict(self.opts))
+
+    def _send(self, text: str, context: Optional[FakeContext] = None) -> FakeMessage:
+        msg = FakeMessage(text, next(_ids))
+        _handle_message(FakeUpdate(self.user, msg), context or self._context())
+        return msg
+
+    def _amount(self) -> str:
+        cents = self.rand.randint(100, 5000)
+        return f"{cents // 100}.{cents % 100:02}"
+
+
+def _button(prompt: FakeMessage, text: str) -> str:
+    """Get the callback data of the button with a text.
+
+    Raises:
+        ValueError: The prompt has no such button.
+    """
+    for row in prompt.reply_markup.inline_keyboard if prompt.reply_markup else []:
+        for button in row:
+            if button.text == text:
+                return button.callback_data
+    raise ValueError(f"No button {text} in {prompt.text}")
+
+
+def _is_result(text: str) -> bool:
+    return "✅" in text or "❌" in text or "error" in text
+
+
+def _wait_result(msg: FakeMessage, timeout: float = 120):
+    """Wait until the message got a result, as reply or as edit of the bot's reply.
+
+    Raises:
+        RuntimeError: The operation failed or timed out.
+    """
+    if not msg.wait(lambda m: any(_is_result(r.text) for r in m.replies), timeout):
+        raise RuntimeError(f"No result for {msg.text}")
+    text = next(r.text for r in msg.replies if _is_result(r.text))
+    if "✅" not in text:
+        raise RuntimeError(f"{msg.text} failed: {text}")
+
+
+def run_all(bench: Bench, iterations: int, loads: int, workers: int) -> List[Result]:
+    """Run all scenarios.
+
+    Args:
+        bench (:class: Bench): The benchmark.
+        iterations (:obj: int): Number of operations per scenario.
+        loads (:obj: int): Number of cold loads.
+        workers (:obj: int): Number of concurrent senders of the throughput scenario.
+    """
+    contexts: Dict[int, FakeContext] = {}
+
+    def concurrent_message():
+        # Every thread is another user, with their own user data
+        context = contexts.setdefault(threading.get_ident(), bench._context())
+        bench.message(context)
+
+    results = [
+        bench.run("load.cold", loads, bench.load_cold),
+        bench.run("load.warm", iterations, bench.load_warm),
+        bench.run("message", iterations, bench.message),
+        bench.run("callback", iterations, bench.callback),
+        bench.run("withdraw", iterations, bench.withdraw),
+        bench.run(
+            f"message.x{workers}", iterations, concurrent_message, workers=workers
+        ),
+    ]
+    # Pushes in the background aren't part of any scenario, but shouldn't outlive them
+    worker = get_commit_queue().worker
+    while worker and worker.pending():
+        time.sleep(0.01)
+    return results
+
+
+def describe() -> Dict[str, object]:
+    """Get the configuration the scenarios ran with."""
+    return {
+        "sync": type(config.synchronizer).__name__,
+        "sync_async": config.sync_async,
+        "commit_window": config.commit_window,
+        "bean_validation": config.bean_validation,
+    }
@@ -0,0 +1,213 @@
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import date
+from logging import getLogger
+from typing import Callable, Hashable, List, Optional, Tuple
+
+from telegram import TelegramError, Update
+from telegram.ext import CallbackContext
+
+import analytics
+import beans
+import config
+
+from .reports import _category_sums, _month_sums, _parse_period
+
+try:
+    from matplotlib.figure import Figure
+except ImportError:
+    Figure = None
+
+_log = getLogger("charts")
+
+CHART_USAGE = """Usage:
+    `/chart category [PERIOD]` spending per category, this month by default
+    `/chart month [MONTHS]` spending per month, the last 12 months by default
+`PERIOD` is a year like `2024`, a month like `2024-05` or `all`."""
+
+# Figures are created without pyplot, which isn't thread safe, and drawn with the
+# Agg backend. Rendering is serialized anyway, so that charts don't compete for the
+# CPU with the handlers answering messages.
+_render_lock = threading.Lock()
+
+
+class Chart(object):
+    """A rendered chart.
+
+    Attributes:
+        png (:obj: bytes): The image.
+        file_id (:obj: str): Telegram's id of the image once it has been sent, it's
+            sent again by id instead of uploading it.
+    """
+
+    def __init__(self, png: bytes):
+        self.png = png
+        self.file_id: Optional[str] = None
+
+
+class ChartCache(object):
+    """ChartCache keeps the most recently used charts. Keys contain the ledger's
+    version, so charts of an older ledger are never served. A chart requested again
+    while it's being rendered is rendered only once.
+
+    Attributes:
+        size (:obj: int): The maximum number of charts kept.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._lock = threading.Lock()
+        self._charts: "OrderedDict[Hashable, Future]" = OrderedDict()
+
+    def get(self, key: Hashable, render: Callable[[], Chart]) -> Chart:
+        """Get a chart, rendering it if it isn't cached.
+
+        Args:
+            key (:obj: Hashable): The chart's key, starting with the ledger's version.
+            render (:obj: Callable): Function rendering the chart.
+
+        Raises:
+            Any exception raised while rendering the chart.
+        """
+        with self._lock:
+            future = self._charts.get(key)
+            owner = future is None
+            if owner:
+                future = self._charts[key] = Future()
+                # Charts of older versions of the ledger are no use anymore
+                for k in [k for k in self._charts if k[0] != key[0]]:  # type: ignore
+                    del self._charts[k]
+                while len(self._charts) > self.size:
+                    self._charts.popitem(last=False)
+            else:
+                self._charts.move_to_end(key)
+        if owner:
+            try:
+                future.set_result(render())  # type: ignore
+            except Exception as e:
+                # Don't keep the error, the next request renders the chart again
+                with self._lock:
+                    if self._charts.get(key) is future:
+                        del self._charts[key]
+                future.set_exception(e)  # type: ignore
+        return future.result()  # type: ignore
+
+
+_cache: Optional[ChartCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_chart_cache() -> ChartCache:
+    """Get the cache of rendered charts."""
+    global _cache
+    with _cache_lock:
+        if not _cache:
+            _cache = ChartCache(config.chart_cache_size)
+        return _cache
+
+
+def _handle_chart(update: Update, context: CallbackContext):
+    """Handle the command /chart. Sends a chart of the user's expenses, see
+    :data:`CHART_USAGE`. Charts are rendered in the dispatcher's worker threads and
+    cached per ledger version, user's account and query."""
+    args = context.args or []
+    kind = args[0] if args else "category"
+    if kind not in ("category", "month"):
+        update.effective_message.reply_markdown(CHART_USAGE)
+        return
+    if Figure is None:
+        update.effective_message.reply_text(
+            "Charts are not available: they require matplotlib (pip install matplotlib)"
+        )
+        return
+    account = context.user_data["opts"]["account"]
+    try:
+        version, columns = _columns()
+        key = (version, account, date.today(), kind, tuple(args[1:]))
+        chart = get_chart_cache().get(
+            key, lambda: _render(context, columns, kind, args[1:])
+        )
+    except ValueError:
+        update.effective_message.reply_markdown(CHART_USAGE)
+        return
+    except ImportError as e:
+        update.effective_message.reply_text(f"Charts are not available: {e}")
+        return
+    except beans.Error as e:
+        _log.exception("Can't load beancount data in _handle_chart: " + e.message)
+        update.effective_message.reply_text(
+            "❌ An internal error with the accounting program occurred. Please contact the administrator."
+        )
+        return
+    _send_chart(update, chart)
+
+
+def _send_chart(update: Update, chart: Chart):
+    """Send a chart, by its id if it has been sent before."""
+    if chart.file_id:
+        try:
+            update.effective_message.reply_photo(photo=chart.file_id)
+            return
+        except TelegramError as e:
+            _log.warning(f"Can't send chart by id, uploading it again: {e}")
+    msg = update.effective_message.reply_photo(photo=io.BytesIO(chart.png))
+    if msg and msg.photo:
+        chart.file_id = msg.photo[-1].file_id
+
+
+def _columns() -> Tuple[int, analytics.Columns]:
+    """Get the ledger's columns with the version of the ledger they were built from."""
+    version = beans.cache.version
+    columns = beans.get_columns()
+    # The ledger was reloaded or appended to meanwhile, the columns may be newer
+    while beans.cache.version != version:
+        version = beans.cache.version
+        columns = beans.get_columns()
+    return version, columns
+
+
+def _render(
+    context: CallbackContext, columns: analytics.Columns, kind: str, args: List[str]
+) -> Chart:
+    """Render a chart of the user's expenses from the ledger's columns.
+
+    Raises:
+        ValueError: The arguments are invalid.
+    """
+    if kind == "month":
+        months = int(args[0]) if args else 12
+        lines, total = _month_sums(context, months, columns)
+        title = f"Expenses per month, {beans.format_amount(total)} in total"
+        return _render_bars(title, lines, horizontal=False)
+    start, end, label = _parse_period(args)
+    lines, total = _category_sums(context, start, end, columns)
+    title = f"Expenses per category ({label}), {beans.format_amount(total)} in total"
+    return _render_bars(title, lines, horizontal=True)
+
+
+def _render_bars(title: str, lines: List[Tuple[str, int]], horizontal: bool) -> Chart:
+    """Render a bar chart of labels and amounts in cents as PNG."""
+    labels = [label for label, _ in lines]
+    values = [a / 100 for _, a in lines]
+    with _render_lock:
+        fig = Figure(figsize=(8, max(3, 0.4 * len(lines) + 1.5) if horizontal else 4.5))
+        ax = fig.add_subplot()
+        if horizontal:
+            # The largest bar on top
+            ax.barh(labels[::-1], values[::-1], color="tab:blue")
+            ax.set_xlabel(config.bean_currency)
+        else:
+            ax.bar(range(len(labels)), values, color="tab:blue")
+            ax.set_ylabel(config.bean_currency)
+            # Label at most 12 bars, long ranges get unreadable otherwise
+            ticks = range(0, len(labels), -(-len(labels) // 12) or 1)
+            ax.set_xticks(list(ticks))
+            ax.set_xticklabels([labels[i] for i in ticks], rotation=45, ha="right")
+        ax.set_title(title)
+        ax.grid(axis="x" if horizontal else "y", alpha=0.3)
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=100)
+    return Chart(buf.getvalue())
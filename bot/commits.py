@@ -0,0 +1,247 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from os.path import join
+from queue import Empty, Queue
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import beans
+import config
+import metrics
+import sync
+
+_log = getLogger("commits")
+
+
+class _Item(NamedTuple):
+    txs: List[beans.Transaction]
+    fname: str
+    msg: str
+    future: Future
+
+
+class CommitQueue(object):
+    """CommitQueue commits transactions in batches. Transactions submitted within
+    ``window`` seconds of each other, up to ``size`` transactions, are committed with a
+    single pull, a single append per file and a single push. The files of a batch are
+    appended to in parallel.
+
+    If a push worker is given, the batch is pushed in the background. The balances
+    the futures resolve to then carry a future under ``"synced"`` which resolves once
+    the push is done. While pushes are pending, pulls are skipped.
+
+    Attributes:
+        synchronizer (:class: sync.Sync): The synchronizer used to pull and push.
+        window (:obj: float): Seconds to wait for more transactions after the first one arrived.
+        size (:obj: int): Maximum number of transactions per batch.
+        worker (:class: sync.PushWorker): Optional worker pushing in the background.
+        appenders (:obj: int): Number of files of a batch appended to in parallel.
+        on_commit (:obj: Callable): Optional function called with the changed files after
+            transactions were appended.
+    """
+
+    def __init__(
+        self,
+        synchronizer: sync.Sync,
+        window: float = 0,
+        size: int = 20,
+        worker: Optional[sync.PushWorker] = None,
+        appenders: int = 1,
+    ):
+        self.synchronizer = synchronizer
+        self.window = window
+        self.size = max(size, 1)
+        self.worker = worker
+        self.on_commit: Optional[Callable[[List[str]], None]] = None
+        self._queue: "Queue[_Item]" = Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._executor = ThreadPoolExecutor(max(appenders, 1), "append")
+
+    def submit(self, tx: beans.Transaction, fname: str, msg: str = "") -> Future:
+        """Queue a transaction to be committed.
+
+        Args:
+            tx (:class: beans.Transaction): The transaction to commit.
+            fname (:obj: str): The relative path of the file to append the transaction to.
+            msg (:obj: str [optional]): The push message.
+
+        Returns:
+            A future resolving to both account balances as dictionary, see :func:`beans.append_tx`.
+        """
+        future: Future = Future()
+
+        def done(f: Future):
+            if f.exception():
+                future.set_exception(f.exception())
+            else:
+                future.set_result(f.result()[0])
+
+        self.submit_many([tx], fname, msg).add_done_callback(done)
+        return future
+
+    def submit_many(
+        self, txs: List[beans.Transaction], fname: str, msg: str = ""
+    ) -> Future:
+        """Queue several transactions to be committed together. They are appended with
+        a single write, if one of them is invalid, none of them is committed.
+
+        Args:
+            txs (:obj: List[beans.Transaction]): The transactions to commit.
+            fname (:obj: str): The relative path of the file to append the transactions to.
+            msg (:obj: str [optional]): The push message.
+
+        Returns:
+            A future resolving to the balances of each transaction, see :func:`beans.append_txs`.
+        """
+        future: Future = Future()
+        self._queue.put(_Item(txs, fname, msg, future))
+        with self._lock:
+            if not self._worker:
+                self._worker = threading.Thread(
+                    target=self._run, name="commits", daemon=True
+                )
+                self._worker.start()
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.size:
+                try:
+                    batch.append(
+                        self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    )
+                except Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as e:
+                _log.exception(f"Unexpected error while committing a batch: {e}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+
+    def _commit(self, batch: List[_Item]):
+        """Commit a batch: pull once, append the transactions to each file in parallel
+        and push all files that changed at once. Results are reported through each
+        item's future."""
+        _log.debug(f"Committing a batch of {len(batch)} transactions")
+        try:
+            # A pull would overwrite local changes that haven't been pushed yet
+            if not (self.worker and self.worker.pending()):
+                with self.synchronizer.lock, metrics.registry.timer("sync.pull"):
+                    self.synchronizer.pull()
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+            return
+
+        files: Dict[str, List[_Item]] = {}
+        for item in batch:
+            files.setdefault(item.fname, []).append(item)
+
+        results: Dict[int, List[dict]] = {}
+        # Appends may leave the files half done for a while, e.g. until an invalid
+        # transaction is truncated again. The push worker mustn't commit, rebase or
+        # reset the repository meanwhile, it holds the same lock.
+        with self.synchronizer.lock:
+            if len(files) > 1:
+                # Files are appended to in parallel, between the single pull and push
+                appended = list(
+                    self._executor.map(
+                        lambda f: self._append(f, files[f], results), files
+                    )
+                )
+            else:
+                appended = [
+                    self._append(f, items, results) for f, items in files.items()
+                ]
+        done = [item for items in appended for item in items]
+
+        if not done:
+            return
+        msg = "\n".join(sorted(set(i.msg for i in done if i.msg)))
+        metrics.registry.count("transactions", sum(len(i.txs) for i in done))
+        fnames = sorted(set(i.fname for i in done))
+        if self.on_commit:
+            try:
+                self.on_commit(fnames)
+            except Exception as e:
+                _log.exception(f"Error in commit callback: {e}")
+        if self.worker:
+            synced = self.worker.push(fnames, msg=msg)
+            for item in done:
+                item.future.set_result(
+                    [dict(b, synced=synced) for b in results[id(item)]]
+                )
+            return
+        try:
+            with self.synchronizer.lock, metrics.registry.timer("sync.push"):
+                self.synchronizer.push_many(fnames, msg=msg)
+        except Exception as e:
+            for item in done:
+                item.future.set_exception(e)
+            return
+        for item in done:
+            item.future.set_result(results[id(item)])
+
+    def _append(
+        self, fname: str, items: List[_Item], results: Dict[int, List[dict]]
+    ) -> List[_Item]:
+        """Append the transactions of several items to a file. The balances of each
+        item are stored in results, keyed by the item's id, failed items are resolved
+        with their error.
+
+        Returns:
+            The items whose transactions were appended.
+        """
+        try:
+            balances = beans.append_txs([tx for i in items for tx in i.txs], fname)
+        except Exception as e:
+            if len(items) == 1:
+                _log.exception(f"Can't append transactions to {fname}")
+                items[0].future.set_exception(e)
+                return []
+            # Retry one by one so that only the invalid submissions fail
+            done = []
+            for item in items:
+                try:
+                    results[id(item)] = beans.append_txs(item.txs, fname)
+                    done.append(item)
+                except Exception as e:
+                    _log.exception(f"Can't append transactions to {fname}")
+                    item.future.set_exception(e)
+            return done
+        for item in items:
+            results[id(item)], balances = (
+                balances[: len(item.txs)],
+                balances[len(item.txs) :],
+            )
+        return items
+
+
+_queue: Optional[CommitQueue] = None
+
+
+def get_commit_queue() -> CommitQueue:
+    """Get the commit queue, creating it with the configured window and batch size on first use.
+    If pushes are asynchronous, the push worker is started as well and begins pushing
+    what is left in the outbox."""
+    global _queue
+    if not _queue:
+        worker = None
+        if config.sync_async:
+            worker = sync.PushWorker(
+                config.synchronizer, join(config.db_dir, "outbox.json")
+            )
+        _queue = CommitQueue(
+            config.synchronizer,
+            config.commit_window,
+            config.commit_batch_size,
+            worker,
+            config.workers,
+        )
+    return _queue
@@ -1,6 +1,9 @@
+import csv
+import io
+from concurrent.futures import Future
 from datetime import date
 from logging import getLogger
-from typing import List
+from typing import List, Optional, Tuple
 
 from telegram import (
     CallbackQuery,
@@ -9,17 +12,23 @@ from telegram import (
     ParseMode,
     Update,
 )
+from telegram.constants import MAX_MESSAGE_LENGTH
 from telegram.ext import CallbackContext, DispatcherHandlerStop
+from telegram.utils.helpers import escape_markdown
 
 import beans
 import config
+import metrics
 
+from . import startup
+from .commits import get_commit_queue
 from .storage import (
     ConversationState,
-    delete_state,
+    changed_keys,
+    data_lock,
     get_narration_account,
-    get_shelve,
-    get_state,
+    get_users,
+    pop_state,
     save_narration_account,
     save_state,
 )
@@ -29,20 +38,24 @@ _log = getLogger("bot")
 
 def _handle_error(update: Update, context: CallbackContext):
     """This handler gets called on any unhandled exception and just logs it."""
+    metrics.registry.count("errors")
     _log.exception(f"error caught in error handler: {context.error}: {context.error}.")
 
 
 def _handle_start(update: Update, context: CallbackContext):
-    with get_shelve() as data:  # If user is not in our users class, stop the handler
-        u = str(update.effective_user.id)
-        if len(data) == 0:
-            data[u] = {
+    users = get_users()  # If user is not in our users class, stop the handler
+    u = str(update.effective_user.id)
+    if len(users) == 0:
+        users.set(
+            u,
+            {
                 "admin": True,
                 "name": update.effective_user["first_name"],
-            }
-            update.effective_message.reply_text(
-                "You have been added as bot admin. You can add new users and set their configuration. Please use /help for more information about the commands."
-            )
+            },
+        )
+        update.effective_message.reply_text(
+            "You have been added as bot admin. You can add new users and set their configuration. Please use /help for more information about the commands."
+        )
 
     _handle_auth(update, context)
     _handle_help(update, context)
@@ -55,16 +68,14 @@ def _handle_auth(update: Update, context: CallbackContext):
     Raises:
         DispatcherHandlerStop: The user is not authorized to use the bot, end the handler chain.
     """
-    with get_shelve() as data:
-        u = str(update.effective_user.id)
-        if not data.get(u):
-            update.effective_message.reply_text(
-                "You are not authorized to use this bot."
-            )
-            raise DispatcherHandlerStop()
-        # Save user data for later use in our context
-        if context.user_data.get("opts") != data[u]:
-            context.user_data["opts"] = dict(data[u]).copy()
+    user = get_users().get(str(update.effective_user.id))
+    if not user:
+        update.effective_message.reply_text("You are not authorized to use this bot.")
+        raise DispatcherHandlerStop()
+    # Save user data for later use in our context
+    if context.user_data.get("opts") != user:
+        with data_lock:
+            context.user_data["opts"] = dict(user)
 
 
 def _handle_help(update: Update, context: CallbackContext):
@@ -85,7 +96,7 @@ Each user needs two settings: a file and a target account. The file will be the
 `:WITHDRAWAL_ACCOUNT` is the asset account from which money withdrawals will be taken, like Assets:Current
 `:ID` is the id of the user.
 
-You can inspect all users with /users.
+You can inspect all users with /users. /stats shows how long the bot's operations take.
             """
         )
     update.effective_message.reply_markdown(
@@ -107,6 +118,10 @@ If you know the expense account, you can tell me directly:
 To withdraw money, type:
     `/withdraw 200`
 
+To enter many transactions at once, send them one per line in a single message, or send /batch, then the transactions in as many messages as you like and /commit when you're done (/cancel discards them). You can also send a CSV file with the columns amount, narration and, optionally, account and tags. Accounts are taken from the transaction, from the last time you used the narration or from similar narrations, I'll tell you which lines I couldn't commit.
+
+To see what you spent, use /spent or /report, e.g. `/report category 2024`. Send /report alone to see all reports. /chart sends the same as image, e.g. `/chart category 2024` or `/chart month`.
+
 Type /help anytime if you want to read this message again.
 """
     )
@@ -120,20 +135,16 @@ def _handle_add_user(update: Update, context: CallbackContext):
 
     id = str(context.args[0])
     name = str(context.args[1])
-    with get_shelve() as data:
-        u = data[str(update.effective_user.id)]
-        if not u or not u["admin"]:
-            update.effective_message.reply_text(
-                "You are not authorized to add new users."
-            )
+    users = get_users()
+    u = users.get(str(update.effective_user.id))
+    if not u or not u["admin"]:
+        update.effective_message.reply_text("You are not authorized to add new users.")
 
-        if data.get(id):
-            update.effective_message.reply_text("User with id already exists")
-            return
-        data[id] = {"name": name, "admin": False}
-        update.effective_message.reply_text(
-            f"User with ID {id} has been added as {name}!"
-        )
+    if users.get(id):
+        update.effective_message.reply_text("User with id already exists")
+        return
+    users.set(id, {"name": name, "admin": False})
+    update.effective_message.reply_text(f"User with ID {id} has been added as {name}!")
 
 
 def _handle_set_user_accounts(update: Update, context: CallbackContext):
@@ -146,21 +157,18 @@ def _handle_set_user_accounts(update: Update, context: CallbackContext):
     acct = str(context.args[1])
     wacct = str(context.args[2])
 
-    with get_shelve() as data:
-        u = data[str(update.effective_user.id)]
-        if not u or not u["admin"]:
-            update.effective_message.reply_text(
-                "You are not authorized to set userdata."
-            )
+    users = get_users()
+    u = users.get(str(update.effective_user.id))
+    if not u or not u["admin"]:
+        update.effective_message.reply_text("You are not authorized to set userdata.")
 
-        if not data.get(id):
-            update.effective_message.reply_text(f"User with id {id} does not exist.")
-            return
-        data[id]["account"] = acct
-        data[id]["withdrawal_account"] = wacct
-        update.effective_message.reply_text(
-            f"Account for user {id} set to {acct} and withdrawal account set to {wacct}."
-        )
+    if not users.get(id):
+        update.effective_message.reply_text(f"User with id {id} does not exist.")
+        return
+    users.update(id, account=acct, withdrawal_account=wacct)
+    update.effective_message.reply_text(
+        f"Account for user {id} set to {acct} and withdrawal account set to {wacct}."
+    )
 
 
 def _handle_set_user_file(update: Update, context: CallbackContext):
@@ -170,39 +178,37 @@ def _handle_set_user_file(update: Update, context: CallbackContext):
     id = str(context.args[0])
     file = str(context.args[1])
 
-    with get_shelve() as data:
-        u = data[str(update.effective_user.id)]
-        if not u or not u["admin"]:
-            update.effective_message.reply_text(
-                "You are not authorized to set userdata."
-            )
+    users = get_users()
+    u = users.get(str(update.effective_user.id))
+    if not u or not u["admin"]:
+        update.effective_message.reply_text("You are not authorized to set userdata.")
 
-        if not data.get(id):
-            update.effective_message.reply_text(f"User with id {id} does not exist.")
-            return
-        data[id]["file"] = file
-        update.effective_message.reply_text(f"Set file for user {id} to {file}.")
+    if not users.get(id):
+        update.effective_message.reply_text(f"User with id {id} does not exist.")
+        return
+    users.update(id, file=file)
+    update.effective_message.reply_text(f"Set file for user {id} to {file}.")
 
 
 def _handle_get_users(update: Update, context: CallbackContext):
     """Let the admin get a list of users."""
-    with get_shelve() as data:
-        u = data[str(update.effective_user.id)]
-        if not u or not u["admin"]:
-            update.effective_message.reply_text("You are not authorized to see users.")
-        for id, user in data.items():
-            name = user.get("name")
-            file = user.get("file")
-            acct = user.get("account")
-            wacct = user.get("withdrawal_account")
-            msg = f"""*{name}*
+    users = get_users()
+    u = users.get(str(update.effective_user.id))
+    if not u or not u["admin"]:
+        update.effective_message.reply_text("You are not authorized to see users.")
+    for id, user in users.items():
+        name = user.get("name")
+        file = user.get("file")
+        acct = user.get("account")
+        wacct = user.get("withdrawal_account")
+        msg = f"""*{name}*
 `{id}`
 `    file: ``{file}`
 ` account: ``{acct}`
 `withdraw: ``{wacct}`
 `   admin: ``{user["admin"]}`
 """
-            update.effective_message.reply_markdown(msg)
+        update.effective_message.reply_markdown(msg)
 
 
 def _handle_check_config(update: Update, context: CallbackContext):
@@ -219,7 +225,9 @@ def _handle_check_config(update: Update, context: CallbackContext):
     else:
         f: str = context.user_data["opts"]["file"]
         f = f.replace("%Y", f"{date.today():%Y}").replace("%M", f"{date.today():%m}")
-        context.user_data["opts"]["file"] = f
+        with data_lock:
+            context.user_data["opts"]["file"] = f
+            changed_keys.mark(context.user_data, "opts")
     if not context.user_data["opts"].get("account"):
         update.effective_message.reply_text(
             "No account is specified. Please ask the admin to specify an account for you."
@@ -232,6 +240,22 @@ def _handle_check_config(update: Update, context: CallbackContext):
         raise DispatcherHandlerStop()
 
 
+def _handle_ready(update: Update, context: CallbackContext):
+    """Wait until the ledger has been loaded after startup.
+
+    Raises:
+        DispatcherHandlerStop: The ledger is still loading, don't run any more handlers.
+    """
+    if startup.wait(config.startup_timeout):
+        return
+    text = "The bot is still starting up, please try again in a moment."
+    if update.callback_query:
+        update.callback_query.answer(text)
+    else:
+        update.effective_message.reply_text(text)
+    raise DispatcherHandlerStop()
+
+
 def _handle_withdraw(update: Update, context: CallbackContext):
     """Handle the command /withdraw amount. Withdraws amount from the user's
     ``withdrawal_account`` to the user's ``account``."""
@@ -250,31 +274,40 @@ def _handle_withdraw(update: Update, context: CallbackContext):
         debit_account=context.user_data["opts"]["account"],
         amount=amount,
     )
-    try:
-        balances = _commit_tx(context, tx)
-        update.effective_message.reply_markdown(
-            quote=True,
-            text=_format_success(
+
+    def done(future: Future):
+        try:
+            balances = future.result()
+            text = _format_success(
                 beans.format_amount(tx.amount),
                 "Withdrawal",
                 balances["debit"],
                 balances["credit"],
-            ),
-        )
-    except Exception:
-        # TODO check various exception types and message, send better user message
-        _log.exception(
-            f"Can't withdraw money. Original message: '{update.effective_message.text}''"
-        )
-        update.effective_message.reply_markdown(
-            text=f"❌ Error on withdrawing money", quote=True
-        )
+            )
+            _send_success(update, text, balances)
+        except Exception:
+            # TODO check various exception types and message, send better user message
+            _log.exception(
+                f"Can't withdraw money. Original message: '{update.effective_message.text}''"
+            )
+            update.effective_message.reply_markdown(
+                text=f"❌ Error on withdrawing money", quote=True
+            )
+
+    _commit_tx(context, tx).add_done_callback(done)
 
 
 def _handle_message(update: Update, context: CallbackContext):
     """Handle an incoming text message, no command. This will try to parse a transaction
-    and complete it.
+    and complete it. Messages with several lines, or any message while a batch is
+    collected, are handled in bulk.
     """
+    if "batch" in context.user_data:
+        _add_to_batch(update, context, update.message.text.splitlines())
+        return
+    if "\n" in update.message.text.strip():
+        _commit_bulk(update, context, update.message.text.splitlines())
+        return
     try:
         tx = beans.parse_tx(update.message.text)
     except ValueError as e:
@@ -294,15 +327,8 @@ def _handle_message(update: Update, context: CallbackContext):
             # If the account exists, just commit the transaction directly
             if tx.debit_account in beans.get_expense_accounts():
                 save_narration_account(context, tx.narration, tx.debit_account)
-                balances = _commit_tx(context, tx)
-                update.effective_message.reply_markdown(
-                    text=_format_success(
-                        beans.format_amount(tx.amount),
-                        tx.debit_account,
-                        balances["credit"],
-                    ),
-                    quote=True,
-                )
+                future = _commit_tx(context, tx)
+                future.add_done_callback(_reply_committed(update, tx))
                 return
             # Otherwise, return an error
             update.effective_message.reply_text(
@@ -330,15 +356,8 @@ def _handle_message(update: Update, context: CallbackContext):
         state.tx.debit_account = acct
         # The bang means to not ask
         if update.message.text.endswith("!"):
-            balances = _commit_tx(context, state.tx)
-            update.effective_message.reply_markdown(
-                text=_format_success(
-                    beans.format_amount(state.tx.amount),
-                    state.tx.debit_account,
-                    balances["credit"],
-                ),
-                quote=True,
-            )
+            future = _commit_tx(context, state.tx)
+            future.add_done_callback(_reply_committed(update, state.tx))
             return
         save_state(context, state)
         # Ask user if they want to use that account
@@ -355,12 +374,240 @@ def _handle_message(update: Update, context: CallbackContext):
             ),
         )
         return
+    if config.suggestions > 0:
+        try:
+            state.suggestions = tuple(
+                beans.suggest_accounts(
+                    tx.narration,
+                    context.user_data["opts"]["account"],
+                    config.suggestions,
+                )
+            )
+        except beans.Error as e:
+            _log.warning(f"Can't suggest accounts: {e.message}")
     save_state(context, state)
     update.message.reply_markdown(
         text="Please choose an account", quote=True, reply_markup=(_get_btns(state))
     )
 
 
+def _handle_batch(update: Update, context: CallbackContext):
+    """Handle the command /batch. Start collecting transactions until /commit."""
+    with data_lock:
+        context.user_data["batch"] = []
+    update.effective_message.reply_text(
+        "Send me the transactions, one per line, in as many messages as you like. "
+        "Use /commit when you're done or /cancel to discard them."
+    )
+
+
+def _handle_commit(update: Update, context: CallbackContext):
+    """Handle the command /commit. Commit the transactions collected since /batch."""
+    with data_lock:
+        lines = context.user_data.pop("batch", None)
+    if lines is None:
+        update.effective_message.reply_text("There is no batch, start one with /batch.")
+        return
+    if not lines:
+        update.effective_message.reply_text("The batch was empty.")
+        return
+    _commit_bulk(update, context, lines)
+
+
+def _handle_cancel(update: Update, context: CallbackContext):
+    """Handle the command /cancel. Discard the transactions collected since /batch."""
+    with data_lock:
+        lines = context.user_data.pop("batch", None)
+    if lines is None:
+        update.effective_message.reply_text("There is no batch to cancel.")
+        return
+    update.effective_message.reply_text(f"Discarded {len(lines)} transactions.")
+
+
+def _handle_document(update: Update, context: CallbackContext):
+    """Handle an uploaded file. A CSV file has a transaction per row with the columns
+    amount, narration and, optionally, account and tags, other text files have a
+    transaction per line. The transactions are committed in bulk."""
+    doc = update.message.document
+    name = (doc.file_name or "").lower()
+    mime = doc.mime_type or ""
+    is_csv = name.endswith(".csv") or mime in ("text/csv", "text/comma-separated-values")
+    if not is_csv and not mime.startswith("text/"):
+        update.effective_message.reply_text(
+            "Please send a CSV or text file.", quote=True
+        )
+        return
+    try:
+        text = doc.get_file().download_as_bytearray().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        update.effective_message.reply_text(
+            "The file must be encoded as UTF-8.", quote=True
+        )
+        return
+    lines = _csv_lines(text) if is_csv else text.splitlines()
+    if "batch" in context.user_data:
+        _add_to_batch(update, context, lines)
+        return
+    _commit_bulk(update, context, lines)
+
+
+def _csv_lines(text: str) -> List[str]:
+    """Convert the rows of a CSV file to lines parsed by :func:`beans.parse_tx`. A first
+    row without amount is considered a header and skipped."""
+    lines = []
+    for n, row in enumerate(csv.reader(io.StringIO(text))):
+        row = [c.strip() for c in row]
+        if not any(row):
+            continue
+        if n == 0:
+            try:
+                beans.parse_amount(row[0])
+            except ValueError:
+                continue
+        amount, narration, account, tags = (row + ["", "", ""])[:4]
+        tags = " ".join(t if t.startswith("#") else f"#{t}" for t in tags.split())
+        account = f"[{account}]" if account else ""
+        lines.append(" ".join(w for w in (amount, narration, tags, account) if w))
+    return lines
+
+
+def _add_to_batch(update: Update, context: CallbackContext, lines: List[str]):
+    """Add lines to the batch collected since /batch."""
+    lines = [line.strip() for line in lines if line.strip()]
+    with data_lock:
+        batch: List[str] = context.user_data["batch"]
+        full = len(batch) + len(lines) > config.batch_max_lines
+        if not full:
+            batch.extend(lines)
+            changed_keys.mark(context.user_data, "batch")
+    if full:
+        update.effective_message.reply_text(
+            f"A batch can have at most {config.batch_max_lines} transactions, "
+            "please /commit the batch first.",
+            quote=True,
+        )
+        return
+    update.effective_message.reply_text(
+        f"📝 {len(batch)} transactions collected, /commit when you're done."
+    )
+
+
+def _commit_bulk(update: Update, context: CallbackContext, lines: List[str]):
+    """Parse a transaction per line, resolve their accounts without asking and commit
+    them all at once. Lines that can't be parsed or resolved are skipped. The user gets
+    a summary with the result of every line.
+
+    Args:
+        update (:class: telegram.Update): The update the lines were sent with.
+        context: CallbackContext used.
+        lines (:obj: List[str]): The lines to parse, blank lines are ignored.
+    """
+    lines = [line.strip() for line in lines if line.strip()]
+    if len(lines) > config.batch_max_lines:
+        update.effective_message.reply_text(
+            f"I can commit at most {config.batch_max_lines} transactions at once.",
+            quote=True,
+        )
+        return
+    try:
+        accounts = set(beans.get_expense_accounts())
+    except beans.Error as e:
+        _log.exception("Can't load beancount data in _commit_bulk: " + e.message)
+        update.effective_message.reply_text(
+            quote=True,
+            text="❌ An internal error with the accounting program occurred. Please contact the administrator.",
+        )
+        return
+
+    results = [""] * len(lines)
+    # The index of the line, the transaction and its account as shown to the user
+    pending: List[Tuple[int, beans.Transaction, str]] = []
+    for i, line in enumerate(lines):
+        try:
+            tx = beans.parse_tx(line)
+        except (ValueError, IndexError):
+            results[i] = f"❌ {line}: I don't understand this."
+            continue
+        if tx.debit_account and tx.debit_account not in accounts:
+            results[i] = f"❌ {line}: The account doesn't exist."
+            continue
+        tx.debit_account = tx.debit_account or _resolve_account(context, tx.narration)
+        if not tx.debit_account:
+            results[i] = f"❓ {line}: No account found, add one like [Food]."
+            continue
+        tx.credit_account = context.user_data["opts"]["account"]
+        pending.append((i, tx, tx.debit_account))
+
+    # Handlers run in the dispatcher's worker threads, waiting for the commit is fine
+    committed: List[Tuple[int, beans.Transaction, str, dict]] = []
+    if pending:
+        file = context.user_data["opts"]["file"]
+        queue = get_commit_queue()
+        try:
+            balances = queue.submit_many([tx for _, tx, _ in pending], file).result()
+            committed = [p + (b,) for p, b in zip(pending, balances)]
+        except ValueError as e:
+            # Find the invalid transactions: submitted at once, the queue retries
+            # them one by one when they can't be committed together
+            _log.warning(f"Can't commit {len(pending)} transactions at once: {e}")
+            futures = [queue.submit(tx, file) for _, tx, _ in pending]
+            for p, future in zip(pending, futures):
+                try:
+                    committed.append(p + (future.result(),))
+                except Exception as e:
+                    results[p[0]] = f"❌ {lines[p[0]]}: {e}"
+        except Exception as e:
+            # Pulling or pushing failed, the transactions may have been appended
+            # already and must not be appended again
+            _log.exception(f"Can't sync {len(pending)} transactions: {e}")
+            for i, _, _ in pending:
+                results[i] = f"❌ {lines[i]}: {e}"
+
+    for i, tx, account, _ in committed:
+        save_narration_account(context, tx.narration, account)
+        results[i] = f"✅ {beans.format_amount(tx.amount)} {tx.narration} → {account}"
+
+    text = _format_bulk(results)
+    text += f"\n\nCommitted {len(committed)} of {len(lines)} transactions.\n"
+    if not committed:
+        update.effective_message.reply_markdown(text=text, quote=True)
+        return
+    balances = committed[-1][3]
+    _send_success(update, text + f"Balance: {balances['credit']}\n", balances)
+
+
+def _resolve_account(context: CallbackContext, narration: str) -> str:
+    """Get the account last used with the narration, or the best suggestion for it.
+
+    Returns:
+        The account or an empty string if there is none.
+    """
+    if acct := get_narration_account(context, narration):
+        return acct
+    if config.suggestions > 0:
+        suggestions = beans.suggest_accounts(
+            narration, context.user_data["opts"]["account"], 1
+        )
+        if suggestions:
+            return suggestions[0]
+    return ""
+
+
+def _format_bulk(results: List[str]) -> str:
+    """Format the results of a bulk commit as markdown. If the message would get too
+    long, only the lines that weren't committed are listed."""
+    lines = [escape_markdown(r) for r in results]
+    text = "\n".join(lines)
+    # Leave room for the totals and the balance
+    limit = MAX_MESSAGE_LENGTH - 200
+    if len(text) > limit:
+        text = "\n".join(line for line in lines if not line.startswith("✅"))
+    if len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        text = text[: cut if cut > 0 else limit] + "\n…"
+    return text
+
+
 def _handle_account_callback(update: Update, context: CallbackContext):
     """Handle callbacks starting with "account". These callbacks mean
     the user selected an expense account option. This handler parses the
@@ -368,12 +615,11 @@ def _handle_account_callback(update: Update, context: CallbackContext):
     try:
         query: CallbackQuery = update.callback_query
         data = query.data.split(":")
-        state = get_state(context, data[1])
+        # Take the state so that a second tap running concurrently doesn't get it too
+        state = pop_state(context, data[1])
         if not state:
-            _log.error(
-                f"State with id {data[1]} not found in _handle_account_callback."
-            )
-            raise ValueError(f"State with id {data[1]} not found.")
+            _answer_state_gone(query, data[1])
+            return
         if data[2] == "back":
             # Remove last element from path
             state.current_path = ":".join(state.current_path.split(":")[:-1])
@@ -382,33 +628,60 @@ def _handle_account_callback(update: Update, context: CallbackContext):
                 state.current_path += ":"
             # data[2] contains the index the user chose
             state.current_path += state.accounts[int(data[2])]
-            if state.current_path in beans.get_expense_accounts():
+            node = beans.get_expense_tree(check=False).find(state.current_path)
+            if node and node.leaf:
                 state.tx.debit_account = state.current_path
-                # Remove the state, we don't need it anymore
-                delete_state(context, data[2])
                 save_narration_account(
                     context, state.tx.narration, state.tx.debit_account
                 )
-                balances = _commit_tx(context, state.tx)
-                update.effective_message.edit_text(
-                    text=_format_success(
-                        beans.format_amount(state.tx.amount),
-                        state.tx.debit_account,
-                        balances["credit"],
-                    ),
-                    quote=True,
-                    parse_mode=ParseMode.MARKDOWN,
-                )
+                future = _commit_tx(context, state.tx)
+                future.add_done_callback(_reply_committed(update, state.tx, edit=True))
                 return
 
-        state.accounts = _get_options_for_path(state.current_path)
+        state.accounts = _get_options_for_path(state.current_path, check=False)
+        # The user goes on to the next level, put the state back
+        save_state(context, state)
         update.effective_message.edit_reply_markup(reply_markup=_get_btns(state))
     except Exception as e:
         _log.exception(f"Exception caught in _handle_account_callback: {e}")
         update.effective_message.edit_text(
             quote=True, text="An error occurred, please try again later!"
         )
-        update.effective_message.reply_markup(
+        update.effective_message.reply_markdown(
+            text=f"❌ `{update.effective_message.reply_to_message.text}`"
+        )
+
+
+def _answer_state_gone(query: CallbackQuery, id: str):
+    """Answer a callback whose state doesn't exist (anymore). Either it expired or
+    another tap on the message took it, which then answers the message."""
+    _log.warning(f"State with id {id} not found.")
+    query.answer("This transaction was already handled or has expired.")
+
+
+def _handle_suggestion_callback(update: Update, context: CallbackContext):
+    """Handle callbacks starting with "suggestion". These callbacks mean the user
+    chose one of the accounts suggested for the narration, the transaction is committed."""
+    state = None
+    try:
+        query: CallbackQuery = update.callback_query
+        data = query.data.split(":")
+        state = pop_state(context, data[1])
+        if not state:
+            _answer_state_gone(query, data[1])
+            return
+        state.tx.debit_account = state.suggestions[int(data[2])]
+        save_narration_account(context, state.tx.narration, state.tx.debit_account)
+        future = _commit_tx(context, state.tx)
+        future.add_done_callback(_reply_committed(update, state.tx, edit=True))
+    except Exception as e:
+        _log.exception(
+            f"{type(e)} in _handle_suggestion_callback: {e}. User: {update.effective_user}. State: {state}."
+        )
+        update.effective_message.edit_text(
+            quote=True, text="An error occurred, please try again later!"
+        )
+        update.effective_message.reply_markdown(
             text=f"❌ `{update.effective_message.reply_to_message.text}`"
         )
 
@@ -420,23 +693,12 @@ def _handle_confirm_callback(update: Update, context: CallbackContext):
     try:
         query: CallbackQuery = update.callback_query
         data = query.data.split(":")
-        state = get_state(context, data[1])
+        state = pop_state(context, data[1])
         if not state:
-            _log.error(
-                f"State with id {data[1]} not found in _handle_account_callback."
-            )
-            raise ValueError(f"State with id {data[1]} not found.")
-        delete_state(context, data[1])
-        balances = _commit_tx(context, state.tx)
-        update.effective_message.edit_text(
-            text=_format_success(
-                beans.format_amount(state.tx.amount),
-                state.tx.debit_account,
-                balances["credit"],
-            ),
-            quote=True,
-            parse_mode=ParseMode.MARKDOWN,
-        )
+            _answer_state_gone(query, data[1])
+            return
+        future = _commit_tx(context, state.tx)
+        future.add_done_callback(_reply_committed(update, state.tx, edit=True))
     except Exception as e:
         _log.exception(
             f"{type(e)} in _commit_tx: {e}. User: {update.effective_user}. State: {state}."
@@ -451,26 +713,99 @@ def _handle_confirm_callback(update: Update, context: CallbackContext):
 
 def _commit_tx(
     context: CallbackContext, tx: beans.Transaction, push_message=""
-) -> dict:
-    """Save the transaction and sync. This raises any exception that might be thrown.
-    
+) -> Future:
+    """Queue the transaction to be saved and synced. Transactions arriving at the same
+    time are committed together, see :class:`CommitQueue`.
+
     Args:
         context: CallbackContext used.
         tx (:class: beans.Transaction): The transaction to commit.
         push_message (:obj: str [optional]): The message to be thrown.
-    
+
     Returns:
-        Both account balances as dictionary.
+        A future resolving to both account balances as dictionary. It raises any
+        exception that was thrown while committing.
     """
-    config.synchronizer.pull()
     # If the credit account is not defined, set it to the user's account
     if not tx.credit_account:
         tx.credit_account = context.user_data["opts"]["account"]
 
-    balances = beans.append_tx(tx, context.user_data["opts"]["file"])
-    config.synchronizer.push(context.user_data["opts"]["file"], msg=push_message)
-    save_narration_account(context, tx.narration, tx.debit_account)
-    return balances
+    future = get_commit_queue().submit(
+        tx, context.user_data["opts"]["file"], push_message
+    )
+
+    def done(f: Future):
+        if not f.exception():
+            save_narration_account(context, tx.narration, tx.debit_account)
+
+    future.add_done_callback(done)
+    return future
+
+
+def _reply_committed(update: Update, tx: beans.Transaction, edit: bool = False):
+    """Get a callback for :func:`_commit_tx`'s future that tells the user whether the
+    transaction has been committed.
+
+    Args:
+        update (:class: telegram.Update): The update that lead to the transaction.
+        tx (:class: beans.Transaction): The committed transaction.
+        edit (:obj: bool [optional]): Edit the message with the result instead of replying to it.
+    """
+
+    def done(future: Future):
+        try:
+            balances = future.result()
+        except Exception as e:
+            _log.exception(
+                f"{type(e)} in _commit_tx: {e}. User: {update.effective_user}. Transaction: {tx}."
+            )
+            if edit:
+                update.effective_message.edit_text(
+                    quote=True, text="An error occurred, please try again later!"
+                )
+                update.effective_message.reply_markdown(
+                    text=f"❌ `{update.effective_message.reply_to_message.text}`"
+                )
+            else:
+                update.effective_message.reply_text(
+                    quote=True, text="An error occurred, please try again later!"
+                )
+                update.effective_message.reply_markdown(
+                    text=f"❌ `{update.effective_message.text}`"
+                )
+            return
+
+        text = _format_success(
+            beans.format_amount(tx.amount), tx.debit_account, balances["credit"]
+        )
+        _send_success(update, text, balances, edit)
+
+    return done
+
+
+def _send_success(update: Update, text: str, balances: dict, edit: bool = False):
+    """Send a success message. If the transaction is still being pushed in the background,
+    the message says so until the push is done.
+
+    Args:
+        update (:class: telegram.Update): The update that lead to the transaction.
+        text (:obj: str): The success message, see :func:`_format_success`.
+        balances (:obj: dict): The balances returned by :func:`_commit_tx`'s future.
+        edit (:obj: bool [optional]): Edit the message instead of replying to it.
+    """
+    synced: Optional[Future] = balances.get("synced")
+    pending = synced is not None and not synced.done()
+    msg_text = text + "⏳ Saved locally, syncing…\n" if pending else text
+    if edit:
+        msg = update.effective_message.edit_text(
+            text=msg_text, quote=True, parse_mode=ParseMode.MARKDOWN
+        )
+    else:
+        msg = update.effective_message.reply_markdown(text=msg_text, quote=True)
+    if pending:
+        synced.add_done_callback(  # type: ignore
+            lambda _: msg.edit_text(text=text, parse_mode=ParseMode.MARKDOWN)
+        )
 
 
 def _format_success(amount: str, account: str, cash: str, bank: str = "") -> str:
@@ -493,22 +828,18 @@ Balance: {cash}
     return msg
 
 
-def _get_options_for_path(path: str) -> List[str]:
-    """Returns all possible expense accounts for the current path"""
-    values = beans.get_expense_accounts()
-    # In case of None, make empty string
-    if not path:
-        path = ""
-
-    # Filter only accounts that start with our current path
-    values = [v for v in values if v.startswith(path)]
-    # Strip prefix if exists
-    if path:
-        values = [v.split(path + ":")[1] for v in values]
-    # Remove suffix
-    values = [v.split(":")[0] for v in values]
+def _get_options_for_path(path: str, check: bool = True) -> List[str]:
+    """Returns all possible expense accounts for the current path.
 
-    return sorted(list(set(values)))
+    Args:
+        path (:obj: str): The current path, relative to the expense accounts.
+        check (:obj: bool [optional]): Check the ledger for changes first. Button callbacks
+            skip the check, they use the accounts the conversation started with.
+    """
+    node = beans.get_expense_tree(check).find(path or "")
+    if not node:
+        return []
+    return list(node.options)
 
 
 def _get_btns(state: ConversationState) -> InlineKeyboardMarkup:
@@ -525,6 +856,12 @@ def _get_btns(state: ConversationState) -> InlineKeyboardMarkup:
         callback_path = f"accounts:{state.id}:back"
         btns.append(InlineKeyboardButton("⬅️ Back", callback_data=callback_path))
 
+    # Suggested accounts come first, they are only offered at the top level
+    if not state.current_path:
+        for i, acct in enumerate(state.suggestions):
+            callback_path = f"suggestion:{state.id}:{i}"
+            btns.append(InlineKeyboardButton(f"⭐ {acct}", callback_data=callback_path))
+
     # Build up other buttons
     for i in range(len(state.accounts)):
         # Our callback path is:
@@ -0,0 +1,223 @@
+import json
+import pickle
+import sqlite3
+import threading
+from collections import defaultdict
+from logging import getLogger
+from os.path import exists
+from typing import Any, ContextManager, Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence
+
+import metrics
+
+_log = getLogger("persistence")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS data (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (kind, id, key)
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB,
+    PRIMARY KEY (name, key)
+);
+"""
+
+# Kinds of rows in the data table. bot_data is stored with an empty id.
+_USER = "user"
+_CHAT = "chat"
+_BOT = "bot"
+
+
+class SQLitePersistence(BasePersistence):
+    """SQLitePersistence stores user_data, chat_data, bot_data and conversations in
+    a SQLite database in WAL mode. Every key of a user's or chat's data is its own
+    row, holding the pickled value. Only the values that were assigned anew or marked
+    as changed in ``changed_keys`` are pickled and, if they differ from what was last
+    written, upserted. Every update is committed on its own, so a crash loses at most
+    the update in progress.
+
+    If the database doesn't exist yet but a file written by ``PicklePersistence``
+    does, its data is imported.
+
+    Attributes:
+        filename (:obj: str): Path of the SQLite database.
+        legacy_filename (:obj: str [optional]): Path of a ``PicklePersistence`` file to import.
+        data_lock (:obj: ContextManager [optional]): Held while pickling data. Handlers
+            running on worker threads must hold it while changing the data, otherwise
+            it may change while it's pickled.
+        changed_keys (:obj: ChangedKeys [optional]): The keys whose values were changed
+            in place, see :class:`bot.storage.ChangedKeys`. If not set, all values are
+            pickled on every update.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        legacy_filename: Optional[str] = None,
+        store_user_data: bool = True,
+        store_chat_data: bool = True,
+        store_bot_data: bool = True,
+        data_lock: Optional[ContextManager] = None,
+        changed_keys: Optional[Any] = None,
+    ):
+        super().__init__(
+            store_user_data=store_user_data,
+            store_chat_data=store_chat_data,
+            store_bot_data=store_bot_data,
+        )
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._data_lock = data_lock or threading.RLock()
+        self._changed_keys = changed_keys
+        created = not exists(filename)
+        # Updates may be persisted from the dispatcher's worker threads
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        # The values and their pickles as last written, used to find the keys that changed
+        self._written: Dict[Tuple[str, str], Dict[str, Tuple[Any, bytes]]] = {}
+        if created and legacy_filename and exists(legacy_filename):
+            self._import(legacy_filename)
+
+    def get_user_data(self) -> defaultdict:
+        return self._load(_USER, int)
+
+    def get_chat_data(self) -> defaultdict:
+        return self._load(_CHAT, int)
+
+    def get_bot_data(self) -> dict:
+        return self._load(_BOT, str).get("", {})
+
+    def get_conversations(self, name: str) -> dict:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, state FROM conversations WHERE name = ?", (name,)
+            ).fetchall()
+        return {
+            tuple(json.loads(key)): pickle.loads(state) if state else None
+            for key, state in rows
+        }
+
+    @metrics.registry.timed("persistence.update")
+    def update_conversation(self, name: str, key: tuple, new_state: Optional[object]):
+        with self._lock, self._db:
+            if new_state is None:
+                self._db.execute(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    (name, json.dumps(key)),
+                )
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                (name, json.dumps(key), pickle.dumps(new_state)),
+            )
+
+    def update_user_data(self, user_id: int, data: dict):
+        self._update(_USER, str(user_id), data)
+
+    def update_chat_data(self, chat_id: int, data: dict):
+        self._update(_CHAT, str(chat_id), data)
+
+    def update_bot_data(self, data: dict):
+        self._update(_BOT, "", data)
+
+    @metrics.registry.timed("persistence.flush")
+    def flush(self):
+        """Move the committed updates from the write-ahead log into the database. The
+        connection stays open, updates may still be persisted until :meth:`close`."""
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        """Close the database. Only call it once the dispatcher has stopped."""
+        with self._lock:
+            self._db.close()
+
+    def _load(self, kind: str, id_type) -> defaultdict:
+        """Load all rows of a kind, grouped by their id."""
+        result: defaultdict = defaultdict(dict)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, key, value FROM data WHERE kind = ?", (kind,)
+            ).fetchall()
+            for id, key, value in rows:
+                try:
+                    loaded = pickle.loads(value)
+                except Exception as e:
+                    # A value that can't be loaded anymore shouldn't lose the rest
+                    _log.warning(f"Skipping {kind} data {id}/{key}: {e}")
+                    continue
+                result[id_type(id)][key] = loaded
+                self._written.setdefault((kind, id), {})[key] = (loaded, value)
+        return result
+
+    @metrics.registry.timed("persistence.update")
+    def _update(self, kind: str, id: str, data: dict):
+        """Upsert the keys of data whose pickled value changed and delete the keys
+        that were removed. Values that are still the objects last written and weren't
+        marked as changed aren't pickled again."""
+        # Updates of the same data are written in the order they were pickled
+        with self._lock:
+            written = self._written.setdefault((kind, id), {})
+            with self._data_lock:
+                marked: Optional[Set[str]] = None
+                if self._changed_keys is not None:
+                    marked = self._changed_keys.pop(data)
+                values = {
+                    str(k): (v, pickle.dumps(v))
+                    for k, v in data.items()
+                    if marked is None
+                    or str(k) in marked
+                    or str(k) not in written
+                    or written[str(k)][0] is not v
+                }
+                keys = {str(k) for k in data}
+            changed = [
+                (k, p)
+                for k, (v, p) in values.items()
+                if k not in written or written[k][1] != p
+            ]
+            removed = [k for k in written if k not in keys]
+            if changed or removed:
+                try:
+                    with self._db:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO data (kind, id, key, value) VALUES (?, ?, ?, ?)",
+                            [(kind, id, k, p) for k, p in changed],
+                        )
+                        self._db.executemany(
+                            "DELETE FROM data WHERE kind = ? AND id = ? AND key = ?",
+                            [(kind, id, k) for k in removed],
+                        )
+                except Exception:
+                    # Their marks are gone, pickle them again with the next update
+                    for k, _ in changed:
+                        written.pop(k, None)
+                    raise
+            # Also keep the values whose pickles didn't change, they are compared by identity
+            written.update(values)
+            for k in removed:
+                del written[k]
+
+    def _import(self, legacy_filename: str):
+        """Import the data of a single file written by ``PicklePersistence``."""
+        _log.info(f"Importing persisted data from {legacy_filename}")
+        with open(legacy_filename, "rb") as file:
+            data = pickle.load(file)
+        for id, d in data.get("user_data", {}).items():
+            self._update(_USER, str(id), d)
+        for id, d in data.get("chat_data", {}).items():
+            self._update(_CHAT, str(id), d)
+        if data.get("bot_data"):
+            self._update(_BOT, "", data["bot_data"])
+        for name, conversations in data.get("conversations", {}).items():
+            for key, state in conversations.items():
+                self.update_conversation(name, key, state)
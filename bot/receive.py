@@ -0,0 +1,38 @@
+from logging import getLogger
+
+from telegram.ext import Updater
+
+import config
+
+
+def start(updater: Updater):
+    """Start receiving updates, by polling or, if a webhook URL is configured, with a
+    webhook server.
+
+    Python-telegram-bot 12 doesn't support the ``secret_token`` of webhooks, so the
+    secret is made part of the webhook's path instead. If no certificate is
+    configured, TLS is terminated by a proxy and the webhook has to be registered
+    here, the library only registers it if it terminates TLS itself.
+    """
+    if not config.webhook_url:
+        updater.start_polling()
+        return
+
+    path = config.webhook_path.strip("/")
+    if config.webhook_secret:
+        path = f"{path}/{config.webhook_secret}"
+    url = f"{config.webhook_url.rstrip('/')}/{path}"
+    tls = bool(config.webhook_cert and config.webhook_key)
+    updater.start_webhook(
+        listen=config.webhook_listen,
+        port=config.webhook_port,
+        url_path=path,
+        cert=config.webhook_cert if tls else None,
+        key=config.webhook_key if tls else None,
+        webhook_url=url,
+    )
+    if not tls:
+        updater.bot.set_webhook(url=url)
+    getLogger("bot").info(
+        f"Receiving updates on {config.webhook_listen}:{config.webhook_port}/{config.webhook_path.strip('/')}"
+    )
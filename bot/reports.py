@@ -0,0 +1,213 @@
+from datetime import date, timedelta
+from logging import getLogger
+from typing import List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.utils.helpers import escape_markdown
+
+import analytics
+import beans
+import config
+
+_log = getLogger("reports")
+
+REPORT_USAGE = """Usage:
+    `/report month [MONTHS]` spending per month, the last 12 months by default
+    `/report category [PERIOD]` spending per category, this month by default
+    `/report tag #TAG` spending per category of the transactions with a tag
+`PERIOD` is a year like `2024`, a month like `2024-05` or `all`."""
+
+
+def _handle_report(update: Update, context: CallbackContext):
+    """Handle the command /report. Sends a report of the user's expenses, see
+    :data:`REPORT_USAGE`."""
+    args = context.args or []
+    kind = args[0] if args else "month"
+    try:
+        if kind == "month":
+            text = _report_months(context, int(args[1]) if len(args) > 1 else 12)
+        elif kind == "category":
+            text = _report_categories(context, *_parse_period(args[1:]))
+        elif kind == "tag" and len(args) == 2:
+            text = _report_tag(context, args[1].lstrip("#"))
+        else:
+            update.effective_message.reply_markdown(REPORT_USAGE)
+            return
+    except ValueError:
+        update.effective_message.reply_markdown(REPORT_USAGE)
+        return
+    except ImportError as e:
+        update.effective_message.reply_text(f"Reports are not available: {e}")
+        return
+    except beans.Error as e:
+        _log.exception("Can't load beancount data in _handle_report: " + e.message)
+        update.effective_message.reply_text(
+            "❌ An internal error with the accounting program occurred. Please contact the administrator."
+        )
+        return
+    update.effective_message.reply_markdown(text)
+
+
+def _handle_spent(update: Update, context: CallbackContext):
+    """Handle the command /spent [period]. Sends what the user spent today, this month
+    and this year, or in the given period."""
+    try:
+        if context.args:
+            start, end, label = _parse_period(context.args)
+            periods = [(start, end, label)]
+        else:
+            today = date.today()
+            periods = [
+                (today, None, "Today"),
+                (today.replace(day=1), None, "This month"),
+                (today.replace(month=1, day=1), None, "This year"),
+            ]
+        lines = [
+            (label, _expenses(context, start=start, end=end)[0])
+            for start, end, label in periods
+        ]
+    except ValueError:
+        update.effective_message.reply_text("Usage: /spent [2024|2024-05|all]")
+        return
+    except ImportError as e:
+        update.effective_message.reply_text(f"Reports are not available: {e}")
+        return
+    except beans.Error as e:
+        _log.exception("Can't load beancount data in _handle_spent: " + e.message)
+        update.effective_message.reply_text(
+            "❌ An internal error with the accounting program occurred. Please contact the administrator."
+        )
+        return
+    update.effective_message.reply_markdown(_format_table("Spent", lines))
+
+
+def _expenses(
+    context: CallbackContext, columns: Optional[analytics.Columns] = None, **conditions
+):
+    """Select the expenses in the ledger's currency of the transactions on the user's
+    account.
+
+    Args:
+        context: CallbackContext used.
+        columns (:class: analytics.Columns [optional]): The columns to select from,
+            by default the ones of the current ledger.
+        conditions: Further conditions, see :meth:`analytics.Columns.select`.
+
+    Returns:
+        The total in cents, the columns and the mask of the selected postings.
+    """
+    if columns is None:
+        columns = beans.get_columns()
+    mask = columns.select(
+        account=context.user_data["opts"]["account"],
+        prefix=beans.get_expense_prefix(),
+        currency=config.bean_currency,
+        **conditions,
+    )
+    return columns.total(mask), columns, mask
+
+
+def _report_months(context: CallbackContext, months: int) -> str:
+    lines, total = _month_sums(context, months)
+    lines.append(("Average", total // len(lines)))
+    lines.append(("Total", total))
+    return _format_table("Expenses per month", lines)
+
+
+def _month_sums(
+    context: CallbackContext, months: int, columns: Optional[analytics.Columns] = None
+) -> Tuple[List[Tuple[str, int]], int]:
+    """Sum the user's expenses per month of the last months, including this one.
+
+    Returns:
+        Each month as ``YYYY-MM`` with its sum in cents, by date, and the total.
+
+    Raises:
+        ValueError: Less than one month was requested.
+    """
+    if months < 1:
+        raise ValueError("At least one month must be reported")
+    today = date.today()
+    start = today.replace(day=1)
+    for _ in range(months - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+    total, columns, mask = _expenses(context, columns, start=start)
+    sums = dict(columns.by_month(mask))
+    # Months without expenses are listed as well
+    lines = []
+    month = start
+    while month <= today:
+        lines.append((f"{month:%Y-%m}", sums.get(month, 0)))
+        month = (month + timedelta(days=32)).replace(day=1)
+    return lines, total
+
+
+def _report_categories(
+    context: CallbackContext, start: Optional[date], end: Optional[date], label: str
+) -> str:
+    lines, total = _category_sums(context, start, end)
+    lines.append(("Total", total))
+    return _format_table(f"Expenses per category ({label})", lines)
+
+
+def _category_sums(
+    context: CallbackContext,
+    start: Optional[date],
+    end: Optional[date],
+    columns: Optional[analytics.Columns] = None,
+) -> Tuple[List[Tuple[str, int]], int]:
+    """Sum the user's expenses in a period per top-level expense category.
+
+    Returns:
+        Each category with its sum in cents, the largest first, and the total.
+    """
+    total, columns, mask = _expenses(context, columns, start=start, end=end)
+    return columns.by_account(mask, beans.get_expense_prefix(), depth=1), total
+
+
+def _report_tag(context: CallbackContext, tag: str) -> str:
+    total, columns, mask = _expenses(context, tag=tag)
+    if not mask.any():
+        return escape_markdown(f"No expenses tagged #{tag}.")
+    dates = columns.dates[mask]
+    lines = columns.by_account(mask, beans.get_expense_prefix(), depth=1)
+    lines.append(("Total", total))
+    return _format_table(f"#{tag}, {dates.min()} to {dates.max()}", lines)
+
+
+def _parse_period(args: List[str]) -> Tuple[Optional[date], Optional[date], str]:
+    """Parse a period given as year, month or ``all``, this month if there is none.
+
+    Returns:
+        The first day of the period, the first day after it and the period's label.
+        The days are None for ``all``.
+
+    Raises:
+        ValueError: The period is invalid.
+    """
+    if not args:
+        start = date.today().replace(day=1)
+    elif len(args) != 1:
+        raise ValueError("Only one period can be given")
+    elif args[0] == "all":
+        return None, None, "all"
+    elif len(args[0]) == 4:
+        start = date(int(args[0]), 1, 1)
+        return start, start.replace(year=start.year + 1), args[0]
+    else:
+        year, month = args[0].split("-")
+        start = date(int(year), int(month), 1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end, f"{start:%Y-%m}"
+
+
+def _format_table(title: str, lines: List[Tuple[str, int]]) -> str:
+    """Format labels and amounts in cents as a markdown message with aligned columns."""
+    amounts = [beans.format_amount(a) for _, a in lines]
+    width = max([len(label) for label, _ in lines] + [0])
+    awidth = max([len(a) for a in amounts] + [0])
+    rows = "\n".join(
+        f"{label:<{width}}  {a:>{awidth}}" for (label, _), a in zip(lines, amounts)
+    )
+    return f"*{escape_markdown(title)}*\n```\n{rows}\n```"
@@ -1,46 +1,131 @@
+import json
+import sys
+import threading
+from functools import wraps
+from logging import getLogger
 from os.path import join
+from typing import Callable, TextIO
 
+from telegram import Bot, Update
 from telegram.ext import (
     CallbackQueryHandler,
     CommandHandler,
+    Dispatcher,
     Filters,
     MessageHandler,
-    PicklePersistence,
     Updater,
 )
+from telegram.ext.dispatcher import DispatcherHandlerStop, run_async
 
+import beans
 import config
+import metrics
 
+from . import receive, startup
+from .charts import _handle_chart
+from .commits import get_commit_queue
 from .handlers import (
     _handle_account_callback,
     _handle_add_user,
     _handle_auth,
+    _handle_batch,
+    _handle_cancel,
     _handle_check_config,
+    _handle_commit,
     _handle_confirm_callback,
+    _handle_document,
     _handle_error,
     _handle_get_users,
     _handle_help,
     _handle_message,
+    _handle_ready,
     _handle_set_user_accounts,
     _handle_set_user_file,
     _handle_start,
+    _handle_suggestion_callback,
     _handle_withdraw,
 )
+from .persistence import SQLitePersistence
+from .reports import _handle_report, _handle_spent
+from .shard import run_front
+from .stats import TimedRequest, _handle_stats, serve_metrics, write_metrics
+from .storage import changed_keys, data_lock, sweep_states
+from .validation import DeepValidator
 
 
 def run():
+    """Run the bot. If ledgers are configured, this process only routes updates to
+    one worker process per ledger. A worker reads the updates from its stdin instead
+    of polling for them."""
+    if config.front:
+        run_front()
+        return
+
+    updater = _create_updater()
+    if config.ledger_name:
+        _serve(updater, sys.stdin)
+    else:
+        receive.start(updater)
+        updater.idle()
+    _close_persistence(updater.dispatcher)
+
+    # Keep the ledger with the transactions added since it was loaded for the next start
+    beans.save_snapshot()
+
+
+def _create_updater() -> Updater:
+    """Create the updater with its persistence and handlers and start the background
+    work: committing, validating and loading the ledger."""
+    # Register persistence for user_data and chat_data, get bot
+    p = SQLitePersistence(
+        join(config.db_dir, "telegram.sqlite"),
+        join(config.db_dir, "telegram.pickle"),
+        data_lock=data_lock,
+        changed_keys=changed_keys,
+    )
+    # The bot's requests are timed, the connection pool is sized as the updater would
+    request = TimedRequest(con_pool_size=config.workers + 4)
+    updater = Updater(
+        bot=Bot(config.telegram_api_token, request=request),
+        use_context=True,
+        persistence=p,
+        workers=config.workers,
+    )
+    _add_handlers(updater.dispatcher)
+
+    # Regularly discard account selections that were never finished
+    updater.job_queue.run_repeating(
+        sweep_states, config.state_sweep_interval, first=config.state_sweep_interval
+    )
+
+    # Start committing, this pushes what is left in the outbox from the last run
+    queue = get_commit_queue()
+
+    # Validate the whole ledger in the background and notify admins about errors
+    validator = DeepValidator(updater.bot, config.deep_validation_delay)
+    if config.deep_validation == "commit":
+        queue.on_commit = validator.request
+    elif config.deep_validation == "schedule":
+        updater.job_queue.run_repeating(
+            validator.job, config.deep_validation_interval, first=0
+        )
+    if config.metrics_file:
+        updater.job_queue.run_repeating(write_metrics, config.metrics_interval)
+    if config.metrics_port:
+        serve_metrics(config.metrics_listen, config.metrics_port)
+    # Pull and load the ledger in the background while already polling for updates
+    startup.start()
+    return updater
+
+
+def _add_handlers(dispatcher: Dispatcher):
     # Define groups under which the handlers run. Auth group will first authorize users,
     # then default group will run with lower priority. Config group will configure user's
-    # data
+    # data.
     AUTH_GROUP = 0
     CONFIG_GROUP = 1
     DEFAULT_GROUP = 5
 
-    # Register persistence for user_data and chat_data, get bot
-    p = PicklePersistence(join(config.db_dir, "telegram.pickle"))
-    updater = Updater(config.telegram_api_token, use_context=True, persistence=p)
-    dispatcher = updater.dispatcher
-
     # Handle all errors
     dispatcher.add_error_handler(_handle_error)
 
@@ -57,26 +142,152 @@ def run():
         CommandHandler("account", _handle_set_user_accounts), CONFIG_GROUP
     )
     dispatcher.add_handler(CommandHandler("users", _handle_get_users), CONFIG_GROUP)
+    dispatcher.add_handler(CommandHandler("stats", _handle_stats), CONFIG_GROUP)
     # Check if the configuration is valid, otherwise stop all other handlers from running
     dispatcher.add_handler(
         MessageHandler(Filters.all, _handle_check_config), group=CONFIG_GROUP
     )
 
-    # Run the default group last
-    dispatcher.add_handler(CommandHandler("help", _handle_help), DEFAULT_GROUP)
-    dispatcher.add_handler(CommandHandler("withdraw", _handle_withdraw), DEFAULT_GROUP)
-    dispatcher.add_handler(MessageHandler(Filters.text, _handle_message), DEFAULT_GROUP)
+    # Run the default group last. Its handlers run in the dispatcher's worker threads,
+    # so that a user doesn't wait for another user's handlers to finish. Those that need
+    # the ledger wait there until it's loaded after startup
+    dispatcher.add_handler(CommandHandler("help", _timed(_handle_help)), DEFAULT_GROUP)
+    dispatcher.add_handler(
+        CommandHandler("withdraw", _in_worker(_handle_withdraw)),
+        DEFAULT_GROUP,
+    )
+    dispatcher.add_handler(
+        CommandHandler("report", _in_worker(_handle_report)),
+        DEFAULT_GROUP,
+    )
+    dispatcher.add_handler(
+        CommandHandler("spent", _in_worker(_handle_spent)),
+        DEFAULT_GROUP,
+    )
+    # Charts are rendered in a worker thread as well, they can take a while
+    dispatcher.add_handler(
+        CommandHandler("chart", _in_worker(_handle_chart)),
+        DEFAULT_GROUP,
+    )
+    dispatcher.add_handler(
+        CommandHandler("batch", _timed(_handle_batch)), DEFAULT_GROUP
+    )
+    dispatcher.add_handler(
+        CommandHandler("commit", _in_worker(_handle_commit)),
+        DEFAULT_GROUP,
+    )
+    dispatcher.add_handler(
+        CommandHandler("cancel", _timed(_handle_cancel)), DEFAULT_GROUP
+    )
+    dispatcher.add_handler(
+        MessageHandler(
+            Filters.text & ~Filters.command,
+            _in_worker(_handle_message),
+        ),
+        DEFAULT_GROUP,
+    )
+    dispatcher.add_handler(
+        MessageHandler(Filters.document, _in_worker(_handle_document)),
+        DEFAULT_GROUP,
+    )
 
     # Handle callbacks (when a user presses a button, the response is logged as callback)
     dispatcher.add_handler(
-        CallbackQueryHandler(_handle_confirm_callback, pattern=r"^confirm"),
+        CallbackQueryHandler(
+            _in_worker(_handle_confirm_callback),
+            pattern=r"^confirm",
+        ),
+        DEFAULT_GROUP,
+    )
+    dispatcher.add_handler(
+        CallbackQueryHandler(
+            _in_worker(_handle_account_callback),
+            pattern=r"^account",
+        ),
         DEFAULT_GROUP,
     )
     dispatcher.add_handler(
-        CallbackQueryHandler(_handle_account_callback, pattern=r"^account"),
+        CallbackQueryHandler(
+            _in_worker(_handle_suggestion_callback),
+            pattern=r"^suggestion",
+        ),
         DEFAULT_GROUP,
     )
 
-    # Run
-    updater.start_polling()
-    updater.idle()
+
+def _in_worker(callback: Callable) -> Callable:
+    """Run a handler that needs the ledger in a worker thread, see :func:`_when_ready`
+    and :func:`_persisted`."""
+    return run_async(_persisted(_when_ready(_timed(callback))))
+
+
+def _persisted(callback: Callable) -> Callable:
+    """Persist the user's and chat's data when a handler finishes. The dispatcher
+    persists them right after starting handlers in worker threads, changes made by
+    these would otherwise only be written with the next update."""
+
+    @wraps(callback)
+    def handler(update: Update, context):
+        try:
+            return callback(update, context)
+        finally:
+            context.dispatcher.update_persistence(update)
+
+    return handler
+
+
+def _when_ready(callback: Callable) -> Callable:
+    """Wait until the ledger has been loaded after startup before calling a handler,
+    see :func:`_handle_ready`. Only use it for handlers run in worker threads, the
+    dispatcher would block otherwise."""
+
+    @wraps(callback)
+    def handler(update: Update, context):
+        try:
+            _handle_ready(update, context)
+        except DispatcherHandlerStop:
+            return
+        return callback(update, context)
+
+    return handler
+
+
+def _timed(callback: Callable) -> Callable:
+    """Record how long each call of a handler takes, as ``handler.<name>``."""
+    return metrics.registry.timed("handler." + callback.__name__.lstrip("_"))(callback)
+
+
+def _serve(updater: Updater, lines: TextIO):
+    """Process updates read from lines of JSON until the end of the input is reached."""
+    dispatcher = updater.dispatcher
+    updater.job_queue.start()
+    # Stopping a dispatcher that isn't running yet does nothing, the thread would never end
+    ready = threading.Event()
+    thread = threading.Thread(
+        target=dispatcher.start, kwargs={"ready": ready}, name="dispatcher"
+    )
+    thread.start()
+    ready.wait()
+    try:
+        for line in lines:
+            try:
+                update = Update.de_json(json.loads(line), updater.bot)
+            except Exception as e:
+                getLogger("bot").error(f"Can't read update: {e}")
+                continue
+            updater.update_queue.put(update)
+    except KeyboardInterrupt:
+        pass
+
+    dispatcher.stop()
+    thread.join()
+    updater.job_queue.stop()
+
+
+def _close_persistence(dispatcher: Dispatcher):
+    """Persist the data changed since the last update and close the persistence. The
+    dispatcher has to be stopped, handlers in its worker threads may persist data until
+    then."""
+    if dispatcher.persistence:
+        dispatcher.update_persistence()
+        dispatcher.persistence.close()
@@ -0,0 +1,181 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from logging import getLogger
+from os.path import abspath, dirname, join
+from queue import Queue
+from typing import Dict, List, NamedTuple, Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext, TypeHandler, Updater
+
+import config
+
+from . import receive
+
+_log = getLogger("shard")
+
+MAIN = join(dirname(dirname(abspath(__file__))), "main.py")
+"""The script started for each ledger's worker."""
+
+
+class Ledger(NamedTuple):
+    """A ledger of a sharded deployment.
+
+    Attributes:
+        name (:obj: str): The ledger's name.
+        env (:obj: Dict[str, str]): Environment variables of the ledger's worker, they
+            override the environment of the routing process. ``DB_DIR`` defaults to a
+            directory named after the ledger in the routing process's ``DB_DIR``.
+        users (:obj: List[int]): IDs of the users whose updates are routed to the ledger.
+        chats (:obj: List[int]): IDs of the chats whose updates are routed to the ledger.
+    """
+
+    name: str
+    env: Dict[str, str]
+    users: List[int]
+    chats: List[int]
+
+
+def load_ledgers(path: str) -> List[Ledger]:
+    """Load the ledgers from a JSON file of the form::
+
+        {
+            "ledgers": {
+                "smith": {
+                    "env": {"BEAN_PATH": "/data/smith", "BEAN_MAIN_FILE": "main.bean"},
+                    "users": [12345678],
+                    "chats": []
+                }
+            }
+        }
+
+    Raises:
+        ValueError: The file is invalid.
+    """
+    with open(path, "r") as file:
+        data = json.load(file)
+    ledgers = []
+    for name, d in data.get("ledgers", {}).items():
+        env = {k: str(v) for k, v in d.get("env", {}).items()}
+        env.setdefault("DB_DIR", join(config.db_dir, name))
+        users = [int(u) for u in d.get("users", [])]
+        chats = [int(c) for c in d.get("chats", [])]
+        ledgers.append(Ledger(name, env, users, chats))
+    if not ledgers:
+        raise ValueError(f"No ledgers configured in {path}")
+    return ledgers
+
+
+class Shard(object):
+    """Shard runs the bot for one ledger in its own process and feeds it updates as
+    lines of JSON through its stdin. Updates are queued and written by a thread, so
+    that a slow worker never blocks the routing of other ledgers' updates. If the
+    process dies, it's started again.
+
+    Attributes:
+        ledger (:class: Ledger): The ledger served by the process.
+    """
+
+    def __init__(self, ledger: Ledger):
+        self.ledger = ledger
+        self._queue: "Queue[Optional[dict]]" = Queue()
+        self._process: Optional[subprocess.Popen] = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"shard-{ledger.name}", daemon=True
+        )
+
+    def start(self):
+        """Start the worker process."""
+        self._spawn()
+        self._thread.start()
+
+    def send(self, update: dict):
+        """Queue an update for the worker."""
+        self._queue.put(update)
+
+    def stop(self, timeout: float = 30):
+        """Close the worker's stdin after the queued updates were written and wait
+        for it to finish."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._process and self._process.poll() is None:
+            try:
+                self._process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                _log.error(f"Worker of {self.ledger.name} didn't stop, killing it")
+                self._process.kill()
+
+    def _spawn(self):
+        env = dict(os.environ, **self.ledger.env, LEDGER_NAME=self.ledger.name)
+        env.pop("LEDGERS_FILE", None)
+        os.makedirs(env["DB_DIR"], 0o755, exist_ok=True)
+        # The worker gets its own session, so that it's stopped by closing its stdin
+        # after the routing process stopped, not by signals sent to the terminal
+        self._process = subprocess.Popen(
+            [sys.executable, MAIN],
+            stdin=subprocess.PIPE,
+            env=env,
+            start_new_session=True,
+        )
+        _log.info(f"Started worker of {self.ledger.name} (pid {self._process.pid})")
+
+    def _run(self):
+        while True:
+            update = self._queue.get()
+            if update is None:
+                break
+            line = (json.dumps(update) + "\n").encode()
+            while True:
+                code = self._process.poll()  # type: ignore
+                if code is not None:
+                    _log.error(f"Worker of {self.ledger.name} exited with {code}, restarting")
+                    time.sleep(1)
+                    self._spawn()
+                try:
+                    self._process.stdin.write(line)  # type: ignore
+                    self._process.stdin.flush()  # type: ignore
+                    break
+                except (BrokenPipeError, OSError) as e:
+                    _log.error(f"Can't send update to {self.ledger.name}: {e}")
+                    self._process.wait()  # type: ignore
+        if self._process and self._process.stdin:
+            self._process.stdin.close()
+
+
+def run_front():
+    """Receive updates and route each one to the worker of the ledger its chat or
+    user belongs to. Updates of chats and users without a ledger are answered as
+    unauthorized."""
+    ledgers = load_ledgers(config.ledgers_file)  # type: ignore
+    shards = {ledger.name: Shard(ledger) for ledger in ledgers}
+    chats = {c: ledger.name for ledger in ledgers for c in ledger.chats}
+    users = {u: ledger.name for ledger in ledgers for u in ledger.users}
+
+    def route(update: Update, context: CallbackContext):
+        name = None
+        if update.effective_chat:
+            name = chats.get(update.effective_chat.id)
+        if not name and update.effective_user:
+            name = users.get(update.effective_user.id)
+        if not name:
+            if update.effective_message:
+                update.effective_message.reply_text(
+                    "You are not authorized to use this bot."
+                )
+            return
+        shards[name].send(update.to_dict())
+
+    updater = Updater(config.telegram_api_token, use_context=True)
+    updater.dispatcher.add_handler(TypeHandler(Update, route))
+    for shard in shards.values():
+        shard.start()
+
+    receive.start(updater)
+    updater.idle()
+
+    for shard in shards.values():
+        shard.stop()
@@ -0,0 +1,99 @@
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from logging import getLogger
+from typing import Callable, Dict, List, Optional, Tuple
+
+import beans
+import config
+import metrics
+
+from .commits import get_commit_queue
+from .storage import get_users
+
+_log = getLogger("startup")
+
+_ready: Optional[Future] = None
+
+
+def start() -> Future:
+    """Start warming up in the background: pull the ledger, load it and build the
+    indexes used to answer messages. The bot can poll for updates in the meantime.
+
+    Returns:
+        A future resolving to the seconds each phase took once the ledger is ready.
+    """
+    global _ready
+    if not _ready:
+        _ready = Future()
+        threading.Thread(target=_run, args=(_ready,), name="startup", daemon=True).start()
+    return _ready
+
+
+def wait(timeout: Optional[float] = None) -> bool:
+    """Wait until the ledger is ready. If warming up failed, the ledger is considered
+    ready as well, handlers then run into the error themselves and report it.
+
+    Args:
+        timeout (:obj: float [optional]): Maximum seconds to wait.
+
+    Returns:
+        True if the ledger is ready or no warm up was started, False on timeout.
+    """
+    if not _ready:
+        return True
+    try:
+        _ready.exception(timeout)
+    except TimeoutError:
+        return False
+    return True
+
+
+def _run(ready: Future):
+    phases: List[Tuple[str, Callable]] = [
+        ("pull", _pull),
+        ("load", _load),
+        ("index", _index),
+    ]
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    try:
+        for name, fn in phases:
+            t = time.perf_counter()
+            fn()
+            timings[name] = time.perf_counter() - t
+            metrics.registry.observe(f"startup.{name}", timings[name])
+            _log.info(f"Startup phase {name} took {timings[name]:.2f}s")
+    except Exception as e:
+        _log.exception(f"Startup failed in phase {name}: {e}")
+        ready.set_exception(e)
+        return
+    timings["total"] = time.perf_counter() - start
+    _log.info(f"Ledger ready after {timings['total']:.2f}s")
+    ready.set_result(timings)
+
+
+def _pull():
+    worker = get_commit_queue().worker
+    # A pull would overwrite changes in the outbox that haven't been pushed yet
+    if worker and worker.pending():
+        _log.info("Not pulling, there are changes waiting to be pushed")
+        return
+    with config.synchronizer.lock, metrics.registry.timer("sync.pull"):
+        config.synchronizer.pull()
+
+
+def _load():
+    _, errors, _ = beans.load()
+    if errors:
+        _log.warning(f"Ledger loaded with {len(errors)} errors")
+
+
+def _index():
+    beans.get_expense_tree(check=False)
+    if config.suggestions <= 0:
+        return
+    accounts = set(u.get("account") for _, u in get_users().items())
+    for account in accounts - {None}:
+        # Building the index is all that's needed, the suggestions are discarded
+        beans.suggest_accounts("", account)
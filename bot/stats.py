@@ -0,0 +1,105 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.utils.request import Request
+
+import beans
+import config
+import metrics
+
+from .storage import get_users
+
+_log = getLogger("stats")
+
+
+class TimedRequest(Request):
+    """Request records how long each call of the Telegram API takes, as
+    ``telegram.<method>``. Long polling for updates isn't recorded, it takes as long
+    as no update arrives."""
+
+    def get(self, url: str, timeout=None):
+        with metrics.registry.timer(_operation(url)):
+            return super().get(url, timeout)
+
+    def post(self, url: str, data, timeout=None):
+        if url.endswith("/getUpdates"):
+            return super().post(url, data, timeout)
+        with metrics.registry.timer(_operation(url)):
+            return super().post(url, data, timeout)
+
+
+def _operation(url: str) -> str:
+    return "telegram." + url.rsplit("/", 1)[-1]
+
+
+def _handle_stats(update: Update, context: CallbackContext):
+    """Let the admin see how long the bot's operations take."""
+    u = get_users().get(str(update.effective_user.id))
+    if not u or not u["admin"]:
+        update.effective_message.reply_text("You are not authorized to see stats.")
+        return
+    rows = [("", "n", "p50", "p95", "p99")]
+    for name, s in metrics.registry.summaries().items():
+        ms = [f"{s.quantiles[q] * 1000:.1f}" for q in metrics.QUANTILES]
+        rows.append((name, str(s.count), *ms))
+    widths = [max(len(r[i]) for r in rows) for i in range(5)]
+    lines = [
+        "  ".join(
+            [r[0].ljust(widths[0])] + [c.rjust(w) for c, w in zip(r[1:], widths[1:])]
+        )
+        for r in rows
+    ]
+    lines.append("")
+    for name, n in metrics.registry.counters().items():
+        lines.append(f"{name}: {n}")
+    info = beans.cache_info()
+    lines.append(
+        f"ledger: version {info.version}, {info.files} files, {info.hits} hits, {info.misses} loads"
+    )
+    text = "\n".join(lines)
+    update.effective_message.reply_markdown(f"*Durations in ms*\n```\n{text}\n```")
+
+
+def write_metrics(context: CallbackContext):
+    """Write the metrics to ``config.metrics_file``, meant to run as repeating job of
+    the job queue. The file is replaced atomically, so it's never read half written."""
+    tmp = config.metrics_file + ".tmp"  # type: ignore
+    try:
+        with open(tmp, "w") as file:
+            file.write(metrics.registry.prometheus())
+        os.replace(tmp, config.metrics_file)  # type: ignore
+    except OSError as e:
+        _log.error(f"Can't write metrics to {config.metrics_file}: {e}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.registry.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _log.debug(format % args)
+
+
+def serve_metrics(listen: str, port: int) -> ThreadingHTTPServer:
+    """Serve the metrics in Prometheus' text format at /metrics in a background thread.
+
+    Returns:
+        The server, shut it down to stop serving.
+    """
+    server = ThreadingHTTPServer((listen, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    _log.info(f"Serving metrics on {listen}:{port}")
+    return server
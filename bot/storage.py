@@ -1,7 +1,12 @@
+import json
+import os
 import shelve
+import threading
+import time
 from dataclasses import dataclass, field
-from os.path import join
-from typing import List, Optional
+from logging import getLogger
+from os.path import exists, join
+from typing import Dict, List, Optional, Set, Tuple
 
 from telegram.ext import CallbackContext
 
@@ -9,10 +14,92 @@ import beans
 import config
 
 
-def get_shelve():
-    """Get a single shelve. This function should not be called concurrently,
-    but since telegram handlers never run concurrently, we will be fine."""
-    return shelve.open(join(config.db_dir, "users.pickle"), writeback=True)
+class UserRegistry(object):
+    """UserRegistry keeps the bot's users in memory. The users are loaded once and
+    written back only when they change. Writes are atomic: the users are written to
+    a temporary file which then replaces the old one.
+
+    Each user is a dict with the keys ``name``, ``admin`` and optionally ``file``,
+    ``account`` and ``withdrawal_account``. Users are replaced instead of modified, so
+    the dicts returned may be used without holding the registry's lock.
+
+    Attributes:
+        path (:obj: str): The JSON file in which the users are stored.
+    """
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._users: Dict[str, dict] = {}
+        if exists(path):
+            with open(path, "r") as file:
+                self._users = json.load(file)
+        elif legacy_path and _shelve_exists(legacy_path):
+            # Migrate the users from the shelve used before
+            with shelve.open(legacy_path, flag="r") as data:
+                self._users = {k: dict(v) for k, v in data.items()}
+            self._write()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def get(self, id: str) -> Optional[dict]:
+        """Get a user by ID.
+
+        Returns:
+            The user, or None if there is no user with the ID.
+        """
+        return self._users.get(id)
+
+    def items(self) -> List[Tuple[str, dict]]:
+        """Get all users, mapped with their ID."""
+        with self._lock:
+            return list(self._users.items())
+
+    def set(self, id: str, user: dict):
+        """Add or replace a user and write the users to disk."""
+        with self._lock:
+            self._users[id] = user
+            self._write()
+
+    def update(self, id: str, **values):
+        """Update values of an existing user and write the users to disk.
+
+        Raises:
+            KeyError: The user doesn't exist.
+        """
+        with self._lock:
+            self._users[id] = dict(self._users[id], **values)
+            self._write()
+
+    def _write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(self._users, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.path)
+
+
+def _shelve_exists(path: str) -> bool:
+    """Check for a shelve, dbm implementations may add a suffix to the filename."""
+    return any(exists(path + suffix) for suffix in ["", ".db", ".dat"])
+
+
+_users: Optional[UserRegistry] = None
+_users_lock = threading.Lock()
+
+
+def get_users() -> UserRegistry:
+    """Get the user registry. It's loaded on first use, users from the shelve
+    ``users.pickle`` used by earlier versions are migrated."""
+    global _users
+    with _users_lock:
+        if not _users:
+            _users = UserRegistry(
+                join(config.db_dir, "users.json"), join(config.db_dir, "users.pickle")
+            )
+    return _users
 
 
 @dataclass
@@ -29,26 +116,70 @@ class ConversationState:
         tx (:class: beans.Transaction): The transaction added to the account
         acounts (:obj: List[str]): List of accounts for the current search path.
         current_path (:obj: str): The current search path
+        suggestions (:obj: Tuple[str]): Accounts suggested for the transaction's narration.
+        touched (:obj: float): When the state was last saved or retrieved, as unix timestamp.
     """
 
     id: int  # The id is the telegram message_id
     tx: beans.Transaction
     accounts: List[str] = field(default_factory=lambda: [])
     current_path: str = ""
+    suggestions: Tuple[str, ...] = ()
+    touched: float = 0.0
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        """Check whether the state hasn't been used for longer than the configured TTL."""
+        return (now or time.time()) - self.touched > config.state_ttl
+
+
+data_lock = threading.RLock()
+"""Held while changing user_data or chat_data, since handlers run on the dispatcher's
+worker threads, and while the persistence pickles them."""
+
+
+class ChangedKeys(object):
+    """ChangedKeys records the keys of user_data and chat_data whose values were changed
+    in place, so that the persistence only pickles those. Values assigned to a key
+    anew are found by the persistence itself. Hold :data:`data_lock` while marking.
+    """
+
+    def __init__(self):
+        # Keyed by the data's id, the dicts of user_data and chat_data aren't hashable
+        self._keys: Dict[int, Set[str]] = {}
+
+    def mark(self, data: dict, key: str):
+        """Record that the value of a key was changed in place."""
+        self._keys.setdefault(id(data), set()).add(key)
+
+    def pop(self, data: dict) -> Set[str]:
+        """Get the keys marked since the last call and forget them."""
+        return self._keys.pop(id(data), set())
+
+
+changed_keys = ChangedKeys()
+"""The keys of user_data and chat_data changed in place since they were persisted."""
 
 
 def save_state(context: CallbackContext, s: ConversationState):
     """Save a conversation's state in the chat context. This way, it can be retrieved by a callback.
+    If the chat has more states than configured, the least recently used ones are discarded.
     
     Args:
         context (:class: telegram.ext.CallbackContext): The conversation's context in which to save the state.
         state (:class: State): The state to persist.
     """
-    data = context.chat_data.get("states")
-    if data == None:
-        context.chat_data["states"] = {}
-        data = context.chat_data["states"]
-    data[str(s.id)] = s
+    with data_lock:
+        data = context.chat_data.get("states")
+        if data == None:
+            context.chat_data["states"] = {}
+            data = context.chat_data["states"]
+        s.touched = time.time()
+        # Dicts keep their insertion order, re-insert to keep the states ordered by use
+        data.pop(str(s.id), None)
+        data[str(s.id)] = s
+        while len(data) > max(config.state_max_per_chat, 1):
+            del data[next(iter(data))]
+        changed_keys.mark(context.chat_data, "states")
 
 
 def get_state(context: CallbackContext, id: str) -> Optional[ConversationState]:
@@ -61,10 +192,20 @@ def get_state(context: CallbackContext, id: str) -> Optional[ConversationState]:
         context (:class: telegram.ext.CallbackContext): The conversation's context from which to retrieve the state.
         id (:obj: str): The ID of the state to retrieve.
     """
-    data = context.chat_data.get("states")
-    if data == None:
-        return None
-    return data.get(id)
+    with data_lock:
+        data = context.chat_data.get("states")
+        if data == None:
+            return None
+        s = data.get(id)
+        if s and s.expired():
+            del data[id]
+            changed_keys.mark(context.chat_data, "states")
+            return None
+        if s:
+            s.touched = time.time()
+            data[id] = data.pop(id)
+            changed_keys.mark(context.chat_data, "states")
+        return s
 
 
 def pop_state(context: CallbackContext, id: str) -> Optional[ConversationState]:
@@ -77,12 +218,16 @@ def pop_state(context: CallbackContext, id: str) -> Optional[ConversationState]:
         context (:class: telegram.ext.CallbackContext): The conversation's context from which to retrieve the state.
         id (:obj: str): The ID of the state to retrieve.
     """
-    data = context.chat_data.get("states")
-    if data == None:
-        return None
-    if data.get(id):
-        return data.pop(id)
-    return None
+    with data_lock:
+        data = context.chat_data.get("states")
+        if data == None:
+            return None
+        s = data.pop(id, None)
+        if s:
+            changed_keys.mark(context.chat_data, "states")
+        if s and s.expired():
+            return None
+        return s
 
 
 def delete_state(context: CallbackContext, id: str):
@@ -95,12 +240,38 @@ def delete_state(context: CallbackContext, id: str):
         context (:class: telegram.ext.CallbackContext): The conversation's context from which to retrieve the state.
         id (:obj: str): The ID of the state to retrieve.
     """
-    data = context.chat_data.get("states")
-    if data == None:
-        return None
+    with data_lock:
+        data = context.chat_data.get("states")
+        if data == None:
+            return None
+
+        if data.get(id):
+            del data[id]
+            changed_keys.mark(context.chat_data, "states")
+
 
-    if data.get(id):
-        del data[id]
+def sweep_states(context: CallbackContext):
+    """Discard expired conversation states of all chats. This is meant to run as
+    repeating job of the job queue.
+
+    Args:
+        context (:class: telegram.ext.CallbackContext): The job's context.
+    """
+    with data_lock:
+        now = time.time()
+        removed = 0
+        for chat_data in list(context.dispatcher.chat_data.values()):
+            data = chat_data.get("states")
+            if not data:
+                continue
+            expired = [id for id, s in data.items() if s.expired(now)]
+            for id in expired:
+                del data[id]
+            if expired:
+                changed_keys.mark(chat_data, "states")
+                removed += len(expired)
+        if removed:
+            getLogger("bot").debug(f"Discarded {removed} expired conversation states")
 
 
 def get_narration_account(context: CallbackContext, narration: str) -> str:
@@ -127,8 +298,10 @@ def save_narration_account(context: CallbackContext, narration: str, account: st
         narration (:obj: str): The narration.
         account (:obj: str): The account.
     """
-    data = context.user_data.get("narrations")
-    if data == None:
-        context.user_data["narrations"] = {}
+    with data_lock:
         data = context.user_data.get("narrations")
-    data[narration] = account
+        if data == None:
+            context.user_data["narrations"] = {}
+            data = context.user_data.get("narrations")
+        data[narration] = account
+        changed_keys.mark(context.user_data, "narrations")
@@ -0,0 +1,97 @@
+import threading
+from logging import getLogger
+from typing import List, Optional
+
+from telegram import Bot
+from telegram.ext import CallbackContext
+
+import beans
+
+from .storage import get_users
+
+_log = getLogger("validation")
+
+MAX_ERRORS = 10
+"""Maximum number of errors listed in a notification."""
+
+
+class DeepValidator(object):
+    """DeepValidator validates the whole ledger in the background, see
+    :func:`beans.validate_deep`, and notifies the admins when it becomes invalid
+    and when it's valid again. The same errors are only reported once.
+
+    Attributes:
+        bot (:class: telegram.Bot): The bot used to notify the admins.
+        delay (:obj: float): Seconds to wait after a validation was requested. Requests
+            in the meantime are served by the same validation.
+    """
+
+    def __init__(self, bot: Bot, delay: float = 0):
+        self.bot = bot
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._reported: List[str] = []
+
+    def request(self, *args):
+        """Validate the ledger after the delay, unless a validation is already waiting.
+        Any arguments are ignored, so that this can be used as callback."""
+        with self._lock:
+            if self._timer:
+                return
+            self._timer = threading.Timer(self.delay, self._run)
+            self._timer.name = "validation"
+            self._timer.daemon = True
+            self._timer.start()
+
+    def job(self, context: CallbackContext):
+        """Validate the ledger, meant to run as repeating job of the job queue."""
+        self.request()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        try:
+            errors = self._validate()
+        except Exception as e:
+            _log.exception(f"Validation failed: {e}")
+            return
+        if errors is None:
+            # The ledger changed while being validated, errors might be from a half written file
+            self.request()
+            return
+        if errors == self._reported:
+            return
+        if errors:
+            _log.error(f"Ledger validation found {len(errors)} errors")
+            text = f"❗ The ledger has {len(errors)} errors:\n\n" + "\n".join(
+                errors[:MAX_ERRORS]
+            )
+            if len(errors) > MAX_ERRORS:
+                text += f"\n… and {len(errors) - MAX_ERRORS} more."
+        else:
+            _log.info("Ledger is valid again")
+            text = "✅ The ledger is valid again."
+        self._reported = errors
+        self._notify(text)
+
+    def _validate(self) -> Optional[List[str]]:
+        version = beans.cache.version
+        errors = beans.validate_deep()
+        if errors and beans.cache.version != version:
+            return None
+        return [_format_error(e) for e in errors]
+
+    def _notify(self, text: str):
+        for id, user in get_users().items():
+            if not user.get("admin"):
+                continue
+            try:
+                self.bot.send_message(chat_id=int(id), text=text)
+            except Exception as e:
+                _log.error(f"Can't notify admin {id}: {e}")
+
+
+def _format_error(error) -> str:
+    source = getattr(error, "source", None) or {}
+    return f"{source.get('filename', '')}:{source.get('lineno', '')}: {error.message}"
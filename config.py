@@ -14,16 +14,66 @@ def _must_get(name: str) -> str:
     return v
 
 
+# Sharding settings
+ledgers_file = os.environ.get("LEDGERS_FILE")
+"""Path to a JSON file mapping users and chats to ledgers. If set, this process routes
+updates to one worker process per ledger, see :mod:`bot.shard`."""
+ledger_name = os.environ.get("LEDGER_NAME") or ""
+"""The name of the ledger served by this process if it's the worker of a ledger."""
+front = bool(ledgers_file) and not ledger_name
+"""Indicates whether this process only routes updates and doesn't serve a ledger itself."""
+
+
+def _must_get_ledger(name: str) -> str:
+    """Get a ledger setting from env like :func:`_must_get`. The process routing updates
+    to the ledgers' workers doesn't need ledger settings, they may be empty there."""
+    if front:
+        return os.environ.get(name) or ""
+    return _must_get(name)
+
+
 # beancount settings
-bean_path = _must_get("BEAN_PATH")
+bean_path = _must_get_ledger("BEAN_PATH")
 """The path to your beancount folder."""
-bean_main_file = _must_get("BEAN_MAIN_FILE")
+bean_main_file = _must_get_ledger("BEAN_MAIN_FILE")
 """The name of the main beancount file expressed as relative path to `bean_path``."""
-bean_currency = _must_get("BEAN_CURRENCY")
+bean_currency = _must_get_ledger("BEAN_CURRENCY")
 """The currency string used for your accounts, e.g. EUR or USD."""
+bean_align_file = os.environ.get("BEAN_ALIGN_FILE") in ["True", "true", "1"]
+"""Indicates whether the whole file is aligned and rewritten on every transaction
+instead of only appending the new transaction aligned to the file's currency column."""
+bean_snapshot = os.environ.get("BEAN_SNAPSHOT") not in ["False", "false", "0"]
+"""Indicates whether the loaded ledger is stored in ``db_dir`` to be loaded from there on
+the next start if the ledger's files didn't change."""
+bean_validation = os.environ.get("BEAN_VALIDATION") or "fast"
+"""Validations run when loading the ledger or adding transactions: ``fast`` runs beancount's
+default validations, ``hardcore`` also runs its hardcore validations."""
+deep_validation = os.environ.get("DEEP_VALIDATION") or "commit"
+"""When the ledger is validated completely in the background and admins are notified of
+errors: ``commit`` after transactions were committed, ``schedule`` regularly or ``off``."""
+deep_validation_delay = float(os.environ.get("DEEP_VALIDATION_DELAY") or 30)
+"""Seconds to wait after a commit before validating, commits in the meantime are validated together."""
+deep_validation_interval = float(os.environ.get("DEEP_VALIDATION_INTERVAL") or 24 * 60 * 60)
+"""Seconds between two scheduled validations."""
 # telegram settings
 telegram_api_token = _must_get("TELEGRAM_API_TOKEN")
 """Telegram API token for your bot."""
+webhook_url = os.environ.get("WEBHOOK_URL") or ""
+"""The public URL under which Telegram reaches the bot's webhook server, e.g.
+``https://bot.example.com``. If set, updates are received through a webhook instead of polling."""
+webhook_listen = os.environ.get("WEBHOOK_LISTEN") or "0.0.0.0"
+"""The address the webhook server listens on."""
+webhook_port = int(os.environ.get("WEBHOOK_PORT") or 8443)
+"""The port the webhook server listens on."""
+webhook_path = os.environ.get("WEBHOOK_PATH") or "telegram"
+"""The path of the webhook, relative to ``webhook_url``."""
+webhook_secret = os.environ.get("WEBHOOK_SECRET") or ""
+"""A secret appended to the webhook's path, so that only Telegram can post updates."""
+webhook_cert = os.environ.get("WEBHOOK_CERT") or ""
+"""Path to the TLS certificate of the webhook server. If it and the key are not set, the
+server uses plain HTTP and TLS has to be terminated by a proxy in front of it."""
+webhook_key = os.environ.get("WEBHOOK_KEY") or ""
+"""Path to the TLS private key of the webhook server."""
 # Logging information
 db_dir = os.environ.get("DB_DIR") or "/var/lib/beanbot"
 """The directory in which persistent data will be stored."""
@@ -31,18 +81,74 @@ verbose = os.environ.get("LOG_VERBOSE") in ["True", "true", "1"]
 """Indicates whether verbose logging is activated."""
 log_lvl = logging.DEBUG if verbose else logging.INFO
 """Current log level used in all loggers."""
+workers = int(os.environ.get("WORKERS") or 4)
+"""Number of threads handling messages in parallel."""
+# Commit settings
+commit_window = float(os.environ.get("COMMIT_WINDOW") or 0)
+"""Seconds to wait for more transactions before committing a batch."""
+commit_batch_size = int(os.environ.get("COMMIT_BATCH_SIZE") or 20)
+"""Maximum number of transactions committed in a single batch."""
+suggestions = int(os.environ.get("SUGGESTIONS") or 3)
+"""Number of accounts suggested for a new narration based on similar past narrations, 0 disables suggestions."""
+state_ttl = float(os.environ.get("STATE_TTL") or 24 * 60 * 60)
+"""Seconds after which an unanswered account selection is discarded."""
+state_max_per_chat = int(os.environ.get("STATE_MAX_PER_CHAT") or 20)
+"""Maximum number of open account selections per chat, the oldest are discarded first."""
+state_sweep_interval = float(os.environ.get("STATE_SWEEP_INTERVAL") or 60 * 60)
+"""Seconds between two runs of the job discarding expired account selections."""
+startup_timeout = float(os.environ.get("STARTUP_TIMEOUT") or 20)
+"""Seconds a message waits for the ledger to be loaded after startup before the user is asked to retry."""
+chart_cache_size = int(os.environ.get("CHART_CACHE_SIZE") or 32)
+"""Number of rendered charts kept, requesting a chart again with an unchanged ledger sends the cached image."""
+batch_max_lines = int(os.environ.get("BATCH_MAX_LINES") or 500)
+"""Maximum number of transactions entered at once with a multi-line message, a CSV file or /batch."""
+# Metrics settings
+metrics_file = os.environ.get("METRICS_FILE") or None
+"""File the metrics are written to in Prometheus' text format, e.g. for node_exporter's textfile collector."""
+metrics_interval = float(os.environ.get("METRICS_INTERVAL") or 60)
+"""Seconds between two writes of the metrics file."""
+metrics_port = int(os.environ.get("METRICS_PORT") or 0)
+"""Port serving the metrics in Prometheus' text format at /metrics, 0 disables it. Each ledger's worker needs its own port."""
+metrics_listen = os.environ.get("METRICS_LISTEN") or "0.0.0.0"
+"""The address the metrics server listens on."""
 # Synchronation settings
+sync_async = os.environ.get("SYNC_ASYNC") in ["True", "true", "1"]
+"""Indicates whether pushes run in the background instead of blocking the reply."""
+sync_freshness = float(os.environ.get("SYNC_FRESHNESS") or 0)
+"""Seconds after a pull during which the server is not checked for changes again."""
 synchronizer = sync.Sync(bean_path)
-if os.environ.get("SYNC_METHOD") == "dav":
+if not front and os.environ.get("SYNC_METHOD") == "dav":
     # DAV settings
     dpath = _must_get("DAV_PATH")
     droot = _must_get("DAV_ROOT")
     duser = _must_get("DAV_USER")
     dpass = _must_get("DAV_PASS")
     dhost = _must_get("DAV_HOST")
-    synchronizer = sync.DavSync(bean_path, dpath, droot, duser, dpass, dhost)
+    # Only download changed files, keeping their ETags in a manifest, unless disabled
+    dmanifest = None
+    if os.environ.get("DAV_DELTA") not in ["False", "false", "0"]:
+        dmanifest = os.path.join(db_dir, "dav_manifest.json")
+    dworkers = int(os.environ.get("DAV_WORKERS") or 4)
+    synchronizer = sync.DavSync(
+        bean_path,
+        dpath,
+        droot,
+        duser,
+        dpass,
+        dhost,
+        freshness=sync_freshness,
+        manifest_path=dmanifest,
+        workers=dworkers,
+    )
+
+if not front and os.environ.get("SYNC_METHOD") == "git":
+    synchronizer = sync.GitSync(bean_path, freshness=sync_freshness)
 
-if os.environ.get("SYNC_METHOD") == "git":
-    synchronizer = sync.GitSync(
+if not front and os.environ.get("SYNC_METHOD") == "pygit":
+    synchronizer = sync.PyGitSync(
         bean_path,
+        freshness=sync_freshness,
+        ssh_key=os.environ.get("GIT_SSH_KEY"),
+        ssh_pubkey=os.environ.get("GIT_SSH_PUBKEY"),
+        ssh_passphrase=os.environ.get("GIT_SSH_PASSPHRASE") or "",
     )
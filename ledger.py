@@ -0,0 +1,464 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from logging import getLogger
+from os.path import dirname
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from beancount.core.data import entry_sortkey
+
+LoadResult = Tuple[list, list, dict]
+"""The ``(entries, errors, options_map)`` triple returned by beancount's loader."""
+
+
+class CacheInfo(NamedTuple):
+    """Statistics of a :class:`LedgerCache`.
+
+    Attributes:
+        hits (:obj: int): Number of loads served from memory.
+        misses (:obj: int): Number of loads that had to parse the ledger.
+        version (:obj: int): Incremented every time the cached ledger changes.
+        files (:obj: int): Number of files in the cached include graph.
+    """
+
+    hits: int
+    misses: int
+    version: int
+    files: int
+
+
+class ReadWriteLock(object):
+    """ReadWriteLock lets any number of readers or a single writer hold the lock.
+    Waiting writers go first, new readers wait for them, so that a steady stream of
+    readers can't starve writers. The writer may acquire the lock again, for reading
+    or writing, while holding it. Readers must neither acquire the lock for writing
+    nor for reading again while reading.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._waiting = 0
+        self._writer: Optional[int] = None
+        self._depth = 0
+
+    @contextmanager
+    def read(self):
+        """Hold the lock for reading."""
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                while self._writer is not None or self._waiting:
+                    self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Hold the lock for writing."""
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+class Snapshot(object):
+    """Snapshot stores the result of loading a ledger on disk, so that it can be loaded
+    again after a restart without parsing the ledger. Similar to beancount's pickle
+    cache, the included files are taken from the stored options. The snapshot is only
+    used if the path, mtime and size of every included file and their directories
+    are unchanged.
+
+    The file holds two pickles: a header with the key and the paths it was computed
+    from, followed by the result. Stale snapshots are detected without loading the result.
+
+    Attributes:
+        path (:obj: str): The file the snapshot is stored in.
+    """
+
+    VERSION = 1
+    """Incremented whenever the format or the content of the stored results changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, filename: str) -> Optional[LoadResult]:
+        """Load the snapshot of a ledger.
+
+        Args:
+            filename (:obj: str): Absolute path to the main beancount file.
+
+        Returns:
+            The ``(entries, errors, options_map)`` triple of the loader, or None if
+            there is no snapshot or it's stale.
+        """
+        log = getLogger("ledger")
+        start = time.perf_counter()
+        try:
+            with open(self.path, "rb") as file:
+                version, main, paths, key = pickle.load(file)
+                if version != self.VERSION or main != filename:
+                    return None
+                if _snapshot_key(paths) != key:
+                    log.debug("Ledger snapshot is stale")
+                    return None
+                result = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Unpickling a corrupted or outdated file fails in many different ways
+            log.warning(f"Can't load ledger snapshot {self.path}: {e}")
+            return None
+        log.debug(f"Loaded ledger snapshot in {time.perf_counter() - start:.3f}s")
+        return result
+
+    def save(
+        self,
+        filename: str,
+        result: LoadResult,
+        stats: Optional[Dict[str, Tuple[Optional[int], Optional[int]]]] = None,
+    ):
+        """Store the result of loading a ledger. Errors are logged, not raised.
+
+        Args:
+            filename (:obj: str): Absolute path to the main beancount file.
+            result (:obj: LoadResult): The ``(entries, errors, options_map)`` triple of the loader.
+            stats (:obj: Dict [optional]): The mtime and size of every path of the include
+                graph the result corresponds to. By default, the paths are stat now.
+        """
+        paths = sorted(stats or _watch(filename, result[2]))
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as file:
+                header = (self.VERSION, filename, paths, _snapshot_key(paths, stats))
+                pickle.dump(header, file, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(result, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            getLogger("ledger").warning(f"Can't save ledger snapshot {self.path}: {e}")
+
+
+class _FileState(object):
+    """The last known state of a single file or directory of the include graph.
+
+    Attributes:
+        path (:obj: str): The absolute path.
+        mtime (:obj: int): Modification time in nanoseconds, ``None`` if the path doesn't exist.
+        size (:obj: int): Size in bytes, ``None`` if the path doesn't exist.
+        digest (:obj: hashlib._Hash): Running hash of the file's content, ``None`` for directories.
+        lines (:obj: int): Number of newlines in the file.
+    """
+
+    def __init__(self, path: str, is_dir: bool = False):
+        self.path = path
+        self.is_dir = is_dir
+        self.mtime: Optional[int] = None
+        self.size: Optional[int] = None
+        self.digest = None
+        self.lines = 0
+        self.refresh()
+
+    def refresh(self):
+        """Stat the path and, for files, hash its content."""
+        self.mtime, self.size = _stat(self.path)
+        self.digest = None
+        self.lines = 0
+        if not self.is_dir and self.mtime is not None:
+            self.digest, self.lines = _hash_file(self.path)
+
+    def changed(self) -> bool:
+        """Check whether the path changed since it was recorded. A file whose mtime or
+        size differs but whose content hash is unchanged (e.g. after a ``git reset``)
+        is not considered changed, its recorded stat is updated instead."""
+        mtime, size = _stat(self.path)
+        if (mtime, size) == (self.mtime, self.size):
+            return False
+        if self.is_dir or mtime is None or self.digest is None:
+            return True
+        digest, _ = _hash_file(self.path)
+        if digest.digest() != self.digest.digest():
+            return True
+        self.mtime, self.size = mtime, size
+        return False
+
+    def append(self, data: bytes):
+        """Record that data was appended to the file without reading it again."""
+        if self.digest is None:
+            self.digest = hashlib.sha1()
+        self.digest.update(data)
+        self.lines += data.count(b"\n")
+        self.mtime, self.size = _stat(self.path)
+
+
+class LedgerCache(object):
+    """LedgerCache keeps the result of loading a beancount ledger in memory and only
+    reloads it if a file of the include graph changed. Files are compared by their
+    mtime and size and, if those differ, by their content hash. The directories
+    containing the included files are watched as well, so new files matched by an
+    ``include`` glob are picked up.
+
+    The returned entries are shared between all callers and must not be modified.
+    The cache may be used from several threads: lookups share a read lock, reloads
+    and appends hold the write lock. Appends replace the list of entries instead of
+    modifying it, so entries returned earlier stay consistent.
+
+    If a snapshot is given, the first load is served from it if the ledger's files
+    didn't change, and every ledger loaded without errors is stored in it.
+
+    Attributes:
+        load_fn (:obj: Callable): Function that loads a ledger file and returns ``(entries, errors, options_map)``.
+        snapshot (:class: Snapshot): Optional snapshot on disk.
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[str], LoadResult],
+        snapshot: Optional[Snapshot] = None,
+    ):
+        self.load_fn = load_fn
+        self.snapshot = snapshot
+        self._rw = ReadWriteLock()
+        self._filename: Optional[str] = None
+        self._result: Optional[LoadResult] = None
+        self._files: Dict[str, _FileState] = {}
+        self._derived: Dict[str, Tuple[int, Any, Optional[Callable]]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._version = 0
+
+    def get(self, filename: str) -> LoadResult:
+        """Get the loaded ledger, parsing it only if it changed since the last call.
+
+        Args:
+            filename (:obj: str): Absolute path to the main beancount file.
+
+        Returns:
+            The ``(entries, errors, options_map)`` triple of the loader.
+        """
+        with self._rw.read():
+            if self._is_fresh(filename):
+                self._hits += 1
+                return self._result  # type: ignore
+        with self._rw.write():
+            # Another thread might have reloaded the ledger in the meantime
+            if self._is_fresh(filename):
+                self._hits += 1
+                return self._result  # type: ignore
+            self._misses += 1
+            result = None
+            if self.snapshot and self._result is None:
+                result = self.snapshot.load(filename)
+            if result is None:
+                getLogger("ledger").debug(f"Ledger cache miss, loading {filename}")
+                result = self.load_fn(filename)
+                if self.snapshot and not result[1]:
+                    self.snapshot.save(filename, result)
+            self._filename = filename
+            self._result = result
+            self._files = _watch(filename, result[2])
+            self._version += 1
+            return result
+
+    def derived(
+        self,
+        name: str,
+        build: Callable[[LoadResult], Any],
+        update: Optional[Callable[[Any, List], Any]] = None,
+    ) -> Any:
+        """Get a value computed from the cached ledger. The value is built once per
+        ledger version and shared between callers. This doesn't check the ledger's
+        files for changes, call :meth:`get` beforehand if that is required.
+
+        Args:
+            name (:obj: str): Unique name of the value.
+            build (:obj: Callable): Function computing the value from ``(entries, errors, options_map)``.
+            update (:obj: Callable [optional]): Function that updates the value with entries
+                added through :meth:`append`. It returns the updated value, or None if the
+                value has to be built again.
+
+        Raises:
+            ValueError: No ledger has been loaded yet.
+        """
+        with self._rw.read():
+            if self._result is None:
+                raise ValueError("No ledger loaded")
+            version, value, _ = self._derived.get(name, (None, None, None))
+            if version == self._version:
+                return value
+        with self._rw.write():
+            if self._result is None:
+                raise ValueError("No ledger loaded")
+            version, value, _ = self._derived.get(name, (None, None, None))
+            if version == self._version:
+                return value
+            value = build(self._result)
+            self._derived[name] = (self._version, value, update)
+            return value
+
+    def lines(self, filename: str) -> Optional[int]:
+        """Get the number of newlines of a file of the cached ledger.
+
+        Returns:
+            The number of newlines, or None if the file is not part of the cached ledger.
+        """
+        with self._rw.read():
+            state = self._files.get(filename)
+            if self._result is None or state is None or state.is_dir:
+                return None
+            return state.lines
+
+    def append(self, filename: str, data: bytes, entries: List):
+        """Record that data was appended to a file of the cached ledger and add the
+        entries parsed from it, so that the ledger doesn't have to be loaded again.
+        Derived values are updated with the new entries if they provide an update
+        function, otherwise they are dropped.
+
+        Args:
+            filename (:obj: str): The file that was appended to.
+            data (:obj: bytes): The bytes appended to the file.
+            entries (:obj: List): The booked entries parsed from data.
+
+        Raises:
+            ValueError: The file is not part of the cached ledger.
+        """
+        with self._rw.write():
+            state = self._files.get(filename)
+            if self._result is None or state is None or state.is_dir:
+                raise ValueError(f"{filename} is not part of the cached ledger")
+            # Copy the entries, callers might still be iterating over the old ones
+            cached = list(self._result[0])
+            for entry in entries:
+                # New entries usually belong at the end, search from there
+                key = entry_sortkey(entry)
+                i = len(cached)
+                while i > 0 and entry_sortkey(cached[i - 1]) > key:
+                    i -= 1
+                cached.insert(i, entry)
+            self._result = (cached, self._result[1], self._result[2])
+            state.append(data)
+            self._version += 1
+            derived = {}
+            for name, (_, value, update) in self._derived.items():
+                if update and (value := update(value, entries)) is not None:
+                    derived[name] = (self._version, value, update)
+            self._derived = derived
+
+    def writing(self):
+        """Hold the write lock while changing the ledger's files, so that no other
+        thread reloads the ledger while the change is half done.
+
+        Returns:
+            A context manager holding the lock.
+        """
+        return self._rw.write()
+
+    @property
+    def loaded(self) -> bool:
+        """Indicates whether a ledger is cached."""
+        return self._result is not None
+
+    def save_snapshot(self):
+        """Store the cached ledger, including appended entries, in the snapshot. Nothing
+        is stored if the ledger's files changed since it was loaded."""
+        with self._rw.read():
+            if not self.snapshot or self._result is None or self._result[1]:
+                return
+            if not self._is_fresh(self._filename):  # type: ignore
+                getLogger("ledger").debug("Not saving the snapshot of a stale ledger")
+                return
+            # The stats recorded with the result, a change after the check isn't covered
+            stats = {p: (f.mtime, f.size) for p, f in self._files.items()}
+            self.snapshot.save(self._filename, self._result, stats)  # type: ignore
+
+    def invalidate(self):
+        """Drop the cached ledger. The next call to :meth:`get` reloads it."""
+        with self._rw.write():
+            self._result = None
+            self._files = {}
+
+    def info(self) -> CacheInfo:
+        """Get the cache's hit and miss counters."""
+        return CacheInfo(self._hits, self._misses, self._version, len(self._files))
+
+    @property
+    def version(self) -> int:
+        """The version of the cached ledger, incremented on every reload."""
+        return self._version
+
+    def _is_fresh(self, filename: str) -> bool:
+        if self._result is None or filename != self._filename:
+            return False
+        # Check every path instead of stopping early so that touched but unchanged
+        # files get their stat updated
+        changed = [f.path for f in self._files.values() if f.changed()]
+        if changed:
+            getLogger("ledger").debug(f"Ledger files changed: {changed}")
+        return not changed
+
+
+def _watch(filename: str, options_map: Optional[dict]) -> Dict[str, _FileState]:
+    """Get the states of all files of the include graph and their directories."""
+    files = set([filename])
+    if options_map:
+        files.update(options_map.get("include", []))
+    dirs = set(dirname(f) for f in files)
+    states = {f: _FileState(f) for f in files}
+    states.update({d: _FileState(d, is_dir=True) for d in dirs})
+    return states
+
+
+def _snapshot_key(
+    paths: List[str],
+    stats: Optional[Dict[str, Tuple[Optional[int], Optional[int]]]] = None,
+) -> str:
+    """Hash the path, mtime and size of each path. The mtime and size are taken from
+    stats if given, otherwise the paths are stat."""
+    h = hashlib.sha1()
+    for path in paths:
+        stat = stats[path] if stats is not None else _stat(path)
+        h.update(repr((path, stat)).encode())
+    return h.hexdigest()
+
+
+def _stat(path: str) -> Tuple[Optional[int], Optional[int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return st.st_mtime_ns, st.st_size
+
+
+def _hash_file(path: str):
+    """Get the running hash and the number of newlines of a file."""
+    h = hashlib.sha1()
+    lines = 0
+    try:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 16), b""):
+                h.update(chunk)
+                lines += chunk.count(b"\n")
+    except OSError:
+        pass
+    return h, lines
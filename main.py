@@ -6,9 +6,10 @@ from bot import run
 
 
 def main():
+    prefix = f"{config.ledger_name}: " if config.ledger_name else ""
     logging.basicConfig(
         level=config.log_lvl,
-        format="%(name)s [%(levelname)s] [%(asctime)s]: %(message)s",
+        format=prefix + "%(name)s [%(levelname)s] [%(asctime)s]: %(message)s",
     )
 
     try:
@@ -0,0 +1,163 @@
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple
+
+WINDOW = 1024
+"""Number of most recent durations the percentiles of an operation are computed from."""
+QUANTILES = (0.5, 0.95, 0.99)
+
+_LOG_TIMINGS_RE = re.compile(r"^Operation: '(.+?)'\s+Time:\s+(\d+) ms$")
+
+
+class Summary(NamedTuple):
+    """The durations recorded for an operation.
+
+    Attributes:
+        count (:obj: int): The number of durations recorded since the start.
+        sum (:obj: float): Their sum in seconds.
+        quantiles (:obj: Dict[float, float]): The percentiles of the most recent
+            durations in seconds, see :data:`WINDOW`.
+    """
+
+    count: int
+    sum: float
+    quantiles: Dict[float, float]
+
+
+class _Histogram(object):
+    """The most recent durations of an operation and the totals of all of them."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=WINDOW)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def summary(self) -> Summary:
+        recent = sorted(self.recent)
+        quantiles = {}
+        for q in QUANTILES:
+            # Nearest rank, so the p99 of few durations is the slowest one
+            quantiles[q] = (
+                recent[min(len(recent) - 1, int(q * len(recent)))] if recent else 0.0
+            )
+        return Summary(self.count, self.sum, quantiles)
+
+
+class Registry(object):
+    """Registry records how long operations take and counts events. It's safe to use
+    from several threads. Operations and events are created when first recorded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, _Histogram] = {}
+        self._counters: Dict[str, int] = {}
+
+    def observe(self, name: str, seconds: float):
+        """Record that an operation took some seconds."""
+        with self._lock:
+            h = self._histograms.get(name)
+            if h is None:
+                h = self._histograms[name] = _Histogram()
+            h.observe(seconds)
+
+    def count(self, name: str, n: int = 1):
+        """Count an event n times."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Record how long the block takes. Blocks raising an exception are recorded
+        as well and counted as ``<name>.errors``."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count(name + ".errors")
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name: str) -> Callable:
+        """Decorator recording how long each call of a function takes, see :meth:`timer`."""
+
+        def decorator(fn: Callable) -> Callable:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def log_timings(self, message: str):
+        """Record a timing logged by beancount's loader, meant to be passed as its
+        ``log_timings`` argument. Operations are recorded as ``beancount.<operation>``.
+        """
+        m = _LOG_TIMINGS_RE.match(message.strip())
+        if not m:
+            return
+        # Operations are module names like beancount.parser.parser, phases like
+        # booking or validation functions like "function: validate_open_close"
+        operation = m.group(1).replace("function: ", "")
+        if not operation.startswith("beancount."):
+            operation = "beancount." + operation
+        self.observe(operation, int(m.group(2)) / 1000)
+
+    def reset(self):
+        """Forget all recorded durations and counts."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def summaries(self) -> Dict[str, Summary]:
+        """Get the summary of each operation, by name."""
+        with self._lock:
+            return {n: h.summary() for n, h in sorted(self._histograms.items())}
+
+    def counters(self) -> Dict[str, int]:
+        """Get the count of each event, by name."""
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def prometheus(self, prefix: str = "beanbot") -> str:
+        """Format the metrics in Prometheus' text format. Operations are exported as
+        summary ``<prefix>_duration_seconds``, events as counter ``<prefix>_events_total``,
+        both with the label ``name``."""
+        lines: List[str] = []
+        summaries = self.summaries()
+        if summaries:
+            lines.append(f"# TYPE {prefix}_duration_seconds summary")
+        for name, s in summaries.items():
+            label = f'name="{_escape(name)}"'
+            for q, v in s.quantiles.items():
+                lines.append(
+                    f'{prefix}_duration_seconds{{{label},quantile="{q}"}} {v:.6f}'
+                )
+            lines.append(f"{prefix}_duration_seconds_sum{{{label}}} {s.sum:.6f}")
+            lines.append(f"{prefix}_duration_seconds_count{{{label}}} {s.count}")
+        counters = self.counters()
+        if counters:
+            lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, n in counters.items():
+            lines.append(f'{prefix}_events_total{{name="{_escape(name)}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+"""The registry used by the bot."""
@@ -0,0 +1,112 @@
+import heapq
+import math
+import re
+from collections import Counter
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+_TOKEN_RE = re.compile(r"\w+")
+_EMPTY: Set[int] = frozenset()  # type: ignore
+
+MIN_SIMILARITY = 0.3
+"""Narrations less similar than this to the searched narration are ignored."""
+CANDIDATES = 50
+"""Number of most similar narrations whose accounts are scored."""
+
+
+class SuggestionIndex(object):
+    """SuggestionIndex suggests accounts for a narration based on the accounts used
+    with similar narrations before. Narrations are normalized to lower case tokens and
+    indexed by the trigrams of those tokens, so typos and extra words still match.
+
+    The accounts of the most similar narrations are scored by the narration's
+    similarity, how often the account was used with it and how long ago that was.
+
+    Attributes:
+        half_life (:obj: float): Days after which the weight of a past use is halved.
+    """
+
+    def __init__(self, half_life: float = 180):
+        self.half_life = half_life
+        self._ids: Dict[str, int] = {}
+        # Per narration: the number of trigrams and, per account, the number of
+        # uses and the ordinal of the last use's date
+        self._sizes: List[int] = []
+        self._uses: List[Dict[str, List[int]]] = []
+        self._postings: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, narration: str, account: str, day: date):
+        """Record that an account was used with a narration.
+
+        Args:
+            narration (:obj: str): The narration.
+            account (:obj: str): The account used with the narration.
+            day (:obj: datetime.date): The date of the use.
+        """
+        key = " ".join(_tokens(narration))
+        if not key:
+            return
+        id = self._ids.get(key)
+        if id is None:
+            id = self._ids[key] = len(self._sizes)
+            grams = _trigrams(key)
+            self._sizes.append(len(grams))
+            self._uses.append({})
+            for g in grams:
+                self._postings.setdefault(g, set()).add(id)
+        use = self._uses[id].setdefault(account, [0, 0])
+        use[0] += 1
+        use[1] = max(use[1], day.toordinal())
+
+    def suggest(self, narration: str, k: int = 3, today: Optional[date] = None) -> List[str]:
+        """Get the accounts most likely meant for a narration.
+
+        Args:
+            narration (:obj: str): The narration to find accounts for.
+            k (:obj: int): The maximum number of accounts to return.
+            today (:obj: datetime.date [optional]): The date to compute the recency of uses from.
+
+        Returns:
+            Up to k accounts, the most likely first.
+        """
+        grams = _trigrams(" ".join(_tokens(narration)))
+        if not grams or k <= 0:
+            return []
+        # A narration can only be similar enough if it shares at least one of the
+        # rarest trigrams of the query. Only those are used to find candidates, the
+        # common ones are only counted for the candidates found.
+        postings = sorted((self._postings.get(g, _EMPTY) for g in grams), key=len)
+        rare = len(grams) - math.ceil(MIN_SIMILARITY * len(grams)) + 1
+        shared: Counter = Counter()
+        for ids in postings[:rare]:
+            shared.update(ids)
+        for ids in postings[rare:]:
+            shared.update(ids.intersection(shared))
+        now = (today or date.today()).toordinal()
+        scores: Dict[str, float] = {}
+        for id, n in shared.most_common(CANDIDATES):
+            similarity = n / (len(grams) + self._sizes[id] - n)
+            if similarity < MIN_SIMILARITY:
+                continue
+            for account, (count, last) in self._uses[id].items():
+                recency = 0.5 ** (max(now - last, 0) / self.half_life)
+                weight = similarity * similarity * (1 + math.log(count)) * recency
+                scores[account] = scores.get(account, 0) + weight
+        return heapq.nlargest(k, scores, key=scores.__getitem__)
+
+
+def _tokens(narration: str) -> List[str]:
+    return _TOKEN_RE.findall(narration.lower())
+
+
+def _trigrams(key: str) -> Set[str]:
+    """Get the trigrams of each token, padded so that short tokens and the start and
+    end of tokens are represented."""
+    grams = set()
+    for token in key.split():
+        token = f"  {token} "
+        grams.update(token[i : i + 3] for i in range(len(token) - 2))
+    return grams
@@ -1,8 +1,25 @@
+import json
+import os
 import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
 from os import path
+from typing import Dict, List, Optional, Set
+from urllib.parse import quote, unquote, urlsplit
+from xml.etree import ElementTree
 
+import requests
 from webdav3.client import Client
 
+import metrics
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
 
 class Sync(object):
     """Sync is the class that syncs our beancount structure with some server. This is
@@ -10,15 +27,46 @@ class Sync(object):
 
     Attributes:
         path (:obj:`str`):  The local directory path to synchronize.
+        freshness (:obj:`float`): Seconds after a pull during which no further pull is done.
+        lock (:obj:`threading.RLock`): Held by callers while pulling, pushing or changing
+            the local files, so that only one operation runs on the repository at a time.
     """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, freshness: float = 0):
         self.os_path = path
+        self.freshness = freshness
+        self.lock = threading.RLock()
+        self._last_pull: Optional[float] = None
 
     def pull(self):
         """Download updated directory from server."""
         return
 
+    def changed(self) -> bool:
+        """Check cheaply whether the server has changes that haven't been pulled yet.
+        If the check is not possible, it's assumed that there are changes."""
+        return True
+
+    def _needs_pull(self) -> bool:
+        """Check whether a pull is necessary, i.e. the last pull isn't within the
+        freshness window and the server changed. If no pull is necessary, the
+        freshness window starts anew."""
+        now = time.monotonic()
+        if self._last_pull is not None and now - self._last_pull < self.freshness:
+            return False
+        try:
+            changed = self.changed()
+        except Exception as e:
+            getLogger("sync").warning(f"Can't check for changes, pulling: {e}")
+            changed = True
+        if not changed:
+            self._last_pull = now
+        return changed
+
+    def _pulled(self):
+        """Start the freshness window after a pull."""
+        self._last_pull = time.monotonic()
+
     def push(self, fname: str, msg=""):
         """Upload a file to the server. If the directory or file does not exist
         on the remote server, crete it.
@@ -28,6 +76,15 @@ class Sync(object):
             msg (:obj:`str`, optional): A message. When using git, this will be used as commit message."""
         return
 
+    def push_many(self, fnames: List[str], msg=""):
+        """Upload several files to the server, see :meth:`push`.
+
+        Args:
+            fnames (:obj:`List[str]`): Files to upload.
+            msg (:obj:`str`, optional): A message. When using git, this will be used as commit message."""
+        for fname in fnames:
+            self.push(fname, msg)
+
 
 class DavSync(Sync):
     """DavSync synchronizes the changes with a webdav server.
@@ -39,6 +96,11 @@ class DavSync(Sync):
         username (:obj:`str`): Webdav username.
         password (:obj:`str`): Webdav password.
         hostname (:obj:`str`): Webdav server host, e.g. https://cloud.example.com/
+        freshness (:obj:`float`): Seconds after a pull during which no further pull is done.
+        manifest_path (:obj:`str`, optional): File in which the ETags of the downloaded files and
+            the modification times and sizes of their local copies are stored. If set, pulls only
+            download the files that changed on either side since the last pull.
+        workers (:obj:`int`): Number of files downloaded in parallel.
     """
 
     def __init__(
@@ -49,12 +111,21 @@ class DavSync(Sync):
         username: str,
         password: str,
         hostname: str,
+        freshness: float = 0,
+        manifest_path: Optional[str] = None,
+        workers: int = 4,
     ):
-        super().__init__(path)
+        super().__init__(path, freshness)
+        self._remote_tag: Optional[tuple] = None
+        self._checked_tag: Optional[tuple] = None
+        # Files whose upload failed, the next pull restores them from the server
+        self._unpushed: Set[str] = set()
         self.dav_path = dav_path
         self.username = username
         self.password = password
         self.hostname = hostname
+        self.manifest_path = manifest_path
+        self.workers = max(workers, 1)
         options = {
             "webdav_hostname": hostname,
             "webdav_login": username,
@@ -62,11 +133,165 @@ class DavSync(Sync):
             "root": dav_root,
         }
         self.client = Client(options)
-        self.pull()
+        self.url = "/".join(
+            p.strip("/") for p in [hostname, dav_root, dav_path] if p.strip("/")
+        ) + "/"
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.workers
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def pull(self):
-        """Download updated directory from server."""
-        self.client.download_sync(self.dav_path, self.os_path)
+        """Download updated directory from server. The download is skipped if the
+        ETag and modification time of the remote directory didn't change, unless
+        uploads failed since the last pull or, with a manifest, local files changed."""
+        self._checked_tag = None
+        if not self._unpushed and not self._locally_changed() and not self._needs_pull():
+            return
+        # The check for changes already got the tag, unless it was skipped or failed
+        tag = self._checked_tag or self._tag()
+        if self.manifest_path:
+            self._pull_changed()
+        else:
+            self.client.download_sync(self.dav_path, self.os_path)
+            self._unpushed.clear()
+        self._remote_tag = tag
+        self._pulled()
+
+    def _pull_changed(self):
+        """Download the files whose ETag or modification time differ from the manifest,
+        whose local copy changed since it was downloaded or whose upload failed, in
+        parallel."""
+        manifest = self._load_manifest()
+        remote = self._propfind()
+        # Files that never reached the server can't be restored
+        self._unpushed &= set(remote)
+        changed = [
+            fname
+            for fname, tag in remote.items()
+            if manifest.get(fname, [])[:2] != tag
+            or manifest[fname][2:] != self._fingerprint(fname)
+            or fname in self._unpushed
+        ]
+        getLogger("sync").debug(f"{len(changed)} of {len(remote)} files changed")
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            for fname, error in zip(changed, pool.map(self._download, changed)):
+                if error:
+                    getLogger("sync").error(f"Can't download {fname}: {error}")
+                    remote.pop(fname)
+                else:
+                    self._unpushed.discard(fname)
+
+        # Keep the old entry of files that couldn't be downloaded, so they are retried
+        failed = [f for f in changed if f not in remote and f in manifest]
+        manifest = dict(
+            {f: manifest[f] for f in failed},
+            **{f: tag + self._fingerprint(f) for f, tag in remote.items()},
+        )
+        os.makedirs(path.dirname(self.manifest_path), exist_ok=True)  # type: ignore
+        tmp = self.manifest_path + ".tmp"  # type: ignore
+        with open(tmp, "w") as file:
+            json.dump(manifest, file)
+        os.replace(tmp, self.manifest_path)  # type: ignore
+
+    def _load_manifest(self) -> Dict[str, list]:
+        """Read the manifest.
+
+        Returns:
+            The ``[etag, modified, mtime, size]`` of each downloaded file, the last two
+            describing the local copy. Empty if there is no manifest yet.
+        """
+        try:
+            with open(self.manifest_path, "r") as file:  # type: ignore
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _fingerprint(self, fname: str) -> list:
+        """Get the modification time and size of a local file, or an empty list if it
+        doesn't exist."""
+        try:
+            stat = os.stat(path.join(self.os_path, fname))
+        except FileNotFoundError:
+            return []
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _locally_changed(self) -> bool:
+        """Check whether a local file differs from the copy recorded in the manifest.
+        Without a manifest, local changes can't be detected."""
+        if not self.manifest_path:
+            return False
+        manifest = self._load_manifest()
+        return any(entry[2:] != self._fingerprint(f) for f, entry in manifest.items())
+
+    def _propfind(self) -> Dict[str, list]:
+        """Get the ETag and modification time of all remote files with a single
+        depth-infinity PROPFIND. Servers that don't allow infinite depth are walked
+        directory by directory.
+
+        Returns:
+            The ``[etag, modified]`` of each file, keyed by its path relative to ``dav_path``.
+        """
+        files: Dict[str, list] = {}
+        dirs = [""]
+        depth = "infinity"
+        while dirs:
+            d = dirs.pop()
+            r = self.session.request(
+                "PROPFIND", self.url + quote(d), headers={"Depth": depth}
+            )
+            if r.status_code == 403 and depth == "infinity":
+                dirs, depth = [""], "1"
+                continue
+            r.raise_for_status()
+            prefix = unquote(urlsplit(self.url).path)
+            for resp in ElementTree.fromstring(r.content).iter("{DAV:}response"):
+                href = unquote(urlsplit(resp.findtext("{DAV:}href", "")).path)
+                fname = href[len(prefix) :] if href.startswith(prefix) else href
+                if resp.find(".//{DAV:}collection") is not None:
+                    if depth == "1" and fname.strip("/") != d.strip("/"):
+                        dirs.append(fname)
+                    continue
+                files[fname] = [
+                    resp.findtext(".//{DAV:}getetag"),
+                    resp.findtext(".//{DAV:}getlastmodified"),
+                ]
+        return files
+
+    def _download(self, fname: str) -> Optional[Exception]:
+        """Download a single file, replacing the local one atomically.
+
+        Returns:
+            The error if the download failed, otherwise None.
+        """
+        local = path.join(self.os_path, fname)
+        try:
+            r = self.session.get(self.url + quote(fname))
+            r.raise_for_status()
+            os.makedirs(path.dirname(local), exist_ok=True)
+            with open(local + ".part", "wb") as file:
+                file.write(r.content)
+            os.replace(local + ".part", local)
+        except Exception as e:
+            return e
+        return None
+
+    def changed(self) -> bool:
+        """Compare the ETag and modification time of the remote directory to the ones of
+        the last pull. Servers like Nextcloud propagate changes to the parent directories."""
+        if self._remote_tag is None:
+            return True
+        self._checked_tag = self._tag()
+        return self._checked_tag != self._remote_tag
+
+    def _tag(self) -> tuple:
+        """Get the ETag and modification time of the remote directory with a PROPFIND."""
+        info = self.client.info(self.dav_path)
+        return info.get("etag"), info.get("modified")
 
     def push(self, fname, msg=""):
         """Upload a file to the server. If the directory or file does not exist
@@ -76,26 +301,56 @@ class DavSync(Sync):
             fname (:obj:`str`): File to upload.
             msg (:obj:`str`, optional): Not used with DavSync.
         """
-        self.client.upload_file(
-            path.join(self.dav_path, fname), path.join(self.os_path, fname)
-        )
+        try:
+            self.client.upload_file(
+                path.join(self.dav_path, fname), path.join(self.os_path, fname)
+            )
+        except Exception:
+            self._unpushed.add(fname)
+            raise
+        self._unpushed.discard(fname)
 
 
 class GitSync(Sync):
-    """GitSync synchronizes the changes with a git server."""
+    """GitSync synchronizes the changes with a git server.
 
-    def __init__(
-        self,
-        path: str,
-    ):
-        super().__init__(path)
+    Attributes:
+        path (:obj:`str`): The local repository path.
+        freshness (:obj:`float`): Seconds after a pull during which no further pull is done.
+    """
+
+    def __init__(self, path: str, freshness: float = 0):
+        super().__init__(path, freshness)
         self.path = path
 
     def pull(self):
-        """Download updated directory from server."""
+        """Download updated directory from server. The pull is skipped if the remote
+        branch still points to the commit we know. Local changes are discarded either
+        way, callers don't pull while pushes are pending."""
+        if not self._needs_pull():
+            # Appends of failed pushes would be committed by the next push otherwise
+            if self._git("status", "--porcelain"):
+                self._reset()
+            return
+        self._reset()
+        subprocess.run(["git", "pull"], cwd=self.os_path, check=True)
+        self._pulled()
+
+    def _reset(self):
         subprocess.run(["git", "reset", "--hard"], cwd=self.os_path, check=True)
         subprocess.run(["git", "clean", "-fd"], cwd=self.os_path, check=True)
-        subprocess.run(["git", "pull"], cwd=self.os_path, check=True)
+
+    def changed(self) -> bool:
+        """Compare the remote branch's commit from ``git ls-remote`` to our remote-tracking branch."""
+        upstream = self._git("rev-parse", "--abbrev-ref", "--symbolic-full-name", "@{u}")
+        remote, branch = upstream.split("/", 1)
+        out = self._git("ls-remote", remote, f"refs/heads/{branch}")
+        return not out or out.split()[0] != self._git("rev-parse", "@{u}")
+
+    def _git(self, *args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=self.os_path, check=True, capture_output=True, text=True
+        ).stdout.strip()
 
     def push(self, fname, msg=""):
         """Upload a file to the server. If the directory or file does not exist
@@ -107,11 +362,314 @@ class GitSync(Sync):
         """
         if msg == "":
             msg = "bot"
-        print("comitting")
-        subprocess.run(
-            ["git", "commit", "--author", "beanbot <beanbot@lho.io>", "-am", msg],
-            cwd=self.os_path,
-            check=True,
+        # Nothing to commit if a previous push failed after committing
+        if subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=self.os_path).returncode:
+            getLogger("sync").debug("Committing")
+            subprocess.run(
+                ["git", "commit", "--author", "beanbot <beanbot@lho.io>", "-am", msg],
+                cwd=self.os_path,
+                check=True,
+            )
+        if subprocess.run(["git", "push"], cwd=self.os_path).returncode:
+            # The remote may have moved on while we were retrying, rebase on it
+            try:
+                subprocess.run(
+                    ["git", "pull", "--rebase"], cwd=self.os_path, check=True
+                )
+            except subprocess.CalledProcessError as e:
+                # Don't leave the repository mid-rebase, later pushes would fail forever
+                subprocess.run(["git", "rebase", "--abort"], cwd=self.os_path)
+                raise RuntimeError(
+                    "Can't rebase on the remote, the conflict must be resolved manually"
+                ) from e
+            subprocess.run(["git", "push"], cwd=self.os_path, check=True)
+
+    def push_many(self, fnames, msg=""):
+        """Commit several files at once and push them with a single push.
+
+        Args:
+            fnames (:obj:`List[str]`): Files to upload.
+            msg (:obj:`str`, optional): The commit message.
+        """
+        subprocess.run(["git", "add", "--", *fnames], cwd=self.os_path, check=True)
+        self.push(fnames[0] if fnames else "", msg)
+
+
+class PushWorker(object):
+    """PushWorker pushes files in the background. Files waiting to be pushed are kept
+    in an outbox on disk, so that they are still pushed after a restart. Failed pushes
+    are retried with exponential backoff.
+
+    Attributes:
+        synchronizer (:class:`Sync`): The synchronizer used to push.
+        outbox_path (:obj:`str`): The file in which the outbox is stored.
+        min_backoff (:obj:`float`): Seconds to wait after the first failed push.
+        max_backoff (:obj:`float`): Maximum seconds to wait between retries.
+    """
+
+    def __init__(
+        self,
+        synchronizer: Sync,
+        outbox_path: str,
+        min_backoff: float = 1.0,
+        max_backoff: float = 300.0,
+    ):
+        self.synchronizer = synchronizer
+        self.outbox_path = outbox_path
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._cond = threading.Condition()
+        self._outbox: List[Dict] = self._read()
+        self._futures: Dict[int, Future] = {}
+        self._seq = max([e["id"] for e in self._outbox], default=0)
+        threading.Thread(target=self._run, name="push", daemon=True).start()
+
+    def push(self, fnames: List[str], msg="") -> Future:
+        """Add files to the outbox.
+
+        Args:
+            fnames (:obj:`List[str]`): Files to upload.
+            msg (:obj:`str`, optional): A message. When using git, this will be used as commit message.
+
+        Returns:
+            A future that resolves once the files have been pushed.
+        """
+        future: Future = Future()
+        with self._cond:
+            self._seq += 1
+            self._outbox.append({"id": self._seq, "fnames": fnames, "msg": msg})
+            self._futures[self._seq] = future
+            self._write()
+            self._cond.notify()
+        return future
+
+    def pending(self) -> bool:
+        """Indicates whether files are waiting to be pushed. While they are, the local
+        directory is ahead of the server and must not be overwritten by a pull."""
+        with self._cond:
+            return bool(self._outbox)
+
+    def _run(self):
+        backoff = self.min_backoff
+        while True:
+            with self._cond:
+                while not self._outbox:
+                    self._cond.wait()
+                batch = list(self._outbox)
+
+            fnames = sorted(set(f for e in batch for f in e["fnames"]))
+            msg = "\n".join(e["msg"] for e in batch if e["msg"])
+            try:
+                with self.synchronizer.lock, metrics.registry.timer("sync.push"):
+                    self.synchronizer.push_many(fnames, msg)
+            except Exception as e:
+                getLogger("sync").warning(f"Push failed, retrying in {backoff}s: {e}")
+                # Not on the condition, new pushes notify it and would cut the backoff short
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.min_backoff
+
+            with self._cond:
+                del self._outbox[: len(batch)]
+                self._write()
+                futures = [self._futures.pop(e["id"], None) for e in batch]
+            for future in futures:
+                if future:
+                    future.set_result(None)
+
+    def _read(self) -> List[Dict]:
+        try:
+            with open(self.outbox_path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return []
+
+    def _write(self):
+        """Write the outbox atomically by replacing it with a temporary file."""
+        tmp = self.outbox_path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(self._outbox, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.outbox_path)
+
+
+class PyGitSync(Sync):
+    """PyGitSync synchronizes the changes with a git server like :class:`GitSync`, but
+    keeps the repository open in process through libgit2 (pygit2) instead of running
+    ``git`` commands. Pulls fetch only the tracked branch and fast-forward by checking
+    out the files that changed, pushes stage and commit only the touched files.
+
+    Attributes:
+        path (:obj:`str`): The local repository path.
+        freshness (:obj:`float`): Seconds after a pull during which no further pull is done.
+        ssh_key (:obj:`str`, optional): Path to the private SSH key used to authenticate. If
+            not set, the SSH agent is used.
+        ssh_pubkey (:obj:`str`, optional): Path to the public SSH key, defaults to ``ssh_key`` + ``.pub``.
+        ssh_passphrase (:obj:`str`, optional): The private key's passphrase.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        freshness: float = 0,
+        ssh_key: Optional[str] = None,
+        ssh_pubkey: Optional[str] = None,
+        ssh_passphrase: str = "",
+    ):
+        if pygit2 is None:
+            raise ImportError("PyGitSync requires pygit2 (pip install pygit2)")
+        super().__init__(path, freshness)
+        self.path = path
+        self.ssh_key = ssh_key
+        self.ssh_pubkey = ssh_pubkey or (ssh_key + ".pub" if ssh_key else None)
+        self.ssh_passphrase = ssh_passphrase
+        self.repo = pygit2.Repository(path)
+        branch = self.repo.branches.local[self.repo.head.shorthand]
+        self.branch = branch.branch_name
+        self.upstream = branch.upstream_name  # e.g. refs/remotes/origin/main
+        self.remote_name = self.repo.config[f"branch.{self.branch}.remote"]
+        self.merge_ref = self.repo.config[f"branch.{self.branch}.merge"]
+        self.signature = pygit2.Signature("beanbot", "beanbot@lho.io")
+
+    def pull(self):
+        """Fetch the tracked branch and fast-forward or merge it. Only the files that
+        differ between the commits are checked out. Uncommitted local changes are
+        discarded even if the pull is skipped, callers don't pull while pushes are pending."""
+        if not self._needs_pull():
+            # Appends of failed pushes would be committed by the next push otherwise
+            if self.repo.status():
+                self._reset()
+            return
+        self._remote().fetch(
+            [f"+{self.merge_ref}:{self.upstream}"], callbacks=self._callbacks()
         )
-        print("committed")
-        subprocess.run(["git", "push"], cwd=self.os_path, check=True)
+        self._merge()
+        self._pulled()
+
+    def changed(self) -> bool:
+        """Compare the remote branch's commit to our remote-tracking branch."""
+        for head in self._remote().list_heads(callbacks=self._callbacks()):
+            if head.name == self.merge_ref:
+                return head.oid != self.repo.references[self.upstream].target
+        return True
+
+    def push(self, fname, msg=""):
+        """Commit a file and push it.
+
+        Args:
+            fname (:obj:`str`): File to upload.
+            msg (:obj:`str`, optional): The commit message.
+        """
+        self.push_many([fname], msg)
+
+    def push_many(self, fnames, msg=""):
+        """Commit several files at once and push them with a single push. If the push
+        is rejected because the remote moved on, the remote branch is merged and the
+        push retried once.
+
+        Args:
+            fnames (:obj:`List[str]`): Files to upload.
+            msg (:obj:`str`, optional): The commit message.
+        """
+        index = self.repo.index
+        for fname in fnames:
+            index.add(fname)
+        index.write()
+        tree = index.write_tree()
+        head = self.repo.head.peel(pygit2.Commit)
+        # Nothing to commit if a previous push failed after committing
+        if tree != head.tree_id:
+            self.repo.create_commit(
+                "HEAD", self.signature, self.signature, msg or "bot", tree, [head.id]
+            )
+        spec = [f"refs/heads/{self.branch}:{self.merge_ref}"]
+        try:
+            self._remote().push(spec, callbacks=self._callbacks())
+        except pygit2.GitError:
+            self._remote().fetch(
+                [f"+{self.merge_ref}:{self.upstream}"], callbacks=self._callbacks()
+            )
+            self._merge()
+            self._remote().push(spec, callbacks=self._callbacks())
+
+    def _reset(self):
+        """Reset the working tree to HEAD and remove untracked files, like
+        ``git reset --hard`` followed by ``git clean -fd``."""
+        self.repo.reset(self.repo.head.target, pygit2.enums.ResetMode.HARD)
+        for fname, flags in self.repo.status().items():
+            if flags & pygit2.enums.FileStatus.WT_NEW:
+                os.remove(path.join(self.os_path, fname))
+                parent = path.dirname(fname)
+                if parent:
+                    # Removes the directories that became empty, up to the first that isn't
+                    try:
+                        os.removedirs(path.join(self.os_path, parent))
+                    except OSError:
+                        pass
+
+    def _merge(self):
+        """Bring the local branch up to date with the remote-tracking branch.
+
+        Raises:
+            pygit2.GitError: The branches can't be merged without conflicts.
+        """
+        target = self.repo.references[self.upstream].target
+        analysis, _ = self.repo.merge_analysis(target)
+        if analysis & pygit2.enums.MergeAnalysis.UP_TO_DATE:
+            return
+        if analysis & pygit2.enums.MergeAnalysis.FASTFORWARD:
+            # A safe checkout only touches files that differ between the two trees,
+            # local changes to those files are overwritten like a hard reset would
+            try:
+                self.repo.checkout_tree(self.repo[target])
+            except pygit2.GitError:
+                self.repo.checkout_tree(
+                    self.repo[target], strategy=pygit2.enums.CheckoutStrategy.FORCE
+                )
+            self.repo.references[f"refs/heads/{self.branch}"].set_target(target)
+            return
+
+        self.repo.merge(target)
+        if self.repo.index.conflicts is not None:
+            self.repo.state_cleanup()
+            self.repo.reset(self.repo.head.target, pygit2.enums.ResetMode.HARD)
+            raise pygit2.GitError(f"Can't merge {self.upstream}: conflicts")
+        tree = self.repo.index.write_tree()
+        self.repo.create_commit(
+            "HEAD",
+            self.signature,
+            self.signature,
+            f"Merge {self.upstream}",
+            tree,
+            [self.repo.head.target, target],
+        )
+        self.repo.state_cleanup()
+
+    def _remote(self):
+        """Get the remote. Remote objects cache the refs advertised by the server,
+        so a new one is needed for every operation."""
+        return self.repo.remotes[self.remote_name]
+
+    def _callbacks(self):
+        """Get the callbacks providing the SSH credentials."""
+        url = self._remote().url or ""
+        # Either ssh://user@host/repo or user@host:repo
+        user = urlsplit(url).username or (url.split("@")[0] if "@" in url else "git")
+        if self.ssh_key:
+            creds = pygit2.Keypair(user, self.ssh_pubkey, self.ssh_key, self.ssh_passphrase)
+        else:
+            creds = pygit2.KeypairFromAgent(user)
+        return _Callbacks(credentials=creds)
+
+
+if pygit2 is not None:
+
+    class _Callbacks(pygit2.RemoteCallbacks):
+        """Remote callbacks that fail pushes the server rejected. libgit2 only reports
+        rejected refs to this callback, the push itself succeeds."""
+
+        def push_update_reference(self, refname: str, message: Optional[str]):
+            if message is not None:
+                raise pygit2.GitError(f"Push of {refname} rejected: {message}")